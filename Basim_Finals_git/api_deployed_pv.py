@@ -1,137 +1,799 @@
-from flask import Flask, request, jsonify
-from ultralytics import YOLO
+from flask import Flask, Request, copy_current_request_context, g, request, jsonify, stream_with_context, url_for
+from werkzeug.exceptions import BadRequest, HTTPException, RequestEntityTooLarge
 from collections import Counter
-import cv2
+import hmac
+import io
+import itertools
+import json
+import math
 import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+
+from backends import load_backend
+from batch_scan import ARCHIVE_TYPES, check_archive, is_archive, is_image_name, iter_archive, oversized, scan_images
+from batch_scheduler import BatchScheduler
+from detection import parse_class_thresholds
+from inference_pool import InferencePool
+from frame_sampler import FrameSampler, av
+from image_io import ALLOWED_IMAGE_TYPES, MAX_IMAGE_BYTES, decode_image_stream, upload_content_key
+from jobs import JOB_QUEUED, JobRunner, JobStore
+from metrics import CONTENT_TYPE, REGISTRY, RequestProfiler, stage_timer
+from model_registry import ModelRegistry, ModelReplacedError
+from result_cache import ResultCache
+from tiling import TILE_MODES, infer_image
+from tracking import DEFAULT_DELTA_THRESHOLD, track_video
+from upload_stream import STREAMABLE_CONTAINERS, SpooledVideoUpload
+from video_classifier import classify_video
+from video_pipeline import process_video_pipelined
+
+
+class ImageBuffer(io.BytesIO):
+    """In-memory upload part that stops storing data once it grows past `limit` bytes."""
+
+    def __init__(self, limit=MAX_IMAGE_BYTES):
+        super().__init__()
+        self.limit = limit
+        self.size = 0
+
+    @property
+    def oversized(self):
+        return self.size > self.limit
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.limit:
+            # Keep counting, but drop what was kept; the part is reported instead of decoded
+            self.seek(0)
+            self.truncate()
+            return len(data)
+        return super().write(data)
+
+
+class UploadRequest(Request):
+    """
+    Request that keeps uploaded images in memory and streams uploaded videos
+    into a uniquely named spool file as the multipart body is parsed.
+    """
+
+    video_upload = None
+    spool_videos = False
+
+    # Per-endpoint body limit; unlike a Content-Length check it also stops chunked bodies
+    body_limit = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.video_upload_started = threading.Event()
+
+    @property
+    def max_content_length(self):
+        if self.body_limit is not None:
+            return self.body_limit
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Images stay in memory, each one capped at MAX_IMAGE_BYTES
+        if content_type in ALLOWED_IMAGE_TYPES or is_image_name(filename or ''):
+            return ImageBuffer()
+        # Only the first file part is spooled; anything after it is buffered by Werkzeug
+        # as usual and rejected once the form is parsed
+        if self.spool_videos and self.video_upload is None:
+            self.video_upload = SpooledVideoUpload()
+            self.video_upload_started.set()
+            return self.video_upload
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
 
 # Initialize Flask app
 app = Flask(__name__)
+app.request_class = UploadRequest
+
+# Prometheus metrics served on /metrics, next to the per-stage timings
+REQUEST_SECONDS = REGISTRY.histogram(
+    "wm_request_seconds", "Request latency by endpoint and status.", ["endpoint", "status"]
+)
+REQUESTS_IN_FLIGHT = REGISTRY.gauge("wm_requests_in_flight", "Requests being handled.", ["endpoint"])
+MODEL_LOAD_SECONDS = REGISTRY.gauge("wm_model_load_seconds", "Time taken by the last model load.")
+
+# PROFILE_SAMPLE_RATE > 0 writes a cProfile dump of that fraction of requests to PROFILE_DIR
+profiler = RequestProfiler(
+    sample_rate=float(os.environ.get("PROFILE_SAMPLE_RATE", 0)),
+    output_dir=os.environ.get("PROFILE_DIR", "profiles"),
+)
+
+# The YOLO model; MODEL_BACKEND picks torch, onnx or openvino
+MODEL_PATH = os.environ.get("MODEL_PATH", "mark.pt")  # Replace "mark.pt" with your model's path
+
+# INFERENCE_WORKERS > 0 runs the model in that many worker processes (see serve.py);
+# INFERENCE_TIMEOUT bounds how long a request waits for a worker
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 0))
+
+# MODEL_LOADING: "lazy" loads on the first request or /ready probe (cheap imports for tools and tests),
+# "background" starts loading at import while /ready reports progress, "eager" blocks the import
+MODEL_LOADING = os.environ.get("MODEL_LOADING", "lazy")
+
+# Set to enable POST /reload_model (sent in the X-Admin-Token header)
+MODEL_ADMIN_TOKEN = os.environ.get("MODEL_ADMIN_TOKEN")
+
+
+def load_model(weights_path):
+    if INFERENCE_WORKERS > 0:
+        return InferencePool(
+            num_workers=INFERENCE_WORKERS,
+            backend=os.environ.get("MODEL_BACKEND"),
+            weights_path=weights_path,
+            threads_per_worker=int(os.environ.get("THREADS_PER_WORKER", 0)) or None,
+            pin_cpus=os.environ.get("PIN_WORKERS", "0") == "1",
+            task_timeout=float(os.environ.get("INFERENCE_TIMEOUT", 300)),
+        )
+    return load_backend(os.environ.get("MODEL_BACKEND"), weights_path)
+
+
+def on_model_load(registry, load_seconds):
+    # Results of the previous weights must not be served for the new ones
+    MODEL_LOAD_SECONDS.set(load_seconds)
+    result_cache.weights_path = registry.weights_path
+    result_cache.set_model_fingerprint(registry.fingerprint)
+
+
+# Warmed up on WARMUP_RUNS passes of dummy 640x640 batches of each WARMUP_BATCH_SIZES size;
+# `model.engine` holds the thresholding and counting for the loaded model's classes
+model = ModelRegistry(
+    load_model,
+    MODEL_PATH,
+    warmup_runs=int(os.environ.get("WARMUP_RUNS", 1)),
+    warmup_batch_sizes=[int(n) for n in os.environ.get("WARMUP_BATCH_SIZES", "1").split(",") if n],
+    on_load=on_model_load,
+)
+
+# Coalesce concurrent requests into batched forward passes
+scheduler = BatchScheduler(
+    model,
+    max_batch_size=int(os.environ.get("BATCH_MAX_SIZE", 16)),
+    max_wait_ms=float(os.environ.get("BATCH_MAX_WAIT_MS", 10)),
+    # One batch in flight per worker process; a single in-process model runs one at a time
+    num_dispatchers=max(1, INFERENCE_WORKERS),
+)
+
+# Large screenshots can be cut into overlapping model-sized tiles: off, on or auto.
+# Off by default: "auto" tiles any image with a side of 1280px or more (e.g. 1920x1080),
+# costing several model passes per image and usually finding more small symbols, so
+# latency and class counts change. Opt in per request with ?tile=auto or globally here.
+TILE_MODE = os.environ.get("TILE_MODE", "off")
+TILE_OVERLAP = float(os.environ.get("TILE_OVERLAP", 0.25))
+
+# /detect_batch: largest upload (multipart files or one zip/tar archive), images per
+# inference call and decoding threads per request
+MAX_BATCH_BYTES = int(os.environ.get("MAX_BATCH_BYTES", 1 << 30))
+SCAN_BATCH_SIZE = int(os.environ.get("SCAN_BATCH_SIZE", 16))
+SCAN_DECODE_WORKERS = int(os.environ.get("SCAN_DECODE_WORKERS", 4))
+
+# Frames per inference call and inference workers for each video
+VIDEO_BATCH_SIZE = int(os.environ.get("VIDEO_BATCH_SIZE", 8))
+VIDEO_WORKERS = int(os.environ.get("VIDEO_WORKERS", 2))
+
+# Frames a class must be seen on before mode=classify stops scanning
+CLASSIFY_MIN_HITS = int(os.environ.get("CLASSIFY_MIN_HITS", 3))
+
+# mode=track: frames changing less than this (mean abs difference, 0-1) reuse the last detections
+TRACK_DELTA_THRESHOLD = float(os.environ.get("TRACK_DELTA_THRESHOLD", DEFAULT_DELTA_THRESHOLD))
+VIDEO_MODES = ("count", "classify", "track")
+
+# Detection results keyed by image content; cleared when the weights file changes
+result_cache = ResultCache(
+    max_entries=int(os.environ.get("RESULT_CACHE_SIZE", 4096)),
+    ttl_seconds=float(os.environ.get("RESULT_CACHE_TTL", 3600)),
+    perceptual=os.environ.get("RESULT_CACHE_PERCEPTUAL", "0") == "1",
+    weights_path=MODEL_PATH,
+)
+
+# Background video jobs, persisted so results survive a restart; the server entry
+# points call job_store.recover() to fail the jobs of processes that died
+job_store = JobStore(os.environ.get("JOBS_DB", "jobs.sqlite3"))
+job_runner = JobRunner(job_store, max_workers=int(os.environ.get("JOB_WORKERS", 2)))
+
+# Spawned inference workers re-import this module as __mp_main__ when it is run as a
+# script; only the server process may load the model (and so start workers)
+if __name__ != "__mp_main__":
+    if MODEL_LOADING == "eager":
+        model.load()
+    elif MODEL_LOADING == "background":
+        model.start_loading()
+
+
+def detection_options(values):
+    """
+    Read per-request thresholds and output options.
+
+    Args:
+        values: Request parameters (query string or form).
+
+    Returns:
+        (conf_threshold, class_thresholds, return_boxes)
+
+    Raises:
+        ValueError: If a threshold is malformed or names an unknown class.
+    """
+    conf_threshold = values.get('conf')
+    if conf_threshold is not None:
+        conf_threshold = float(conf_threshold)
+        if not 0.0 <= conf_threshold <= 1.0:
+            raise ValueError("conf must be between 0 and 1")
+    class_thresholds = parse_class_thresholds(values.get('class_conf'), model.names)
+    return_boxes = values.get('boxes', '').lower() in ('1', 'true', 'yes')
+    return conf_threshold, class_thresholds, return_boxes
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc(endpoint=request.endpoint or "unknown")
+    g.profile = profiler.start()
+
+
+@app.after_request
+def record_request_metrics(response):
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - g.request_started,
+        endpoint=request.endpoint or "unknown", status=response.status_code,
+    )
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exc=None):
+    # Runs even when the handler raised, so the in-flight gauge never drifts
+    if 'request_started' in g:
+        REQUESTS_IN_FLIGHT.dec(endpoint=request.endpoint or "unknown")
+        profiler.stop(g.profile, request.path)
 
-# Load the YOLO model once
-model = YOLO("mark.pt")  # Replace "mark.pt" with your model's path
 
 @app.route('/detect', methods=['POST'])
 def detect_objects():
-    # Check if an image is uploaded
-    if 'image' not in request.files:
-        return jsonify({'error': 'No image file uploaded'}), 400
+    # Reject oversized bodies before the multipart form is parsed; bodies without a
+    # Content-Length are cut off once they pass the limit
+    if request.content_length is not None and request.content_length > MAX_IMAGE_BYTES:
+        return jsonify({'error': f'Image exceeds {MAX_IMAGE_BYTES} bytes'}), 413
+    request.body_limit = MAX_IMAGE_BYTES
 
-    image_file = request.files['image']
+    # Check if an image is uploaded; parsing the form reads the whole body
+    try:
+        with stage_timer("upload"):
+            files = request.files
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'Image exceeds {MAX_IMAGE_BYTES} bytes'}), 413
+    if 'image' not in files:
+        return jsonify({'error': 'No image file uploaded'}), 400
 
-    # Save the image to a temporary location
-    image_path = "temp_image.jpg"
-    image_file.save(image_path)
+    # The part's Content-Type is not checked: clients often send none or
+    # application/octet-stream, and decoding rejects anything that is not an image
+    image_file = files['image']
 
+    # Optional conf, class_conf, boxes and tile parameters
     try:
-        # Predict with YOLO model
-        results = model(image_path)
-        result = results[0]  # Extract the first Results object
-
-        # Process the boxes
-        boxes = result.boxes
-        if boxes is not None:
-            # Extract class indices and confidence scores
-            class_indices = boxes.cls.cpu().numpy()
-            confidences = boxes.conf.cpu().numpy()
-
-            # Filter classes with confidence >= 50%
-            valid_detections = [
-                (int(cls), float(conf))  # Convert to standard Python types
-                for cls, conf in zip(class_indices, confidences) if conf >= 0.5
-            ]
-
-            # Count classes
-            class_names = result.names
-            filtered_counts = Counter([cls for cls, _ in valid_detections])
-
-            # Prepare the response
-            response = {
-                "class_counts": {class_names[cls]: count for cls, count in filtered_counts.items()},
-                #"confidences": [
-                #    {"class": class_names[cls], "confidence": round(conf, 2)}
-                #    for cls, conf in valid_detections
-                #]
-            }
-        else:
-            response = {"class_counts": {}}
+        conf_threshold, class_thresholds, return_boxes = detection_options(request.values)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    tile_mode = request.values.get('tile', TILE_MODE).lower()
+    if tile_mode not in TILE_MODES:
+        return jsonify({'error': f'tile must be one of {", ".join(TILE_MODES)}'}), 400
+
+    with stage_timer("cache"):
+        key = f"{upload_content_key(image_file.stream)}:{tile_mode}"
+    # Near-duplicates only match results of the same tiling; whole-frame results are
+    # shared with video frames, which are never tiled
+    phash_scope = None if tile_mode == "off" else tile_mode
+
+    image = None
+    # The engine's class map must belong to the model that produced `raw`; if a hot
+    # swap lands in between, the detections are fetched again from the new model
+    for _ in range(3):
+        engine, generation = model.current()
+        fingerprint = result_cache.fingerprint
+
+        # The same screenshot uploaded again skips both decoding and inference
+        with stage_timer("cache"):
+            raw = result_cache.get(key)
+
+        if raw is None:
+            if image is None:
+                # Decode straight from the upload buffer, no temporary file involved
+                with stage_timer("decode"):
+                    image = decode_image_stream(image_file.stream)
+                if image is None:
+                    return jsonify({'error': 'Uploaded file is not a readable image'}), 400
+
+            with stage_timer("cache"):
+                raw = result_cache.get_similar(image, namespace=phash_scope)
+            if raw is None:
+                # Predict with YOLO model, batched together with other in-flight requests;
+                # the tiles of a large screenshot are queued together as one batch.
+                # Includes the batching wait; the backend records preprocess/model/postprocess.
+                with stage_timer("inference"):
+                    raw = infer_image(scheduler.infer_many, image, tile_mode, overlap=TILE_OVERLAP)
+                result_cache.put(key, raw, image=image, fingerprint=fingerprint, namespace=phash_scope)
+
+        if model.generation == generation:
+            break
+
+    # Threshold, count and (optionally) list boxes in one vectorised pass
+    with stage_timer("summarize"):
+        response = engine.summarize(raw, conf_threshold, class_thresholds, return_boxes)
 
+    with stage_timer("serialize"):
         return jsonify(response)
 
-    finally:
-        # Clean up the temporary image
-        if os.path.exists(image_path):
-            os.remove(image_path)
+
+def pinned_inference():
+    """
+    The engine of the model serving now, with an infer_batch for a long run that reads it once.
+
+    Every batch still goes to the newest model, so after a swap to weights with
+    other classes the batch fails with ModelReplacedError instead of having the
+    new model's class ids read through the old class map.
+    """
+    engine, _ = model.current()
+
+    def infer_batch(images):
+        results = scheduler.infer_many(images)
+        model.check_engine(engine)
+        return results
+
+    return engine, infer_batch
+
+
+def checked_results(results, engine):
+    """Pass a long run's results through, failing once a swap has changed the class map under it."""
+    try:
+        for result in results:
+            # Cache hits skip infer_batch, and may come from the replacement model
+            model.check_engine(engine)
+            yield result
+    except Exception:
+        # e.g. class ids the old engine does not know; the swap is the better explanation
+        model.check_engine(engine)
+        raise
+
+
+def batch_sources():
+    """
+    Collect the images of a /detect_batch request as (name, read) pairs.
+
+    Accepts a multipart form with any number of image files and/or zip/tar
+    archives, or a raw zip/tar body. Archive members are listed lazily.
+
+    Uploaded archives are detached from the request, which closes its files
+    when the view returns while the results are still streaming; the caller
+    closes the returned streams once it is done.
+
+    Returns:
+        (sources, streams): an iterable of (name, read) pairs (None if the request
+        carries no images) and the file objects to close afterwards.
+
+    Raises:
+        ValueError: If an uploaded archive is not a zip or tar archive.
+        RequestEntityTooLarge: If the body grows past the request's limit.
+    """
+    sources, streams = [], []
+    try:
+        if request.mimetype == 'multipart/form-data':
+            for key in request.files:
+                for upload in request.files.getlist(key):
+                    if is_archive(upload.filename, upload.mimetype):
+                        stream, upload.stream = upload.stream, io.BytesIO()
+                        streams.append(stream)
+                        check_archive(stream)
+                        sources.append(iter_archive(stream))
+                    elif getattr(upload.stream, 'oversized', False):
+                        sources.append([(upload.filename, oversized(upload.filename, upload.stream.size))])
+                    elif upload.mimetype in ALLOWED_IMAGE_TYPES or is_image_name(upload.filename or ''):
+                        sources.append([(upload.filename, lambda data=upload.read(): data)])
+        elif request.mimetype in ARCHIVE_TYPES:
+            # Zip needs random access, so the raw body is spooled (to disk once large)
+            body = tempfile.SpooledTemporaryFile(max_size=32 << 20)
+            streams.append(body)
+            shutil.copyfileobj(request.stream, body, 1 << 20)
+            body.seek(0)
+            check_archive(body)
+            sources.append(iter_archive(body))
+    except Exception:
+        for stream in streams:
+            stream.close()
+        raise
+    return (itertools.chain.from_iterable(sources) if sources else None), streams
+
+
+@app.route('/detect_batch', methods=['POST'])
+def detect_batch():
+    # Many screenshots in one request; one NDJSON line per image is streamed back as
+    # soon as it is done, then a final {"summary": ...} line
+    if request.content_length is not None and request.content_length > MAX_BATCH_BYTES:
+        return jsonify({'error': f'Upload exceeds {MAX_BATCH_BYTES} bytes'}), 413
+    request.body_limit = MAX_BATCH_BYTES
+
+    try:
+        conf_threshold, class_thresholds, return_boxes = detection_options(request.args)
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    tile_mode = request.args.get('tile', TILE_MODE).lower()
+    if tile_mode not in TILE_MODES:
+        return jsonify({'error': f'tile must be one of {", ".join(TILE_MODES)}'}), 400
+
+    try:
+        with stage_timer("upload"):
+            sources, streams = batch_sources()
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'Upload exceeds {MAX_BATCH_BYTES} bytes'}), 413
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
+    if sources is None:
+        return jsonify({'error': 'No images or archive uploaded'}), 400
+
+    engine, infer_batch = pinned_inference()
+
+    def generate():
+        totals = Counter()
+        files = errors = 0
+        try:
+            for result in checked_results(scan_images(
+                sources,
+                infer_batch,
+                engine,
+                batch_size=SCAN_BATCH_SIZE,
+                decode_workers=SCAN_DECODE_WORKERS,
+                tile_mode=tile_mode,
+                overlap=TILE_OVERLAP,
+                conf_threshold=conf_threshold,
+                class_thresholds=class_thresholds,
+                return_boxes=return_boxes,
+                cache=result_cache,
+            ), engine):
+                files += 1
+                if 'error' in result:
+                    errors += 1
+                else:
+                    totals.update(result['class_counts'])
+                yield json.dumps(result) + '\n'
+        except (ValueError, tarfile.TarError, zipfile.BadZipFile, ModelReplacedError) as exc:
+            # An archive that breaks off or holds too many images, or a model swap to other
+            # classes, ends the stream with an error line
+            yield json.dumps({'error': str(exc)}) + '\n'
+        finally:
+            for stream in streams:
+                stream.close()
+        yield json.dumps({'summary': {'files': files, 'errors': errors, 'class_counts': dict(totals)}}) + '\n'
+
+    return app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def start_video_upload():
+    """
+    Start spooling the uploaded video on a background thread.
+
+    Accepts either a raw body (Content-Type: video/* or application/octet-stream)
+    or a multipart form with a `video` file part.
+
+    Returns:
+        (upload, thread) once the spool file exists, or (None, thread) if the
+        request carries no video; (None, None) for an unsupported body.
+    """
+    req = request._get_current_object()
+
+    if req.mimetype.startswith('video/') or req.mimetype == 'application/octet-stream':
+        upload = SpooledVideoUpload()
+
+        def spool():
+            upload.copy_from(req.stream)
+    elif req.mimetype == 'multipart/form-data':
+        upload = None
+        req.spool_videos = True
+
+        def spool():
+            try:
+                # Werkzeug writes the file part into req.video_upload while parsing
+                req.files
+            except Exception as exc:
+                if req.video_upload is not None:
+                    req.video_upload.fail(exc)
+            else:
+                if req.video_upload is not None:
+                    # The spooled part must be the `video` field and the only file
+                    parts = sum(len(req.files.getlist(key)) for key in req.files)
+                    if parts != 1 or req.files.get('video') is None or req.files['video'].stream is not req.video_upload:
+                        req.video_upload.fail(BadRequest("Upload exactly one file, in the video field"))
+                    else:
+                        req.video_upload.finish()
+            finally:
+                req.video_upload_started.set()
+    else:
+        return None, None
+
+    thread = threading.Thread(target=copy_current_request_context(spool), daemon=True)
+    thread.start()
+    if upload is None:
+        req.video_upload_started.wait()
+        upload = req.video_upload
+    return upload, thread
+
+
+def analyze_video(source, sampler, conf_threshold=None, class_thresholds=None, on_progress=None,
+                  classify_hits=None, track_delta=None):
+    """
+    Run a video through the decode/inference pipeline and build the response.
+
+    Args:
+        source: Video path, or a reader over an upload still in flight.
+        sampler (FrameSampler): Which frames to run the model on.
+        conf_threshold (float): Optional request-level confidence threshold.
+        class_thresholds (dict): Optional class index -> threshold overrides.
+        on_progress: Optional callback(frames_processed, class_counts by name).
+        classify_hits (int): If set, only find the watermark class, stopping once
+            it has been seen on this many frames (`source` must be a path).
+        track_delta (float): If set, count unique watermark instances by tracking
+            them across frames, skipping detection on frames that change less than this.
+
+    Returns:
+        The /process_video response dictionary.
+
+    Raises:
+        ModelReplacedError: If a swap changed the model's classes during the run.
+    """
+    engine, infer_batch = pinned_inference()
+    try:
+        response = _video_response(
+            engine, infer_batch, source, sampler, conf_threshold, class_thresholds, on_progress,
+            classify_hits, track_delta,
+        )
+    except Exception:
+        # e.g. class ids the old engine does not know; the swap is the better explanation
+        model.check_engine(engine)
+        raise
+    # Cache hits skip infer_batch, and may come from the replacement model
+    model.check_engine(engine)
+    return response
+
+
+def _video_response(engine, infer_batch, source, sampler, conf_threshold, class_thresholds, on_progress,
+                    classify_hits, track_delta):
+    # analyze_video against one engine
+    progress = None
+    if on_progress is not None:
+        progress = lambda frames, counts: on_progress(frames, engine.named_counts(counts))
+
+    if classify_hits is not None:
+        # Coarse-to-fine seeking with early exit instead of a full scan
+        return classify_video(
+            source,
+            infer_batch,
+            engine,
+            interval_seconds=sampler.interval_seconds,
+            min_hits=classify_hits,
+            conf_threshold=conf_threshold,
+            class_thresholds=class_thresholds,
+            on_progress=progress,
+            cache=result_cache,
+        )
+
+    if track_delta is not None:
+        summary = track_video(
+            source,
+            infer_batch,
+            engine,
+            sampler=sampler,
+            batch_size=VIDEO_BATCH_SIZE,
+            delta_threshold=track_delta,
+            conf_threshold=conf_threshold,
+            class_thresholds=class_thresholds,
+            on_progress=progress,
+            cache=result_cache,
+        )
+        return {
+            "class_counts": engine.named_counts(summary["class_counts"]),
+            "instances": [
+                {
+                    "class": engine.class_names[track.class_id],
+                    "first_seen": round(track.first_seen, 3),
+                    "last_seen": round(track.last_seen, 3),
+                    "confidence": round(track.confidence, 4),
+                    "box": [round(float(v), 1) for v in track.box],
+                }
+                for track in summary["tracks"]
+            ],
+            "frames_processed": summary["frames_processed"],
+            "frames_detected": summary["frames_detected"],
+        }
+
+    # Decoding, batched inference and counting run as overlapping stages
+    summary = process_video_pipelined(
+        source,
+        infer_batch,
+        engine,
+        sampler=sampler,
+        batch_size=VIDEO_BATCH_SIZE,
+        num_workers=VIDEO_WORKERS,
+        conf_threshold=conf_threshold,
+        class_thresholds=class_thresholds,
+        on_progress=progress,
+        cache=result_cache,
+    )
+
+    # Aggregate results
+    class_counts = summary["class_counts"]
+    if class_counts:
+        return {"class_counts": engine.named_counts(class_counts)}
+    return {"message": f"No objects detected with {engine.describe_thresholds(conf_threshold, class_thresholds)}."}
 
 
 @app.route('/process_video', methods=['POST'])
 def process_video():
-    # Check if a video file is uploaded
-    if 'video' not in request.files:
-        return jsonify({'error': 'No video file uploaded'}), 400
+    # ?async=1 returns a job id at once instead of holding the connection open
+    return handle_video_upload(run_async=request.args.get('async', '').lower() in ('1', 'true', 'yes'))
+
 
-    video_file = request.files['video']
-    video_path = "temp_video.mp4"
-    video_file.save(video_path)
+@app.route('/jobs', methods=['POST'])
+def submit_video_job():
+    return handle_video_upload(run_async=True)
 
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    # Progress (frames processed, partial class_counts) and, once done, the result
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown job: {job_id}'}), 404
+    return jsonify(job)
+
+
+def handle_video_upload(run_async=False):
+    # Sampling: interval (every N seconds), scene (on content change) or keyframes.
+    # Options come from the query string so they are known before the body arrives.
     try:
-        cap = cv2.VideoCapture(video_path)
-        frame_rate = int(cap.get(cv2.CAP_PROP_FPS))  # Get the frame rate of the video
-        frame_count = 0
-        all_detections = []
+        sampler = FrameSampler(
+            mode=request.args.get('sample_mode', 'interval'),
+            interval_seconds=float(request.args.get('sample_interval', 1.0)),
+        )
+        conf_threshold, class_thresholds, _ = detection_options(request.args)
 
-        if not cap.isOpened():
-            return jsonify({'error': 'Failed to process video file'}), 500
+        # mode=count (default) counts every box; mode=classify stops at the first confirmed class;
+        # mode=track counts each watermark instance once however many frames it is on
+        mode = request.args.get('mode', 'count')
+        if mode not in VIDEO_MODES:
+            raise ValueError(f"mode must be one of {', '.join(VIDEO_MODES)}")
+        classify_hits = int(request.args.get('min_hits', CLASSIFY_MIN_HITS)) if mode == 'classify' else None
+        if classify_hits is not None and classify_hits < 1:
+            raise ValueError("min_hits must be at least 1")
+        track_delta = float(request.args.get('delta', TRACK_DELTA_THRESHOLD)) if mode == 'track' else None
+        if track_delta is not None and not (math.isfinite(track_delta) and track_delta >= 0):
+            raise ValueError("delta must be a non-negative number")
+    except ValueError as exc:
+        return jsonify({'error': str(exc)}), 400
 
-        # Process video frames
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            if frame_count % frame_rate == 0:  # Extract 1 frame per second
-                results = model(frame)
-                result = results[0]  # Extract the first Results object
-                boxes = result.boxes
-
-                if boxes is not None:
-                    # Extract class indices and confidence scores
-                    class_indices = boxes.cls.cpu().numpy()
-                    confidences = boxes.conf.cpu().numpy()
-
-                    # Filter classes with confidence >= 50%
-                    valid_detections = [
-                        (int(cls), float(conf))  # Convert to standard Python types
-                        for cls, conf in zip(class_indices, confidences) if conf >= 0.5
-                    ]
-                    all_detections.extend(valid_detections)
-
-            frame_count += 1
-
-        cap.release()
-
-        # Aggregate results
-        if all_detections:
-            class_names = model.names
-            class_counts = Counter([cls for cls, _ in all_detections])
-
-            response = {
-                "class_counts": {class_names[cls]: count for cls, count in class_counts.items()},
-                #"confidences": [
-                #    {"class": class_names[cls], "confidence": round(conf, 2)}
-                #    for cls, conf in all_detections
-                #]
-            }
-        else:
-            response = {"message": "No objects detected with confidence >= 50%."}
+    # Check if a video file is being uploaded
+    upload, thread = start_video_upload()
+    if upload is None:
+        if thread is not None:
+            thread.join()
+        return jsonify({'error': 'No video file uploaded'}), 400
 
-        return jsonify(response)
+    reader = None
+    handed_off = False
+    try:
+        try:
+            # Rejects bad containers as soon as the first bytes arrive
+            container = upload.wait_for_header()
+
+            if run_async:
+                # The job owns the spool file from here and removes it when done
+                with stage_timer("upload"):
+                    upload.wait_until_finished()
+                job_id = job_runner.submit(
+                    "video",
+                    lambda report_progress: analyze_video(
+                        upload.path, sampler, conf_threshold, class_thresholds, report_progress,
+                        classify_hits, track_delta,
+                    ),
+                    cleanup=upload.discard,
+                )
+                handed_off = True
+                return jsonify({
+                    'job_id': job_id,
+                    'status': JOB_QUEUED,
+                    'status_url': url_for('get_job', job_id=job_id),
+                }), 202
+
+            if av is not None and container in STREAMABLE_CONTAINERS and classify_hits is None:
+                # Decode while the rest of the upload is still arriving
+                reader = upload.reader()
+                source = reader
+            else:
+                with stage_timer("upload"):
+                    upload.wait_until_finished()
+                source = upload.path
+
+            with stage_timer("video"):
+                response = analyze_video(
+                    source, sampler, conf_threshold, class_thresholds,
+                    classify_hits=classify_hits, track_delta=track_delta,
+                )
+        except HTTPException as exc:
+            return jsonify({'error': exc.description}), exc.code
+        except IOError:
+            return jsonify({'error': 'Failed to process video file'}), 500
+        except ModelReplacedError as exc:
+            return jsonify({'error': str(exc)}), 503
+
+        with stage_timer("serialize"):
+            return jsonify(response)
 
     finally:
-        # Clean up the temporary video
-        if os.path.exists(video_path):
-            os.remove(video_path)
+        # Stop spooling if we bailed out early, then remove the spool file
+        if not upload.finished:
+            upload.fail(IOError("Video processing aborted"))
+        thread.join()
+        if reader is not None:
+            reader.close()
+        if not handed_off:
+            upload.discard()
+
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    # Hit/miss counters for the detection result cache
+    return jsonify(result_cache.stats())
+
+
+@app.route('/scheduler_stats', methods=['GET'])
+def scheduler_stats():
+    # Queue depth, batch sizes and wait times for tuning the batching window
+    return jsonify(scheduler.stats())
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    # Readiness probe: 200 only once the model is loaded and warmed up. Under a WSGI host
+    # that never calls start_loading() (gunicorn, waitress-serve) the first probe starts it,
+    # since the load balancer sends no traffic until the probe passes
+    status = model.status()
+    if status['state'] == 'unloaded':
+        model.start_loading()
+        status = model.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+
+@app.route('/reload_model', methods=['POST'])
+def reload_model():
+    # Hot-swap the weights (optional "weights" path, default: reload the current file);
+    # the old model keeps serving until the new one is warmed up
+    if not MODEL_ADMIN_TOKEN:
+        return jsonify({'error': 'Model reloading is disabled'}), 404
+    # Constant-time comparison, so response timing does not leak how much of a guess matched
+    if not hmac.compare_digest(request.headers.get('X-Admin-Token', '').encode(), MODEL_ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Invalid admin token'}), 403
+    weights_path = request.values.get('weights') or (request.get_json(silent=True) or {}).get('weights')
+    if weights_path and not os.path.exists(weights_path):
+        return jsonify({'error': f'Weights not found: {weights_path}'}), 400
+    try:
+        status = model.swap(weights_path)
+    except Exception as exc:
+        return jsonify({'error': f'Failed to load model: {exc}'}), 500
+    return jsonify(status)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus scrape target: stage and request latency histograms, frame counters,
+    # model load time and requests in flight
+    return app.response_class(REGISTRY.render(), content_type=CONTENT_TYPE)
 
 
 # Run the Flask app
 if __name__ == '__main__':
+    job_store.recover()
+    # Accept connections right away; /ready turns true once the model is warm
+    model.start_loading()
     app.run(host='0.0.0.0', port=6001)
@@ -0,0 +1,350 @@
+import ast
+import os
+import time
+
+import cv2
+import numpy as np
+
+from detection import EMPTY_DETECTIONS, RawDetections, non_max_suppression, raw_detections
+from metrics import observe_stage, stage_timer
+
+try:
+    import onnxruntime as ort  # Optional: only needed for the onnx/openvino backends
+except ImportError:
+    ort = None
+
+BACKENDS = ("torch", "onnx", "openvino", "stub")
+
+# Ultralytics predict() defaults, so every backend returns the same boxes
+DEFAULT_IMGSZ = 640
+DEFAULT_CONF = 0.25
+DEFAULT_IOU = 0.7
+DEFAULT_MAX_DET = 300
+
+
+def _as_list(source):
+    return source if isinstance(source, (list, tuple)) else [source]
+
+
+def _load_image(image):
+    if isinstance(image, (str, os.PathLike)):
+        loaded = cv2.imread(str(image), cv2.IMREAD_COLOR)
+        if loaded is None:
+            raise IOError(f"Cannot read image: {image}")
+        return loaded
+    return image
+
+
+class TorchBackend:
+    """The PyTorch `YOLO` model, returning RawDetections like every other backend."""
+
+    def __init__(self, weights_path):
+        from ultralytics import YOLO
+
+        self.weights_path = weights_path
+        self.model = YOLO(weights_path)
+        self.names = self.model.names
+
+    def __call__(self, source):
+        """Run one image, a path or a list of either; returns one RawDetections per image."""
+        results = self.model(source)
+
+        # Ultralytics times each image's share of the batch in milliseconds
+        for stage, key in (("preprocess", "preprocess"), ("model", "inference"), ("postprocess", "postprocess")):
+            observe_stage(stage, sum(result.speed.get(key) or 0.0 for result in results) / 1000.0)
+        return [raw_detections(result) for result in results]
+
+
+def letterbox(image, size=DEFAULT_IMGSZ, pad_value=114):
+    """
+    Resize keeping the aspect ratio and pad to a `size` x `size` square.
+
+    Returns:
+        (padded image, scale, (pad_x, pad_y)) so boxes can be mapped back.
+    """
+    height, width = image.shape[:2]
+    scale = min(size / height, size / width)
+    new_w, new_h = int(round(width * scale)), int(round(height * scale))
+    if (new_w, new_h) != (width, height):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    pad_x, pad_y = (size - new_w) // 2, (size - new_h) // 2
+    padded = cv2.copyMakeBorder(
+        image, pad_y, size - new_h - pad_y, pad_x, size - new_w - pad_x,
+        cv2.BORDER_CONSTANT, value=(pad_value, pad_value, pad_value),
+    )
+    return padded, scale, (pad_x, pad_y)
+
+
+def model_input(image, size=DEFAULT_IMGSZ):
+    """
+    Letterbox a BGR image into the exported graph's input layout.
+
+    Returns:
+        (CHW RGB float32 array in [0, 1], scale, (pad_x, pad_y))
+    """
+    padded, scale, pad = letterbox(image, size)
+    # HWC BGR uint8 -> CHW RGB float in [0, 1]
+    return padded[:, :, ::-1].transpose(2, 0, 1) * np.float32(1 / 255.0), scale, pad
+
+
+class OnnxBackend:
+    """
+    YOLO detector exported to ONNX and served through ONNX Runtime.
+
+    Pre-processing (letterbox, BGR->RGB, 0-1 scaling) and post-processing
+    (confidence filter, class-aware NMS, mapping back to image coordinates)
+    mirror Ultralytics, so results match the PyTorch path.
+    """
+
+    def __init__(self, onnx_path, names=None, imgsz=DEFAULT_IMGSZ, conf=DEFAULT_CONF,
+                 iou=DEFAULT_IOU, max_det=DEFAULT_MAX_DET, intra_op_threads=None,
+                 inter_op_threads=None, providers=None):
+        """
+        Args:
+            onnx_path (str): Exported model file.
+            names (dict): Class index -> name; read from the model metadata when omitted.
+            imgsz (int): Square input size the model was exported with.
+            conf (float): Confidence below which raw candidates are dropped before NMS.
+            iou (float): NMS IoU threshold.
+            max_det (int): Largest number of boxes kept per image.
+            intra_op_threads (int): Threads used inside one operator (0 lets ORT decide).
+            inter_op_threads (int): Threads used across independent operators.
+            providers (list): ONNX Runtime execution providers, e.g. OpenVINO before CPU.
+        """
+        if ort is None:
+            raise ImportError("The onnx backend needs onnxruntime (pip install onnxruntime)")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = int(intra_op_threads or os.environ.get("ORT_INTRA_OP_THREADS", 0))
+        options.inter_op_num_threads = int(inter_op_threads or os.environ.get("ORT_INTER_OP_THREADS", 0))
+        options.execution_mode = (
+            ort.ExecutionMode.ORT_PARALLEL if options.inter_op_num_threads > 1
+            else ort.ExecutionMode.ORT_SEQUENTIAL
+        )
+
+        available = ort.get_available_providers()
+        providers = [p for p in (providers or ["CPUExecutionProvider"]) if p in available]
+        self.session = ort.InferenceSession(onnx_path, options, providers=providers or None)
+        self.input_name = self.session.get_inputs()[0].name
+
+        self.weights_path = onnx_path
+        self.imgsz = imgsz
+        self.conf = conf
+        self.iou = iou
+        self.max_det = max_det
+        self.names = names or self._metadata_names()
+
+    def _metadata_names(self):
+        # Ultralytics stores the class names as a dict literal in the model metadata
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        if "names" in metadata:
+            return {int(k): v for k, v in ast.literal_eval(metadata["names"]).items()}
+        raise ValueError("Class names not found in ONNX metadata; pass names explicitly")
+
+    def __call__(self, source):
+        """Run one image, a path or a list of either; returns one RawDetections per image."""
+        images = [_load_image(image) for image in _as_list(source)]
+        if not images:
+            return []
+
+        with stage_timer("preprocess"):
+            batch = np.empty((len(images), 3, self.imgsz, self.imgsz), dtype=np.float32)
+            transforms = []
+            for i, image in enumerate(images):
+                batch[i], scale, pad = model_input(image, self.imgsz)
+                transforms.append((scale, pad, image.shape[:2]))
+
+        with stage_timer("model"):
+            predictions = self.session.run(None, {self.input_name: batch})[0]
+        with stage_timer("postprocess"):
+            return [
+                self._postprocess(prediction, *transform)
+                for prediction, transform in zip(predictions, transforms)
+            ]
+
+    def _postprocess(self, prediction, scale, pad, shape):
+        # (4 + classes, anchors) -> (anchors, 4 + classes)
+        prediction = prediction.T
+        scores = prediction[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences > self.conf
+        if not keep.any():
+            return EMPTY_DETECTIONS
+
+        xywh = prediction[keep, :4]
+        class_ids, confidences = class_ids[keep], confidences[keep]
+        boxes = np.empty_like(xywh)
+        boxes[:, :2] = xywh[:, :2] - xywh[:, 2:] / 2
+        boxes[:, 2:] = xywh[:, :2] + xywh[:, 2:] / 2
+
+        kept = non_max_suppression(boxes, confidences, class_ids, self.iou, self.max_det)
+        boxes, class_ids, confidences = boxes[kept], class_ids[kept], confidences[kept]
+
+        # Undo the letterbox
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / scale
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / scale
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, shape[1])
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, shape[0])
+        return RawDetections(
+            class_ids.astype(np.int64), confidences.astype(np.float32), boxes.astype(np.float32)
+        )
+
+
+class StubBackend:
+    """
+    Stand-in detector for benchmarks and smoke tests, needing no weights or ML libraries.
+
+    Each call sleeps for a fixed batch overhead plus a per-image cost, roughly
+    the shape of a real model's latency, and returns a few boxes per image laid
+    out on a grid. The boxes depend only on the image size, so repeated frames
+    give repeated results.
+    """
+
+    def __init__(self, weights_path="stub", names=None, batch_ms=None, image_ms=None, boxes=3):
+        """
+        Args:
+            weights_path (str): Only reported back; nothing is loaded.
+            names (dict): Class index -> name; defaults to the three lap classes.
+            batch_ms (float): Time per call; defaults to $STUB_BATCH_MS or 5.
+            image_ms (float): Extra time per image; defaults to $STUB_IMAGE_MS or 20.
+            boxes (int): Boxes returned per image, at least 1.
+        """
+        if int(boxes) < 1:
+            raise ValueError(f"boxes must be at least 1, got {boxes}")
+        self.weights_path = weights_path
+        self.names = names or {0: "lap1", 1: "lap2", 2: "lap3"}
+        self.batch_ms = float(batch_ms if batch_ms is not None else os.environ.get("STUB_BATCH_MS", 5))
+        self.image_ms = float(image_ms if image_ms is not None else os.environ.get("STUB_IMAGE_MS", 20))
+        self.boxes = int(boxes)
+
+    def _detections(self, image):
+        height, width = image.shape[:2]
+        n = np.arange(self.boxes)
+        x0 = (n + 0.25) * width / self.boxes
+        y0 = np.full(self.boxes, height / 3.0)
+        side = min(width, height) / (4.0 * self.boxes)
+        boxes = np.stack([x0, y0, x0 + side, y0 + side], axis=1).astype(np.float32)
+        confidences = np.linspace(0.9, 0.4, self.boxes).astype(np.float32)
+        return RawDetections((n % len(self.names)).astype(np.int64), confidences, boxes)
+
+    def __call__(self, source):
+        """Run one image, a path or a list of either; returns one RawDetections per image."""
+        images = [_load_image(image) for image in _as_list(source)]
+        with stage_timer("model"):
+            time.sleep((self.batch_ms + self.image_ms * len(images)) / 1000.0)
+        return [self._detections(image) for image in images]
+
+
+def load_calibration_images(directory, limit=100):
+    """Up to `limit` BGR images from `directory`, e.g. generated watermarked screenshots."""
+    names = sorted(f for f in os.listdir(directory) if f.lower().endswith((".jpg", ".jpeg", ".png", ".bmp")))
+    images = [cv2.imread(os.path.join(directory, name), cv2.IMREAD_COLOR) for name in names[:limit]]
+    return [image for image in images if image is not None]
+
+
+def export_onnx(weights_path, imgsz=DEFAULT_IMGSZ, int8=False, output_path=None, calibration_images=None):
+    """
+    Export YOLO weights to ONNX, optionally quantized to INT8.
+
+    INT8 uses static quantization: activation ranges are calibrated on
+    `calibration_images` and stored in the graph (QDQ format, per-channel
+    weights), so ONNX Runtime runs the convolutions as INT8 kernels. Dynamic
+    quantization is not offered: on a convolutional network it only shrinks the
+    weights, and its ConvInteger kernels are often slower than FP32 on CPU.
+
+    Args:
+        weights_path (str): PyTorch weights, e.g. "mark.pt".
+        imgsz (int): Square input size baked into the graph.
+        int8 (bool): Also quantize the model to INT8 and return that model.
+        output_path (str): Where to put the final model; defaults next to the weights.
+        calibration_images (list): BGR images like the ones served (a hundred or so);
+            required with `int8`.
+
+    Returns:
+        Path of the exported (and possibly quantized) ONNX model.
+    """
+    if int8 and not calibration_images:
+        raise ValueError("INT8 export needs calibration_images to calibrate activation ranges")
+
+    from ultralytics import YOLO
+
+    # Dynamic batch so the scheduler and video pipeline can send batches of any size
+    exported = YOLO(weights_path).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+
+    if int8:
+        from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+        input_name = ort.InferenceSession(exported, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+        class Calibration(CalibrationDataReader):
+            # One preprocessed image per get_next(), exactly as OnnxBackend feeds the graph
+            def __init__(self):
+                self.inputs = ({input_name: model_input(image, imgsz)[0][None]} for image in calibration_images)
+
+            def get_next(self):
+                return next(self.inputs, None)
+
+        quantized = output_path or os.path.splitext(exported)[0] + ".int8.onnx"
+        quantize_static(
+            exported, quantized, Calibration(), quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8, per_channel=True,
+        )
+        return quantized
+
+    if output_path and os.path.abspath(output_path) != os.path.abspath(exported):
+        os.replace(exported, output_path)
+        return output_path
+    return exported
+
+
+def load_backend(name=None, weights_path="mark.pt", **options):
+    """
+    Build an inference backend.
+
+    Args:
+        name (str): "torch", "onnx", "openvino" or "stub"; defaults to $MODEL_BACKEND or "torch".
+        weights_path (str): "mark.pt" for torch; for onnx/openvino either a .onnx file
+            or a .pt file, which is exported to ONNX next to it on first use.
+        **options: Passed to OnnxBackend (threads, imgsz, conf, iou ...) or StubBackend.
+
+    Returns:
+        A callable mapping images to lists of RawDetections, with a `names` attribute.
+    """
+    name = (name or os.environ.get("MODEL_BACKEND", "torch")).lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name!r}, expected one of {BACKENDS}")
+    if name == "torch":
+        return TorchBackend(weights_path)
+    if name == "stub":
+        return StubBackend(weights_path, **options)
+
+    onnx_path = weights_path
+    if not weights_path.endswith(".onnx"):
+        onnx_path = os.path.splitext(weights_path)[0] + ".onnx"
+        if not os.path.exists(onnx_path):
+            onnx_path = export_onnx(weights_path, imgsz=options.get("imgsz", DEFAULT_IMGSZ))
+
+    if name == "openvino":
+        options.setdefault("providers", ["OpenVINOExecutionProvider", "CPUExecutionProvider"])
+    return OnnxBackend(onnx_path, **options)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export YOLO weights to ONNX for CPU serving.")
+    parser.add_argument("weights", nargs="?", default="mark.pt")
+    parser.add_argument("--imgsz", type=int, default=DEFAULT_IMGSZ)
+    parser.add_argument("--int8", action="store_true", help="Quantize to INT8 (static, needs --calibration)")
+    parser.add_argument("--calibration", default=None,
+                        help="Directory of images like the served ones, e.g. generated screenshots")
+    parser.add_argument("--calibration-images", type=int, default=100, help="Images used for calibration")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+    if args.int8 and not args.calibration:
+        parser.error("--int8 needs --calibration")
+
+    calibration = load_calibration_images(args.calibration, args.calibration_images) if args.int8 else None
+    print(f"Exported: {export_onnx(args.weights, args.imgsz, args.int8, args.output, calibration)}")
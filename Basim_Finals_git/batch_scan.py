@@ -0,0 +1,228 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import glob
+import os
+import tarfile
+import zipfile
+
+from detection import raw_detections
+from image_io import MAX_IMAGE_BYTES, decode_image_buffer
+from result_cache import content_key
+from tiling import DEFAULT_OVERLAP, infer_tiled, should_tile
+
+# File types picked up from directories and archives
+SCAN_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+
+ARCHIVE_TYPES = {"application/zip", "application/x-zip-compressed", "application/x-tar", "application/gzip",
+                 "application/x-gzip", "application/x-gtar"}
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+
+
+def is_image_name(name):
+    return name.lower().endswith(SCAN_EXTENSIONS)
+
+
+def is_archive(filename, mimetype=None):
+    """True for zip/tar uploads, judged by content type or file name."""
+    return mimetype in ARCHIVE_TYPES or (filename or "").lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def oversized(name, size):
+    """read() for an image over MAX_IMAGE_BYTES: raises, so it becomes a per-file error."""
+    def read():
+        raise ValueError(f"{name} exceeds {MAX_IMAGE_BYTES} bytes")
+    return read
+
+
+def check_archive(fileobj):
+    """
+    Make sure a seekable file starts like a zip or tar archive, then rewind it.
+
+    Lets a caller reject a bad upload before it starts streaming results.
+
+    Raises:
+        ValueError: If the data is neither a zip nor a tar archive.
+    """
+    try:
+        if not zipfile.is_zipfile(fileobj):
+            fileobj.seek(0)
+            tarfile.open(fileobj=fileobj, mode="r:*").close()
+    except tarfile.TarError as exc:
+        raise ValueError("Upload is not a zip or tar archive") from exc
+    finally:
+        fileobj.seek(0)
+
+
+def iter_archive(fileobj, max_files=10000):
+    """
+    Image members of a zip or tar archive, as (name, read) pairs for `scan_images`.
+
+    Zip members are read lazily by the decode threads; tar members are read in
+    archive order while iterating, so the archive may be a non-seekable stream.
+    Members over MAX_IMAGE_BYTES yield an entry whose read() raises, so they show
+    up as per-file errors instead of being decompressed.
+
+    Raises:
+        ValueError: If the data is neither a zip nor a tar archive, or holds more
+            than `max_files` images.
+    """
+    count = 0
+    if fileobj.seekable() and zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        archive = zipfile.ZipFile(fileobj)
+        for info in archive.infolist():
+            if info.is_dir() or not is_image_name(info.filename):
+                continue
+            count += 1
+            if count > max_files:
+                raise ValueError(f"Archive holds more than {max_files} images")
+            if info.file_size > MAX_IMAGE_BYTES:
+                yield info.filename, oversized(info.filename, info.file_size)
+            else:
+                yield info.filename, functools.partial(archive.read, info)
+        return
+
+    if fileobj.seekable():
+        fileobj.seek(0)
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode="r|*")
+    except tarfile.TarError as exc:
+        raise ValueError("Upload is not a zip or tar archive") from exc
+    with archive:
+        for info in archive:
+            if not info.isfile() or not is_image_name(info.name):
+                continue
+            count += 1
+            if count > max_files:
+                raise ValueError(f"Archive holds more than {max_files} images")
+            if info.size > MAX_IMAGE_BYTES:
+                yield info.name, oversized(info.name, info.size)
+            else:
+                data = archive.extractfile(info).read()
+                yield info.name, lambda data=data: data
+
+
+def _load(read, tile_mode, cache):
+    # Runs on a decode thread: read, look up the cache, decode on a miss
+    data = read()
+    key = raw = image = None
+    if cache is not None:
+        key = f"{content_key(data)}:{tile_mode}"
+        raw = cache.get(key)
+    if raw is None:
+        image = decode_image_buffer(data)
+        if image is None:
+            raise ValueError("not a readable image")
+    return key, raw, image
+
+
+def scan_images(sources, infer_batch, engine, batch_size=16, decode_workers=4, tile_mode="off",
+                overlap=DEFAULT_OVERLAP, conf_threshold=None, class_thresholds=None,
+                return_boxes=False, cache=None, max_pending=None):
+    """
+    Detect watermarks in many images, yielding one result per image as soon as it is ready.
+
+    Reading and decoding run on a thread pool ahead of inference, so the model
+    never waits for the disk. Decoded images go to the model `batch_size` at a
+    time; images large enough for tiling (see tiling.should_tile) are run as
+    their own tile batch. Results come out in input order.
+
+    Args:
+        sources: Iterable of (name, read) pairs, where read() returns the encoded image bytes.
+        infer_batch: Callable mapping a list of images to one result per image.
+        engine (DetectionEngine): Thresholding and counting.
+        batch_size (int): Images per inference call.
+        decode_workers (int): Threads reading and decoding images.
+        tile_mode (str): "off", "on" or "auto", as for /detect.
+        overlap (float): Tile overlap.
+        conf_threshold (float): Optional request-level confidence threshold.
+        class_thresholds (dict): Optional class index -> threshold overrides.
+        return_boxes (bool): Include the boxes of every image.
+        cache (ResultCache): Optional cache keyed by the encoded bytes, shared with /detect.
+        max_pending (int): Images read ahead of inference; defaults to two batches.
+
+    Yields:
+        {"file": name, "class_counts": {...}} (plus "detections" with `return_boxes`),
+        or {"file": name, "error": message} for files that could not be read.
+    """
+    batch_size = max(1, int(batch_size))
+    max_pending = max(batch_size, int(max_pending or 2 * batch_size))
+    sources = iter(sources)
+    pending = deque()
+
+    with ThreadPoolExecutor(max(1, int(decode_workers)), thread_name_prefix="scan-decode") as pool:
+        def fill():
+            while len(pending) < max_pending:
+                source = next(sources, None)
+                if source is None:
+                    return
+                name, read = source
+                pending.append((name, pool.submit(_load, read, tile_mode, cache)))
+
+        try:
+            while True:
+                fill()
+                if not pending:
+                    return
+                batch = [pending.popleft() for _ in range(min(batch_size, len(pending)))]
+                # Keep the decoders busy with the next batch while this one is inferred
+                fill()
+
+                results = [None] * len(batch)
+                raws = [None] * len(batch)
+                keys = [None] * len(batch)
+                whole, tiled = [], []
+                for i, (name, future) in enumerate(batch):
+                    try:
+                        keys[i], raws[i], image = future.result()
+                    except (OSError, ValueError, zipfile.BadZipFile, tarfile.TarError) as exc:
+                        results[i] = {"file": name, "error": str(exc)}
+                        continue
+                    if raws[i] is None:
+                        if should_tile(image.shape, tile_mode):
+                            tiled.append((i, image))
+                        else:
+                            whole.append((i, image))
+
+                fingerprint = cache.fingerprint if cache is not None else None
+                if whole:
+                    for (i, _), result in zip(whole, infer_batch([image for _, image in whole])):
+                        raws[i] = raw_detections(result)
+                for i, image in tiled:
+                    raws[i] = infer_tiled(infer_batch, image, overlap=overlap)
+                if cache is not None:
+                    for i, _ in whole + tiled:
+                        cache.put(keys[i], raws[i], fingerprint=fingerprint)
+
+                ok = [i for i in range(len(batch)) if results[i] is None]
+                summaries = engine.summarize_batch(
+                    [raws[i] for i in ok], conf_threshold, class_thresholds, return_boxes
+                ) if ok else []
+                for i, summary in zip(ok, summaries):
+                    results[i] = {"file": batch[i][0], **summary}
+                yield from results
+        finally:
+            # Stop reading ahead if the consumer went away
+            for _, future in pending:
+                future.cancel()
+
+
+def walk_images(paths, recursive=True):
+    """
+    Image files under the given files, directories or glob patterns, in sorted order.
+
+    Returns:
+        List of file paths.
+    """
+    found = set()
+    for path in paths:
+        matches = glob.glob(path, recursive=True) if glob.has_magic(path) else [path]
+        for match in matches:
+            if os.path.isdir(match):
+                walker = os.walk(match) if recursive else [(match, [], os.listdir(match))]
+                for root, _, files in walker:
+                    found.update(os.path.join(root, f) for f in files if is_image_name(f))
+            elif os.path.isfile(match) and is_image_name(match):
+                found.add(match)
+    return sorted(found)
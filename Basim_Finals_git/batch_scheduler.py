@@ -0,0 +1,152 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class BatchScheduler:
+    """
+    Coalesce single-image inference requests into batched model calls.
+
+    Requests are queued by `submit`; a background thread waits for the first
+    one, keeps collecting until `max_batch_size` images are queued or
+    `max_wait_ms` has passed, runs one forward pass over the whole batch and
+    hands each caller back its own result.
+
+    With `num_dispatchers` > 1, several threads form and run batches
+    concurrently; only useful when the model can serve calls in parallel,
+    e.g. an InferencePool of worker processes.
+    """
+
+    def __init__(self, model, max_batch_size=16, max_wait_ms=10.0, num_dispatchers=1):
+        """
+        Args:
+            model: Callable taking a list of images and returning one result per image.
+            max_batch_size (int): Largest batch sent to the model in one call.
+            max_wait_ms (float): Longest time the first queued image waits for company.
+            num_dispatchers (int): Batches allowed in flight at the same time.
+        """
+        self.model = model
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._submit_lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "images": 0,
+            "last_batch_size": 0,
+            "max_batch_size_seen": 0,
+            "total_wait_ms": 0.0,
+            "max_wait_ms_seen": 0.0,
+            "total_inference_ms": 0.0,
+        }
+
+        self._stopped = False
+        self._workers = [
+            threading.Thread(target=self._run, name=f"batch-scheduler-{i}", daemon=True)
+            for i in range(max(1, int(num_dispatchers)))
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, image):
+        """Queue one image and return a Future resolving to its model result."""
+        future = Future()
+        # Checked and queued together, so nothing lands behind close()'s stop sentinels
+        with self._submit_lock:
+            if self._stopped:
+                raise RuntimeError("BatchScheduler has been closed")
+            self._queue.put((image, future, time.perf_counter()))
+        return future
+
+    def infer(self, image, timeout=None):
+        """Run one image through the batched model and block for its result."""
+        return self.submit(image).result(timeout)
+
+    def infer_many(self, images, timeout=None):
+        """Queue several images at once and block for all of their results, in order."""
+        futures = [self.submit(image) for image in images]
+        return [future.result(timeout) for future in futures]
+
+    def stats(self):
+        """Return a snapshot of queue depth, batch sizes and wait times."""
+        with self._lock:
+            stats = dict(self._stats)
+        batches = stats["batches"] or 1
+        images = stats["images"] or 1
+        stats["queue_depth"] = self._queue.qsize()
+        stats["avg_batch_size"] = round(stats["images"] / batches, 3)
+        stats["avg_wait_ms"] = round(stats["total_wait_ms"] / images, 3)
+        stats["avg_inference_ms"] = round(stats["total_inference_ms"] / batches, 3)
+        stats["config"] = {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "num_dispatchers": len(self._workers),
+        }
+        return stats
+
+    def close(self):
+        """Stop the workers once every already-queued image has been served."""
+        with self._submit_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            for _ in self._workers:
+                self._queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+    def _collect(self):
+        # Block for the first request, then gather more until full or out of time
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Put the sentinel back so the loop exits after this batch
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+
+            images = [image for image, _, _ in batch]
+            futures = [future for _, future, _ in batch]
+            started = time.perf_counter()
+            waits = [(started - queued) * 1000.0 for _, _, queued in batch]
+
+            try:
+                results = list(self.model(images))
+                if len(results) != len(images):
+                    raise RuntimeError(f"Model returned {len(results)} results for {len(images)} images")
+            except Exception as exc:
+                # Every caller gets an answer, never a future that stays pending
+                for future in futures:
+                    future.set_exception(exc)
+            else:
+                for future, result in zip(futures, results):
+                    future.set_result(result)
+
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+            with self._lock:
+                self._stats["batches"] += 1
+                self._stats["images"] += len(batch)
+                self._stats["last_batch_size"] = len(batch)
+                self._stats["max_batch_size_seen"] = max(self._stats["max_batch_size_seen"], len(batch))
+                self._stats["total_wait_ms"] += sum(waits)
+                self._stats["max_wait_ms_seen"] = max(self._stats["max_wait_ms_seen"], max(waits))
+                self._stats["total_inference_ms"] += elapsed_ms
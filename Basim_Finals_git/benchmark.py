@@ -0,0 +1,411 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import cv2
+import numpy as np
+
+from dataset_generator import generate_dataset
+from shards import ShardReader, decode_sample
+
+# Symbol for lap1 (see Symbol_labels.txt)
+SYMBOL = "☂"
+
+
+def latency_stats(seconds):
+    """p50/p95/p99, mean and max of a list of durations, in milliseconds."""
+    ms = np.asarray(seconds, dtype=np.float64) * 1000.0
+    if not len(ms):
+        return {}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "count": int(len(ms)),
+        "p50_ms": round(float(p50), 2),
+        "p95_ms": round(float(p95), 2),
+        "p99_ms": round(float(p99), 2),
+        "mean_ms": round(float(ms.mean()), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def bench_generator(backgrounds_dir, font_path, sizes, grids, num_images, workers):
+    """
+    Images/sec of the dataset generator for every (image size, grid density) pair.
+
+    Every size gets an untimed warm-up run first. In-process runs (workers=1)
+    then keep resized backgrounds and rasterized glyphs, so every grid is timed
+    warm. A worker pool is started afresh by each run; its backgrounds come
+    warm from a shared memory-mapped stack, but every worker still rasterizes
+    its glyphs and pays its start-up inside the timing. Each result says which
+    caches were warm.
+
+    Returns:
+        One result dictionary per combination.
+    """
+    in_process = workers == 1
+    cache_dir = None if in_process else tempfile.mkdtemp(prefix="bench_gen_cache_")
+
+    def run(img_size, grid, count):
+        output_dir = tempfile.mkdtemp(prefix="bench_gen_")
+        try:
+            return generate_dataset(
+                SYMBOL, 0, backgrounds_dir, output_dir, font_path,
+                num_images=count, img_size=img_size, rows_range=(grid[0],) * 2,
+                cols_range=(grid[1],) * 2, workers=workers, report_every=count + 1,
+                cache_dir=cache_dir,
+            )
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    results = []
+    try:
+        for img_size in sizes:
+            run(img_size, grids[0], num_images)
+            for grid in grids:
+                stats = run(img_size, grid, num_images)
+                results.append({
+                    "img_size": list(img_size), "grid": list(grid),
+                    "warm_caches": ["backgrounds", "glyphs"] if in_process else ["backgrounds"],
+                    **stats,
+                })
+    finally:
+        if cache_dir is not None:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+    return results
+
+
+def sample_images(backgrounds_dir, font_path, count, img_size=(640, 640), seed=0):
+    """Render `count` watermarked test images through a shard; returns BGR NumPy images."""
+    output_dir = tempfile.mkdtemp(prefix="bench_images_")
+    try:
+        generate_dataset(
+            SYMBOL, 0, backgrounds_dir, output_dir, font_path, num_images=count,
+            img_size=img_size, seed=seed, workers=1, report_every=count + 1,
+            output_format="shards", shard_size=count,
+        )
+        reader = ShardReader(output_dir)
+        images = [decode_sample(reader[i])[0] for i in range(len(reader))]
+        reader.close()
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return images
+
+
+def bench_detection(model, images, batch_sizes, repeats):
+    """
+    Latency of single-image and batched calls to the model.
+
+    Returns:
+        Dictionary keyed by batch size, with latency percentiles per call and images/sec.
+    """
+    model(images[:1])  # warm up
+    results = {}
+    for batch_size in batch_sizes:
+        durations = []
+        for r in range(repeats):
+            start = (r * batch_size) % len(images)
+            batch = [images[(start + i) % len(images)] for i in range(batch_size)]
+            started = time.perf_counter()
+            model(batch)
+            durations.append(time.perf_counter() - started)
+        results[str(batch_size)] = {
+            **latency_stats(durations),
+            "images_per_sec": round(batch_size * len(durations) / max(sum(durations), 1e-9), 2),
+        }
+    return results
+
+
+def mark(image, marker):
+    """Copy of `image` with `marker` written into its top-left pixels, so no two markers share content."""
+    image = image.copy()
+    bits = np.unpackbits(np.array([marker], dtype=">u4").view(np.uint8))
+    image[:8, :32 * 8] = np.repeat(bits, 8)[None, :, None] * 255
+    return image
+
+
+def make_video(path, images, seconds, fps=30, hold_seconds=2.0, marker=None):
+    """
+    Write a synthetic video that shows each image for `hold_seconds`, slowly panning.
+
+    Args:
+        marker (int): Stamped into every frame, so videos with different markers
+            never hit the result cache for each other.
+
+    Returns:
+        The path written.
+    """
+    height, width = images[0].shape[:2]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    try:
+        for frame in range(int(seconds * fps)):
+            image = images[int(frame / (fps * hold_seconds)) % len(images)]
+            image = np.roll(image, frame % fps, axis=1)
+            writer.write(image if marker is None else mark(image, marker))
+    finally:
+        writer.release()
+    return path
+
+
+def bench_video(model, engine, video_path, duration, sampling, batch_size=8, num_workers=2):
+    """Frames/sec and video seconds processed per wall-clock second, for each sampling mode."""
+    from frame_sampler import FrameSampler
+    from video_pipeline import process_video_pipelined
+
+    results = {}
+    for mode in sampling:
+        sampler = FrameSampler(mode=mode, interval_seconds=1.0)
+        started = time.perf_counter()
+        summary = process_video_pipelined(
+            video_path, model, engine, sampler=sampler, batch_size=batch_size, num_workers=num_workers
+        )
+        elapsed = time.perf_counter() - started
+        results[mode] = {
+            "seconds": round(elapsed, 3),
+            "frames_processed": summary["frames_processed"],
+            "frames_per_sec": round(summary["frames_processed"] / max(elapsed, 1e-9), 2),
+            "realtime_factor": round(duration / max(elapsed, 1e-9), 2),
+            "sampler": summary["sampler"],
+        }
+    return results
+
+
+def _multipart(field, filename, content_type, data, boundary):
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body
+
+
+def load_test(host, port, path, bodies, content_type, requests, concurrency):
+    """
+    Send `requests` POSTs with `concurrency` clients in parallel, cycling through `bodies`.
+
+    Returns:
+        Latency percentiles, requests/sec and error count.
+    """
+    local = threading.local()
+
+    def send(i):
+        body = bodies[i % len(bodies)]
+        connection = getattr(local, "connection", None)
+        if connection is None:
+            connection = local.connection = http.client.HTTPConnection(host, port, timeout=300)
+        started = time.perf_counter()
+        try:
+            connection.request("POST", path, body=body, headers={"Content-Type": content_type})
+            response = connection.getresponse()
+            response.read()
+            ok = response.status == 200
+        except (OSError, http.client.HTTPException):
+            local.connection = None
+            ok = False
+        return time.perf_counter() - started, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        outcomes = list(pool.map(send, range(requests)))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        **latency_stats([duration for duration, ok in outcomes if ok]),
+        "errors": sum(1 for _, ok in outcomes if not ok),
+        "requests_per_sec": round(len(outcomes) / max(elapsed, 1e-9), 2),
+    }
+
+
+def wait_until_ready(host, port, timeout=600.0):
+    """Poll GET /ready until the server's model is loaded and warmed up."""
+    deadline = time.monotonic() + timeout
+    while True:
+        connection = http.client.HTTPConnection(host, port, timeout=30)
+        try:
+            connection.request("GET", "/ready")
+            response = connection.getresponse()
+            response.read()
+            if response.status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            connection.close()
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"{host}:{port} not ready after {timeout:g}s")
+        time.sleep(1.0)
+
+
+def start_local_server():
+    """Serve the API in-process on a free port; returns (host, port, server)."""
+    from werkzeug.serving import make_server
+
+    from api_deployed_pv import app, model
+
+    # Load and warm up before the first timed request, so it does not pay for the model load
+    model.load()
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="bench-api", daemon=True).start()
+    return "127.0.0.1", server.server_port, server
+
+
+def _image_upload(image, boundary):
+    ok, encoded = cv2.imencode(".png", image)
+    return _multipart("image", "bench.png", "image/png", encoded.tobytes(), boundary)
+
+
+def bench_api(host, port, images, work_dir, video_seconds, concurrency_levels, requests, video_requests):
+    """
+    Load-test /detect and /process_video at each concurrency level.
+
+    Every /detect and /process_video request uploads content the server has not
+    seen before, so the numbers include decoding and inference; "detect_cached"
+    repeats one image to measure the result-cache path.
+    """
+    boundary = uuid.uuid4().hex
+    form_type = f"multipart/form-data; boundary={boundary}"
+    markers = iter(range((int(time.time()) & 0xFFFF) << 16, 1 << 32))
+    cached_body = _image_upload(images[0], boundary)
+
+    results = {"detect": [], "detect_cached": [], "process_video": []}
+    for concurrency in concurrency_levels:
+        bodies = [_image_upload(mark(images[i % len(images)], next(markers)), boundary) for i in range(requests)]
+        results["detect"].append(load_test(host, port, "/detect", bodies, form_type, requests, concurrency))
+        results["detect_cached"].append(
+            load_test(host, port, "/detect", [cached_body], form_type, requests, concurrency)
+        )
+
+        videos = []
+        for i in range(video_requests):
+            path = make_video(os.path.join(work_dir, f"upload_{i}.mp4"), images, video_seconds, marker=next(markers))
+            with open(path, "rb") as video_file:
+                videos.append(video_file.read())
+        results["process_video"].append(
+            load_test(host, port, "/process_video", videos, "video/mp4", video_requests, concurrency)
+        )
+    return results
+
+
+def run_metadata(args):
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "backend": args.backend,
+        "weights": args.weights,
+        "args": vars(args),
+    }
+
+
+def _pairs(spec):
+    # "640x640,1280x720" -> [(640, 640), (1280, 720)]
+    return [tuple(int(v) for v in item.split("x")) for item in spec.split(",") if item]
+
+
+def _ints(spec):
+    return [int(v) for v in spec.split(",") if v]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark generation, inference and the HTTP API.")
+    parser.add_argument("--suites", default="generator,detection,video,api",
+                        help="Comma-separated subset of generator,detection,video,api")
+    parser.add_argument("--backend", default=os.environ.get("MODEL_BACKEND", "torch"),
+                        help="torch, onnx, openvino or stub (no weights needed)")
+    parser.add_argument("--weights", default="mark.pt")
+    parser.add_argument("--backgrounds", default="./backgrounds")
+    parser.add_argument("--font", default="segoe-ui-symbol.ttf")
+    parser.add_argument("--output", default="benchmark.json", help="Where to write the JSON results")
+    # generator
+    parser.add_argument("--gen-sizes", default="320x320,640x640,1280x1280")
+    parser.add_argument("--gen-grids", default="3x3,6x6,10x10", help="rows x cols of the watermark grid")
+    parser.add_argument("--gen-images", type=int, default=64)
+    parser.add_argument("--gen-workers", type=int, default=None)
+    # detection
+    parser.add_argument("--images", type=int, default=32, help="Distinct test images rendered")
+    parser.add_argument("--batch-sizes", default="1,4,8")
+    parser.add_argument("--repeats", type=int, default=30)
+    # video
+    parser.add_argument("--video-seconds", type=float, default=30.0)
+    parser.add_argument("--sampling", default="interval,scene")
+    # api
+    parser.add_argument("--url", default=None, help="host:port of a running API; default starts one in-process")
+    parser.add_argument("--concurrency", default="1,4,16")
+    parser.add_argument("--requests", type=int, default=100, help="/detect requests per concurrency level")
+    parser.add_argument("--video-requests", type=int, default=8, help="/process_video requests per concurrency level")
+    parser.add_argument("--api-video-seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    suites = set(args.suites.split(","))
+    unknown = suites - {"generator", "detection", "video", "api"}
+    if unknown:
+        parser.error(f"Unknown suites: {', '.join(sorted(unknown))}")
+
+    # The API reads its backend from the environment when it is imported
+    os.environ["MODEL_BACKEND"] = args.backend
+    os.environ["MODEL_PATH"] = args.weights
+
+    report = {"meta": run_metadata(args)}
+
+    if "generator" in suites:
+        print("Generator throughput ...")
+        report["generator"] = bench_generator(
+            args.backgrounds, args.font, _pairs(args.gen_sizes), _pairs(args.gen_grids),
+            args.gen_images, args.gen_workers,
+        )
+
+    if suites & {"detection", "video", "api"}:
+        images = sample_images(args.backgrounds, args.font, args.images)
+        work_dir = tempfile.mkdtemp(prefix="bench_video_")
+        video_path = make_video(os.path.join(work_dir, "synthetic.mp4"), images, args.video_seconds)
+        try:
+            if suites & {"detection", "video"}:
+                from backends import load_backend
+                from detection import DetectionEngine
+
+                load_started = time.perf_counter()
+                model = load_backend(args.backend, args.weights)
+                report["model_load_seconds"] = round(time.perf_counter() - load_started, 3)
+
+                if "detection" in suites:
+                    print("Detection latency ...")
+                    report["detection"] = bench_detection(model, images, _ints(args.batch_sizes), args.repeats)
+                if "video" in suites:
+                    print("Video throughput ...")
+                    report["video"] = bench_video(
+                        model, DetectionEngine(model.names), video_path, args.video_seconds,
+                        args.sampling.split(","),
+                    )
+
+            if "api" in suites:
+                print("API load test ...")
+                server = None
+                if args.url:
+                    host, port = args.url.rsplit(":", 1)
+                    port = int(port)
+                    wait_until_ready(host, port)
+                else:
+                    host, port, server = start_local_server()
+                try:
+                    report["api"] = bench_api(
+                        host, port, images, work_dir, args.api_video_seconds,
+                        _ints(args.concurrency), args.requests, args.video_requests,
+                    )
+                finally:
+                    if server is not None:
+                        server.shutdown()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(json.dumps({key: value for key, value in report.items() if key != "meta"}, indent=2))
+    print(f"Results written to {args.output}")
@@ -0,0 +1,122 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from backends import OnnxBackend, TorchBackend, export_onnx
+from detection import DetectionEngine, box_iou
+
+# Symbols for lap1, lap2 and lap3 (see Symbol_labels.txt)
+SYMBOLS = ["☂", "♫", "✈"]
+
+
+def generate_images(backgrounds_dir, font_path, count, img_size=(640, 640), seed=0):
+    """
+    Render watermarked test images in memory, one random symbol per image.
+
+    Returns:
+        List of BGR NumPy images.
+    """
+    rng = random.Random(seed)
+    background_files = [f for f in os.listdir(backgrounds_dir) if f.endswith(('jpg', 'png', 'jpeg'))]
+    images = []
+    for _ in range(count):
+        background = Image.open(os.path.join(backgrounds_dir, rng.choice(background_files)))
+        background = background.convert("RGBA").resize(img_size)
+        overlay = Image.new("RGBA", img_size, (255, 255, 255, 0))
+        draw = ImageDraw.Draw(overlay)
+
+        symbol = rng.choice(SYMBOLS)
+        rows, cols = rng.randint(3, 6), rng.randint(3, 6)
+        font = ImageFont.truetype(font_path, rng.randint(40, 75))
+        cell_w, cell_h = img_size[0] // cols, img_size[1] // rows
+        for row in range(rows):
+            for col in range(cols):
+                xy = (col * cell_w + cell_w // 2, row * cell_h + cell_h // 2)
+                draw.text(xy, symbol, font=font, fill=(128, 128, 128, 128), anchor="mm")
+
+        rgb = np.asarray(Image.alpha_composite(background, overlay).convert("RGB"))
+        images.append(np.ascontiguousarray(rgb[:, :, ::-1]))
+    return images
+
+
+def timed_run(backend, images, batch_size=8):
+    """
+    Run `backend` over `images` in batches, after one untimed warmup batch.
+
+    Returns:
+        (one RawDetections per image, milliseconds per image)
+    """
+    backend(images[:batch_size])
+    outputs = []
+    started = time.perf_counter()
+    for start in range(0, len(images), batch_size):
+        outputs.extend(backend(images[start:start + batch_size]))
+    return outputs, (time.perf_counter() - started) * 1000.0 / max(1, len(images))
+
+
+def compare(reference, candidate, engine, iou_threshold=0.5):
+    """
+    Compare two backends' outputs on the same images.
+
+    Returns:
+        (images whose class counts match, total boxes matched, total reference boxes)
+    """
+    ref_counts = engine.count_batch(reference)
+    cand_counts = engine.count_batch(candidate)
+    matching_images = int((ref_counts == cand_counts).all(axis=1).sum())
+
+    matched = total = 0
+    for ref, cand in zip(reference, candidate):
+        _, ref_cls, _, ref_boxes = engine.filter_batch([ref])
+        _, cand_cls, _, cand_boxes = engine.filter_batch([cand])
+        total += len(ref_boxes)
+        for cls, box in zip(ref_cls, ref_boxes):
+            same_class = cand_boxes[cand_cls == cls]
+            if len(same_class) and box_iou(box, same_class).max() >= iou_threshold:
+                matched += 1
+    return matching_images, matched, total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check ONNX Runtime results against the PyTorch model.")
+    parser.add_argument("--weights", default="mark.pt")
+    parser.add_argument("--onnx", default=None, help="Exported model; exported from --weights if omitted")
+    parser.add_argument("--int8", action="store_true", help="Compare the INT8-quantized export")
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--calibration-images", type=int, default=100,
+                        help="Generated images used to calibrate the INT8 export (a different seed)")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--backgrounds", default="./backgrounds")
+    parser.add_argument("--font", default="segoe-ui-symbol.ttf")
+    parser.add_argument("--min-match", type=float, default=0.95,
+                        help="Fraction of images whose class counts must agree")
+    args = parser.parse_args()
+
+    calibration = None
+    if args.int8 and not args.onnx:
+        calibration = generate_images(args.backgrounds, args.font, args.calibration_images, seed=1)
+    onnx_path = args.onnx or export_onnx(args.weights, int8=args.int8, calibration_images=calibration)
+    torch_backend = TorchBackend(args.weights)
+    onnx_backend = OnnxBackend(onnx_path, names=torch_backend.names)
+    engine = DetectionEngine(torch_backend.names)
+
+    images = generate_images(args.backgrounds, args.font, args.images)
+    reference, torch_ms = timed_run(torch_backend, images, args.batch_size)
+    candidate, onnx_ms = timed_run(onnx_backend, images, args.batch_size)
+
+    matching_images, matched, total = compare(reference, candidate, engine)
+    print(f"Class counts identical on {matching_images}/{len(images)} images")
+    print(f"Boxes matched (IoU >= 0.5, same class): {matched}/{total}")
+    # Accuracy alone does not justify INT8; it has to be faster too
+    print(f"Latency per image: torch {torch_ms:.1f} ms, {os.path.basename(onnx_path)} {onnx_ms:.1f} ms"
+          f" ({torch_ms / max(onnx_ms, 1e-9):.2f}x)")
+
+    if matching_images < args.min_match * len(images):
+        print("Parity check FAILED")
+        sys.exit(1)
+    print("Parity check passed")
@@ -0,0 +1,100 @@
+import numpy as np
+
+
+def mask_array(mask):
+    """Glyph mask (PIL "L" image or uint8 array) as float32 coverage in [0, 1]."""
+    return np.asarray(mask, dtype=np.float32) * np.float32(1 / 255.0)
+
+
+def _copies_overlap(origins, mask_shape):
+    # Two copies of the same mask overlap when both offsets are below the mask size
+    delta = np.abs(origins[:, None, :] - origins[None, :, :])
+    overlap = (delta[..., 0] < mask_shape[1]) & (delta[..., 1] < mask_shape[0])
+    np.fill_diagonal(overlap, False)
+    return bool(overlap.any())
+
+
+def stamp_pixels(mask, origins, opacity, shape):
+    """
+    Tile one glyph mask over an image as a sparse alpha layer.
+
+    Args:
+        mask: Glyph mask (PIL "L" image or uint8 array).
+        origins: (cells, 2) array of (x, y) positions of the mask's top-left corner.
+        opacity: Scalar or one value per origin, in [0, 1].
+        shape (tuple): (height, width) of the image; pixels outside it are dropped.
+
+    Returns:
+        (ys, xs, alpha) arrays with one entry per covered pixel. Where copies
+        overlap, the stronger coverage is kept.
+    """
+    coverage = mask_array(mask)
+    origins = np.asarray(origins, dtype=np.int64).reshape(-1, 2)
+    opacity = np.broadcast_to(np.asarray(opacity, dtype=np.float32), (len(origins),))
+
+    # Only inked mask pixels matter; (cells, inked) coordinates and alpha values
+    mask_ys, mask_xs = np.nonzero(coverage)
+    ys = origins[:, 1, None] + mask_ys
+    xs = origins[:, 0, None] + mask_xs
+    alpha = coverage[mask_ys, mask_xs] * opacity[:, None]
+
+    inside = (ys >= 0) & (ys < shape[0]) & (xs >= 0) & (xs < shape[1])
+    ys, xs, alpha = ys[inside], xs[inside], alpha[inside]
+
+    if _copies_overlap(origins, coverage.shape):
+        # Resolve shared pixels on a dense layer so each appears once
+        layer = np.zeros(shape, dtype=np.float32)
+        np.maximum.at(layer, (ys, xs), alpha)
+        ys, xs = np.nonzero(layer)
+        alpha = layer[ys, xs]
+    return ys, xs, alpha
+
+
+def watermark_pixels(stamps, shape):
+    """
+    Build the (sparse) watermark layers of a batch of images.
+
+    Args:
+        stamps (iterable): (image_index, mask, origins, opacity) per image, as for `stamp_pixels`.
+        shape (tuple): (height, width) of the images.
+
+    Returns:
+        (image_index, ys, xs, alpha) arrays over every covered pixel of the batch.
+    """
+    images, ys, xs, alphas = [], [], [], []
+    for image_index, mask, origins, opacity in stamps:
+        cell_ys, cell_xs, alpha = stamp_pixels(mask, origins, opacity, shape)
+        images.append(np.full(len(cell_ys), image_index, dtype=np.int64))
+        ys.append(cell_ys)
+        xs.append(cell_xs)
+        alphas.append(alpha)
+    if not alphas:
+        return (np.zeros(0, dtype=np.int64),) * 3 + (np.zeros(0, dtype=np.float32),)
+    return np.concatenate(images), np.concatenate(ys), np.concatenate(xs), np.concatenate(alphas)
+
+
+def composite(backgrounds, pixels, colors, inplace=False):
+    """
+    Alpha-blend solid-colour watermark layers into a batch of backgrounds.
+
+    Args:
+        backgrounds: (N, H, W, 3) uint8 images.
+        pixels (tuple): (image_index, ys, xs, alpha) from `watermark_pixels`.
+        colors: (N, 3) or (3,) watermark colour(s), in the backgrounds' channel order.
+        inplace (bool): Blend straight into `backgrounds` instead of a copy.
+
+    Returns:
+        (N, H, W, 3) uint8 composited images.
+    """
+    out = backgrounds if inplace else np.array(backgrounds)
+    num_images, height, width, _ = out.shape
+    colors = np.broadcast_to(np.asarray(colors, dtype=np.float32).reshape(-1, 3), (num_images, 3))
+
+    # One gather-blend-scatter over every covered pixel of the whole batch
+    n, y, x, alpha = pixels
+    flat = out.reshape(-1, 3)
+    index = (n * height + y) * width + x
+    base = flat[index].astype(np.float32)
+    blended = base + (colors[n] - base) * alpha[:, None]
+    flat[index] = np.clip(blended + 0.5, 0, 255).astype(np.uint8)
+    return out
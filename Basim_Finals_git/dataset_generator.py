@@ -0,0 +1,364 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import io
+import os
+import random
+import time
+
+import numpy as np
+from PIL import Image
+
+from compositing import composite, watermark_pixels
+from generator_cache import BackgroundCache, GlyphCache
+from shards import SHARD_PATTERN, ShardWriter
+
+IMAGE_EXTENSIONS = ('jpg', 'png', 'jpeg')
+
+# Per-process state, set once by _init_worker
+_options = None
+_caches = None
+
+
+def list_backgrounds(backgrounds_dir):
+    """Background image paths in a fixed order, so seeds map to the same files everywhere."""
+    return [
+        os.path.join(backgrounds_dir, f)
+        for f in sorted(os.listdir(backgrounds_dir))
+        if f.endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+def sample_rng(seed, index):
+    """Random generator for one sample; depends only on (seed, index), never on the worker."""
+    return random.Random(f"{seed}:{index}")
+
+
+def glyph_boxes(corners, ink, img_size):
+    """
+    Normalized YOLO boxes of glyph copies placed at `corners`.
+
+    Args:
+        corners: (cells, 2) array of (x, y) top-left corners of the glyph mask.
+        ink (tuple): (x0, y0, x1, y1) non-zero extent of the mask, see GlyphCache.glyph.
+        img_size (tuple): (width, height) of the image.
+
+    Returns:
+        (boxes, 4) array of (x_center, y_center, w, h); boxes are clipped to the
+        image and copies that fall entirely outside it are dropped.
+    """
+    width, height = img_size
+    x0 = np.clip(corners[:, 0] + ink[0], 0, width)
+    y0 = np.clip(corners[:, 1] + ink[1], 0, height)
+    x1 = np.clip(corners[:, 0] + ink[2], 0, width)
+    y1 = np.clip(corners[:, 1] + ink[3], 0, height)
+    visible = (x1 > x0) & (y1 > y0)
+    boxes = np.stack([(x0 + x1) / 2 / width, (y0 + y1) / 2 / height, (x1 - x0) / width, (y1 - y0) / height], axis=1)
+    return boxes[visible]
+
+
+def _worker_caches(options):
+    # Backgrounds and glyphs live for the whole process, not for one sample;
+    # they are rebuilt only when a later in-process run changes the settings
+    global _caches
+    key = (tuple(options["background_files"]), options["img_size"], options["cache_dir"], options["font_path"])
+    if _caches is None or _caches[0] != key:
+        _caches = (
+            key,
+            BackgroundCache(options["background_files"], options["img_size"], options["cache_dir"]),
+            GlyphCache(options["font_path"]),
+        )
+    return _caches[1:]
+
+
+def render_samples(indices, options):
+    """
+    Render a batch of watermarked images and their YOLO annotations.
+
+    Random choices are made per sample; the watermark layers of the whole
+    batch are then built and blended into the backgrounds in single
+    vectorised NumPy operations.
+
+    Args:
+        indices (list): Sample numbers; with options["seed"] they fix every random choice.
+        options (dict): Generator settings built by `generate_dataset`.
+
+    Returns:
+        (list of RGB PIL images, list of YOLO annotation line lists)
+    """
+    backgrounds, glyphs = _worker_caches(options)
+    width, height = options["img_size"]
+    symbol = options["symbol"]
+
+    batch = np.empty((len(indices), height, width, 3), dtype=np.uint8)
+    stamps, colors, annotations = [], [], []
+    for n, index in enumerate(indices):
+        rng = sample_rng(options["seed"], index)
+
+        # Randomly select grid dimensions and font size
+        rows = rng.randint(*options["rows_range"])
+        cols = rng.randint(*options["cols_range"])
+
+        # Select a background image, either at random or cycling through the directory
+        if options["background_order"] == "cycle":
+            bg_index = index % len(backgrounds)
+        else:
+            bg_index = rng.randrange(len(backgrounds))
+        batch[n] = backgrounds.array(bg_index)
+
+        # Calculate grid cell dimensions
+        cell_width = width // cols
+        cell_height = height // rows
+
+        # Without a font size range the font is sized to the grid cell
+        if options["font_size_range"]:
+            font_size = rng.randint(*options["font_size_range"])
+        else:
+            font_size = min(cell_width, cell_height) // 2
+
+        # Augmentation: rotation and colour per image, opacity and position jitter per cell
+        angle = round(rng.uniform(*options["rotation_range"]))
+        gray = rng.randint(*options["gray_range"])
+        cell_rng = np.random.default_rng(rng.getrandbits(64))
+        cells = rows * cols
+        opacity = cell_rng.uniform(*options["opacity_range"], cells) / 255.0
+        jitter = cell_rng.integers(-options["jitter"], options["jitter"] + 1, (cells, 2))
+
+        # Rasterized once per (symbol, font size, angle) and reused for every cell and image
+        glyph = glyphs.glyph(symbol, font_size, angle)
+        (left, top), (symbol_width, symbol_height) = glyph.offset, glyph.extent
+        vertical_offset = options["vertical_offset"]
+        if vertical_offset is None:
+            vertical_offset = symbol_height // 4
+
+        # Centre of every cell, row by row, plus jitter
+        xs, ys = np.meshgrid(
+            np.arange(cols) * cell_width + cell_width // 2,
+            np.arange(rows) * cell_height + cell_height // 2,
+        )
+        centers = np.stack([xs, ys], axis=-1).reshape(-1, 2) + jitter
+
+        # Offset to align symbol rendering (to handle baseline alignment issues),
+        # then from the text origin to the corner of the glyph mask
+        corners = centers - (symbol_width // 2 - left, symbol_height // 2 + vertical_offset - top)
+        stamps.append((n, glyph.mask, corners, opacity))
+        colors.append((gray, gray, gray))
+
+        # YOLO annotations from the exact extent of the rendered glyph
+        annotations.append([
+            f"{options['class_id']} {x:.6f} {y:.6f} {w:.6f} {h:.6f}"
+            for x, y, w, h in glyph_boxes(corners, glyph.ink, (width, height)).tolist()
+        ])
+
+    # Tile every overlay, then blend the whole batch with the backgrounds at once
+    pixels = watermark_pixels(stamps, (height, width))
+    images = composite(batch, pixels, colors, inplace=True)
+    return [Image.fromarray(image) for image in images], annotations
+
+
+def render_sample(index, options):
+    """Render one watermarked image; returns (RGB PIL image, YOLO annotation lines)."""
+    images, annotations = render_samples([index], options)
+    return images[0], annotations[0]
+
+
+def _init_worker(options):
+    global _options
+    _options = options
+
+
+def _generate_chunk(indices):
+    images, annotations = render_samples(indices, _options)
+    for index, image, lines in zip(indices, images, annotations):
+        name = f"{_options['prefix']}_{index + 1}"
+
+        # Save the image and its annotations
+        image.save(os.path.join(_options["images_dir"], f"{name}.jpg"))
+        with open(os.path.join(_options["labels_dir"], f"{name}.txt"), "w") as label_file:
+            label_file.write("\n".join(lines))
+    return len(indices)
+
+
+def _generate_shard(unit):
+    shard, indices = unit
+    path = os.path.join(
+        _options["output_dir"], SHARD_PATTERN.format(prefix=_options["prefix"], shard=shard)
+    )
+    with ShardWriter(path) as writer:
+        for start in range(0, len(indices), _options["chunksize"]):
+            chunk = indices[start:start + _options["chunksize"]]
+            images, annotations = render_samples(chunk, _options)
+            for index, image, lines in zip(chunk, images, annotations):
+                encoded = io.BytesIO()
+                image.save(encoded, format="JPEG")
+                writer.write(f"{_options['prefix']}_{index + 1}", encoded.getvalue(), "\n".join(lines))
+    return len(indices)
+
+
+def generate_dataset(
+    symbol, class_id, backgrounds_dir, output_dir, font_path,
+    num_images=10, img_size=(640, 640),
+    rows_range=(3, 6), cols_range=(3, 6), font_size_range=(40, 75),
+    background_order="random", vertical_offset=None, prefix="watermarked",
+    rotation_range=(0, 0), opacity_range=(128, 128), gray_range=(128, 128), jitter=0,
+    seed=0, workers=None, chunksize=8, report_every=500, cache_dir=None,
+    output_format="files", shard_size=1000,
+):
+    """
+    Generate watermarked images and YOLO labels across a pool of worker processes.
+
+    Sample `i` is rendered from its own generator seeded with (seed, i), so the
+    same seed always produces the same dataset whatever the number of workers.
+
+    Args:
+        symbol (str): The symbol to overlay.
+        class_id (int): YOLO class written to the labels.
+        backgrounds_dir (str): Directory containing background images.
+        output_dir (str): Directory to save generated images and annotations.
+        font_path (str): Path to the font file that supports the symbols.
+        num_images (int): Number of images to generate.
+        img_size (tuple): Size to which images will be resized.
+        rows_range (tuple): Range for the number of rows (min, max).
+        cols_range (tuple): Range for the number of columns (min, max).
+        font_size_range (tuple): Range for font size (min, max); None sizes the font to the grid cell.
+        background_order (str): "random", or "cycle" to walk the backgrounds in order.
+        vertical_offset (int): Pixels the symbol is raised by; None uses a quarter of its height.
+        prefix (str): File name prefix, e.g. "watermarked0".
+        rotation_range (tuple): Range of the watermark rotation in degrees (min, max).
+        opacity_range (tuple): Range of the per-symbol alpha, 0-255 (min, max).
+        gray_range (tuple): Range of the watermark grey level, 0-255 (min, max).
+        jitter (int): Largest random shift of each symbol from its cell centre, in pixels.
+        seed (int): Dataset seed.
+        workers (int): Worker processes; defaults to the CPU count, 1 runs in-process.
+        chunksize (int): Samples rendered together as one batch.
+        report_every (int): Print progress after this many images.
+        cache_dir (str): Where to keep the resized backgrounds as a memory-mapped stack
+            shared by all workers; None decodes each background once per worker instead.
+        output_format (str): "files" for images/ and labels/ directories, or "shards" for
+            tar shards of `shard_size` samples each (read them back with shards.ShardReader).
+        shard_size (int): Samples per shard; shard k always holds samples k*shard_size onwards.
+
+    Returns:
+        Dictionary with images, seconds and images_per_sec.
+    """
+    if output_format not in ("files", "shards"):
+        raise ValueError(f"Unknown output format {output_format!r}")
+
+    # Ensure the output directories exist
+    images_dir = os.path.join(output_dir, "images")
+    labels_dir = os.path.join(output_dir, "labels")
+    if output_format == "files":
+        os.makedirs(images_dir, exist_ok=True)
+        os.makedirs(labels_dir, exist_ok=True)
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+
+    background_files = list_backgrounds(backgrounds_dir)
+    if not background_files:
+        print("No background images found in the specified directory.")
+        return None
+
+    options = {
+        "symbol": symbol,
+        "class_id": class_id,
+        "background_files": background_files,
+        "font_path": font_path,
+        "img_size": tuple(img_size),
+        "rows_range": rows_range,
+        "cols_range": cols_range,
+        "font_size_range": font_size_range,
+        "background_order": background_order,
+        "vertical_offset": vertical_offset,
+        "prefix": prefix,
+        "rotation_range": rotation_range,
+        "opacity_range": opacity_range,
+        "gray_range": gray_range,
+        "jitter": int(jitter),
+        "seed": seed,
+        "images_dir": images_dir,
+        "labels_dir": labels_dir,
+        "output_dir": output_dir,
+        "chunksize": chunksize,
+        "cache_dir": cache_dir,
+    }
+
+    # Build the on-disk background stack once, before the workers map it
+    if cache_dir:
+        BackgroundCache(background_files, options["img_size"], cache_dir)
+    workers = workers or os.cpu_count() or 1
+
+    started = time.perf_counter()
+
+    def report(done):
+        elapsed = time.perf_counter() - started
+        print(f"{done}/{num_images} images, {done / max(elapsed, 1e-9):.1f} images/sec")
+
+    # Work units: batches of files, or whole shards with fixed sample ranges
+    if output_format == "shards":
+        generate = _generate_shard
+        units = [
+            (shard, range(start, min(start + shard_size, num_images)))
+            for shard, start in enumerate(range(0, num_images, shard_size))
+        ]
+    else:
+        generate = _generate_chunk
+        units = [range(i, min(i + chunksize, num_images)) for i in range(0, num_images, chunksize)]
+
+    executor = None
+    if workers == 1:
+        _init_worker(options)
+        results = map(generate, units)
+    else:
+        # Workers render and write their own samples; only indices travel between processes
+        executor = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(options,))
+        results = executor.map(generate, units)
+
+    done = 0
+    next_report = report_every
+    try:
+        for count in results:
+            done += count
+            if done >= next_report:
+                report(done)
+                next_report += report_every
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    elapsed = time.perf_counter() - started
+    report(done)
+    return {
+        "images": done,
+        "seconds": round(elapsed, 3),
+        "images_per_sec": round(done / max(elapsed, 1e-9), 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a watermarked YOLO dataset in parallel.")
+    parser.add_argument("symbol", help='Symbol to overlay, e.g. "☂"')
+    parser.add_argument("--class-id", type=int, default=0)
+    parser.add_argument("--num-images", type=int, default=1000)
+    parser.add_argument("--backgrounds", default="./backgrounds")
+    parser.add_argument("--output", default="./output")
+    parser.add_argument("--font", default="segoe-ui-symbol.ttf")
+    parser.add_argument("--img-size", type=int, nargs=2, default=(640, 640))
+    parser.add_argument("--prefix", default="watermarked")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--cache-dir", default=None, help="Keep resized backgrounds here, memory-mapped")
+    parser.add_argument("--rotation", type=float, default=0.0, help="Largest rotation either way, in degrees")
+    parser.add_argument("--opacity", type=int, nargs=2, default=(128, 128), help="Alpha range, 0-255")
+    parser.add_argument("--gray", type=int, nargs=2, default=(128, 128), help="Grey level range, 0-255")
+    parser.add_argument("--jitter", type=int, default=0, help="Largest shift from the cell centre, in pixels")
+    parser.add_argument("--format", choices=("files", "shards"), default="files")
+    parser.add_argument("--shard-size", type=int, default=1000, help="Samples per shard")
+    args = parser.parse_args()
+
+    generate_dataset(
+        args.symbol, args.class_id, args.backgrounds, args.output, args.font,
+        num_images=args.num_images, img_size=args.img_size, prefix=args.prefix,
+        rotation_range=(-args.rotation, args.rotation), opacity_range=tuple(args.opacity),
+        gray_range=tuple(args.gray), jitter=args.jitter,
+        seed=args.seed, workers=args.workers, cache_dir=args.cache_dir,
+        output_format=args.format, shard_size=args.shard_size,
+    )
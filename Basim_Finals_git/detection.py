@@ -0,0 +1,231 @@
+from collections import namedtuple
+import json
+
+import numpy as np
+
+DEFAULT_CONF_THRESHOLD = 0.5
+
+# Unfiltered model output for one image, as NumPy arrays
+RawDetections = namedtuple("RawDetections", ["class_ids", "confidences", "boxes"])
+
+EMPTY_DETECTIONS = RawDetections(
+    np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32), np.zeros((0, 4), dtype=np.float32)
+)
+
+
+def raw_detections(result):
+    """
+    Pull class ids, confidences and xyxy boxes out of a YOLO Results object.
+
+    The tensors are moved to the CPU once per image; nothing is filtered here,
+    so the same raw output can be re-thresholded (or cached) freely. Backends
+    that already return RawDetections are passed through unchanged.
+    """
+    if isinstance(result, RawDetections):
+        return result
+    boxes = result.boxes
+    if boxes is None:
+        return EMPTY_DETECTIONS
+    return RawDetections(
+        boxes.cls.cpu().numpy().astype(np.int64),
+        boxes.conf.cpu().numpy().astype(np.float32),
+        boxes.xyxy.cpu().numpy().astype(np.float32),
+    )
+
+
+def box_iou(box, boxes):
+    """IoU between one xyxy box and an (N, 4) array of xyxy boxes."""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def non_max_suppression(boxes, scores, class_ids, iou_threshold=0.7, max_det=300):
+    """
+    Class-aware greedy NMS over xyxy boxes.
+
+    Boxes of different classes are shifted apart by a per-class offset so one
+    pass suppresses within classes only.
+
+    Returns:
+        Indices of the kept boxes, highest score first.
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    offset = class_ids.astype(np.float32)[:, None] * (float(boxes.max()) + 1.0)
+    shifted = boxes + offset
+    order = np.argsort(-scores)
+    keep = []
+    while order.size and len(keep) < max_det:
+        best = order[0]
+        keep.append(best)
+        if order.size == 1:
+            break
+        overlap = box_iou(shifted[best], shifted[order[1:]])
+        order = order[1:][overlap <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def parse_class_thresholds(spec, class_names):
+    """
+    Parse per-class confidence thresholds from a request parameter.
+
+    Args:
+        spec (str): Either JSON ('{"lap1": 0.6}') or comma-separated pairs ("lap1=0.6,lap3=0.4").
+            Classes may be given by name or index.
+        class_names (dict): Class index -> name mapping of the model.
+
+    Returns:
+        Dictionary of class index -> threshold.
+
+    Raises:
+        ValueError: On malformed input, unknown classes or thresholds outside [0, 1].
+    """
+    if not spec:
+        return {}
+    spec = spec.strip()
+    if spec.startswith("{"):
+        pairs = json.loads(spec).items()
+    else:
+        pairs = [item.split("=", 1) for item in spec.split(",") if item.strip()]
+        if any(len(pair) != 2 for pair in pairs):
+            raise ValueError(f"Expected class=threshold pairs, got {spec!r}")
+
+    by_name = {name: index for index, name in class_names.items()}
+    thresholds = {}
+    for name, value in pairs:
+        name = str(name).strip()
+        if name in by_name:
+            index = by_name[name]
+        elif name.isdigit() and int(name) in class_names:
+            index = int(name)
+        else:
+            raise ValueError(f"Unknown class {name!r}")
+        try:
+            threshold = float(value)
+        except (TypeError, ValueError):
+            # JSON input can hold lists, objects or null where a number belongs
+            raise ValueError(f"Threshold for {name!r} must be a number, got {value!r}") from None
+        if not 0.0 <= threshold <= 1.0:
+            raise ValueError(f"Threshold for {name!r} must be between 0 and 1")
+        thresholds[index] = threshold
+    return thresholds
+
+
+class DetectionEngine:
+    """
+    Thresholding, class counting and box output shared by every entry point.
+
+    All post-processing works on the whole batch at once: the raw detections
+    of every image are concatenated, filtered against a per-class threshold
+    table with one comparison and counted with one `bincount`.
+    """
+
+    def __init__(self, class_names, conf_threshold=DEFAULT_CONF_THRESHOLD, class_thresholds=None):
+        """
+        Args:
+            class_names (dict): Class index -> name mapping (YOLO `model.names`).
+            conf_threshold (float): Default minimum confidence for every class.
+            class_thresholds (dict): Optional class index -> threshold overrides.
+        """
+        self.class_names = dict(class_names)
+        self.num_classes = max(self.class_names) + 1 if self.class_names else 0
+        self.conf_threshold = conf_threshold
+        self.class_thresholds = dict(class_thresholds or {})
+
+    def threshold_table(self, conf_threshold=None, class_thresholds=None):
+        """Per-class threshold array; request values override the engine defaults."""
+        default = self.conf_threshold if conf_threshold is None else conf_threshold
+        table = np.full(self.num_classes, default, dtype=np.float32)
+        for overrides in (self.class_thresholds, class_thresholds or {}):
+            for index, threshold in overrides.items():
+                table[index] = threshold
+        return table
+
+    def describe_thresholds(self, conf_threshold=None, class_thresholds=None):
+        """Human-readable thresholds in effect, e.g. "confidence >= 50% (lap1 >= 70%)"."""
+        default = self.conf_threshold if conf_threshold is None else conf_threshold
+        table = self.threshold_table(conf_threshold, class_thresholds)
+        overrides = [
+            f"{self.class_names.get(index, index)} >= {float(value) * 100:g}%"
+            for index, value in enumerate(table.tolist())
+            if abs(value - default) > 1e-6
+        ]
+        text = f"confidence >= {float(default) * 100:g}%"
+        return f"{text} ({', '.join(overrides)})" if overrides else text
+
+    def filter_batch(self, raws, conf_threshold=None, class_thresholds=None):
+        """
+        Keep the detections of a batch that clear their class threshold.
+
+        Args:
+            raws (list): One RawDetections per image.
+
+        Returns:
+            (image_index, class_ids, confidences, boxes) arrays over all kept detections.
+        """
+        lengths = [len(raw.class_ids) for raw in raws]
+        if not sum(lengths):
+            return (np.zeros(0, dtype=np.int64),) + tuple(EMPTY_DETECTIONS)
+
+        image_index = np.repeat(np.arange(len(raws)), lengths)
+        class_ids = np.concatenate([raw.class_ids for raw in raws])
+        confidences = np.concatenate([raw.confidences for raw in raws])
+        boxes = np.concatenate([raw.boxes.reshape(-1, 4) for raw in raws])
+
+        table = self.threshold_table(conf_threshold, class_thresholds)
+        keep = confidences >= table[class_ids]
+        return image_index[keep], class_ids[keep], confidences[keep], boxes[keep]
+
+    def _count(self, image_index, class_ids, num_images):
+        # One bincount over (image, class) pairs gives the whole count matrix
+        flat = np.bincount(
+            image_index * self.num_classes + class_ids,
+            minlength=num_images * self.num_classes,
+        )
+        return flat.reshape(num_images, self.num_classes)
+
+    def count_batch(self, raws, conf_threshold=None, class_thresholds=None):
+        """Return an (images, classes) matrix of kept-detection counts."""
+        image_index, class_ids, _, _ = self.filter_batch(raws, conf_threshold, class_thresholds)
+        return self._count(image_index, class_ids, len(raws))
+
+    def named_counts(self, counts):
+        """Turn a per-class count vector (or Counter of indices) into {class name: count}."""
+        if isinstance(counts, np.ndarray):
+            counts = {index: int(n) for index, n in enumerate(counts) if n}
+        return {self.class_names[index]: int(n) for index, n in counts.items() if n}
+
+    def summarize_batch(self, raws, conf_threshold=None, class_thresholds=None, return_boxes=False):
+        """
+        Build the per-image response payloads for a batch.
+
+        Returns:
+            One dictionary per image with "class_counts" and, if `return_boxes`,
+            a "detections" list of {"class", "confidence", "box"} entries.
+        """
+        image_index, class_ids, confidences, boxes = self.filter_batch(
+            raws, conf_threshold, class_thresholds
+        )
+        counts = self._count(image_index, class_ids, len(raws))
+        summaries = [{"class_counts": self.named_counts(row)} for row in counts]
+
+        if return_boxes:
+            for summary in summaries:
+                summary["detections"] = []
+            rounded_boxes = np.round(boxes.astype(np.float64), 1).tolist()
+            rounded_conf = np.round(confidences.astype(np.float64), 4).tolist()
+            for i, cls, conf, box in zip(image_index.tolist(), class_ids.tolist(), rounded_conf, rounded_boxes):
+                summaries[i]["detections"].append(
+                    {"class": self.class_names[cls], "confidence": conf, "box": box}
+                )
+        return summaries
+
+    def summarize(self, raw, conf_threshold=None, class_thresholds=None, return_boxes=False):
+        """Single-image convenience wrapper around `summarize_batch`."""
+        return self.summarize_batch([raw], conf_threshold, class_thresholds, return_boxes)[0]
@@ -0,0 +1,316 @@
+from collections import namedtuple
+import math
+import os
+import cv2
+import numpy as np
+
+try:
+    import av  # Optional: PyAV lets us skip non-keyframes inside the decoder
+except ImportError:
+    av = None
+
+from metrics import record_frames
+
+SAMPLING_MODES = ("interval", "scene", "keyframes", "coarse")
+
+# Used when the container reports no usable frame rate
+DEFAULT_FPS = 30.0
+
+# Seek threshold when the keyframe spacing cannot be measured (no PyAV)
+DEFAULT_SEEK_MIN_FRAMES = 90
+
+# OpenCV's FFmpeg backend seeks to this many frames before the target (then to the
+# keyframe before that) and decodes forward, backing off further if it overshoots
+OPENCV_SEEK_BACKOFF = 16
+
+SampledFrame = namedtuple("SampledFrame", ["index", "timestamp", "image"])
+
+
+def read_fps(cap):
+    """
+    Read a usable frame rate from an opened capture.
+
+    Returns:
+        The frame rate as a float, or None when the metadata is 0, NaN or absurd.
+    """
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not fps or fps != fps or fps <= 0 or fps > 1000:
+        return None
+    return float(fps)
+
+
+def keyframe_spacing(path, max_packets=600):
+    """
+    Longest run of frames between keyframes at the start of a video, by demuxing only.
+
+    A seek lands on the keyframe before its target and decodes forward from
+    there, so it only saves work over gaps at least this long.
+
+    Returns:
+        Frames per keyframe interval (a lower bound when no second keyframe turns
+        up in the first `max_packets` packets), or None without PyAV.
+    """
+    if av is None:
+        return None
+    try:
+        with av.open(path) as container:
+            if not container.streams.video:
+                return None
+            keyframes, packets = [], 0
+            for packet in container.demux(container.streams.video[0]):
+                if packet.size == 0:
+                    continue  # Flush packet at the end of the stream
+                if packet.is_keyframe:
+                    keyframes.append(packets)
+                packets += 1
+                if packets >= max_packets:
+                    break
+    except (av.error.FFmpegError, OSError):
+        return None
+    if not keyframes:
+        return packets or None
+    return max([b - a for a, b in zip(keyframes, keyframes[1:])] + [packets - keyframes[-1]])
+
+
+def coarse_to_fine(count):
+    """
+    Yield 0..count-1 coarse to fine: first, last, middle, then successive bisections.
+
+    Spread-out positions come first, so a question about the whole video is
+    usually settled after a handful of samples; every index is still visited
+    exactly once.
+    """
+    if count <= 0:
+        return
+    seen = bytearray(count)
+    last = count - 1
+    order = [0, last]
+    parts = 2
+    while parts < 2 * count:
+        order.extend(k * last // parts for k in range(1, parts, 2))
+        parts *= 2
+    for i in order + list(range(count)):
+        if not seen[i]:
+            seen[i] = 1
+            yield i
+
+
+class FrameSampler:
+    """
+    Pull a subset of frames out of a video, converting only the ones we keep.
+
+    Modes:
+        interval:  one frame every `interval_seconds`. Short gaps are crossed with
+                   `grab()`, which still decodes every frame and only skips the colour
+                   conversion. A seek decodes forward from the keyframe before its
+                   target, so only gaps longer than the keyframe spacing are seeked;
+                   with 1 s samples and the usual 1-10 s keyframe spacing most frames
+                   are still decoded.
+        scene:     frames whose content differs from the last emitted frame by more
+                   than `scene_threshold`, checked every `scene_check_seconds`.
+        keyframes: only the stream's keyframes, using PyAV's decoder-side skip when
+                   it is installed and falling back to `interval` otherwise.
+        coarse:    the `interval` grid visited coarse to fine (start, end, middle,
+                   then bisections) by seeking, for scans that stop early. Needs a
+                   seekable file with a frame count; otherwise it behaves like `interval`.
+
+    Paths are read through OpenCV. File-like sources (e.g. an upload that is
+    still arriving) are demuxed by PyAV, which only converts the sampled frames.
+    """
+
+    def __init__(self, mode="interval", interval_seconds=1.0, scene_threshold=0.12,
+                 scene_check_seconds=0.25, seek_min_frames=None):
+        """
+        Args:
+            mode (str): One of SAMPLING_MODES.
+            interval_seconds (float): Spacing between samples in interval mode.
+            scene_threshold (float): Mean absolute thumbnail difference (0-1) that counts as a cut.
+            scene_check_seconds (float): How often scene mode looks at a frame.
+            seek_min_frames (int): Gaps at least this long are crossed by seeking instead of
+                grabbing; defaults to the video's keyframe spacing (see `keyframe_spacing`)
+                plus OPENCV_SEEK_BACKOFF, or DEFAULT_SEEK_MIN_FRAMES when it cannot be measured.
+        """
+        if mode not in SAMPLING_MODES:
+            raise ValueError(f"Unknown sampling mode {mode!r}, expected one of {SAMPLING_MODES}")
+        # NaN and inf slip past a plain `<= 0` check and only fail once frames are read
+        if not all(math.isfinite(v) and v > 0 for v in (interval_seconds, scene_check_seconds)):
+            raise ValueError("Sampling intervals must be positive numbers")
+
+        self.mode = mode
+        self.interval_seconds = float(interval_seconds)
+        self.scene_threshold = float(scene_threshold)
+        self.scene_check_seconds = float(scene_check_seconds)
+        self.seek_min_frames = int(seek_min_frames) if seek_min_frames is not None else None
+        self.stats = {"frames_skipped": 0, "frames_decoded": 0, "frames_sampled": 0}
+
+    def frames(self, video_path):
+        """
+        Yield SampledFrame(index, timestamp, image) tuples for the selected frames.
+
+        Args:
+            video_path: Path (or URL) of the video to sample, or a readable binary file object.
+        """
+        self.stats = {"frames_skipped": 0, "frames_decoded": 0, "frames_sampled": 0}
+
+        is_path = isinstance(video_path, (str, os.PathLike))
+        if not is_path and av is None:
+            raise RuntimeError("Decoding from a stream requires PyAV (pip install av)")
+        try:
+            if not is_path or (self.mode == "keyframes" and av is not None):
+                yield from self._decode_av(video_path)
+                return
+
+            cap = cv2.VideoCapture(video_path)
+            if not cap.isOpened():
+                raise IOError(f"Cannot open video file: {video_path}")
+            self._seek_min = self.seek_min_frames
+            if self._seek_min is None:
+                spacing = keyframe_spacing(video_path)
+                # Shorter gaps would seek back behind the current frame and decode more than grab()
+                self._seek_min = spacing + OPENCV_SEEK_BACKOFF if spacing else DEFAULT_SEEK_MIN_FRAMES
+            try:
+                if self.mode == "scene":
+                    yield from self._scene(cap)
+                elif self.mode == "coarse":
+                    yield from self._coarse(cap)
+                else:
+                    yield from self._interval(cap, self.interval_seconds)
+            finally:
+                cap.release()
+        finally:
+            # Decoded vs sampled frame counters for /metrics
+            record_frames(self.stats)
+
+    def _step_frames(self, fps, seconds):
+        return max(1, int(round((fps or DEFAULT_FPS) * seconds)))
+
+    def _advance(self, cap, index, target, total):
+        """Move the capture from frame `index` to `target` without decoding the gap."""
+        gap = target - index
+        if gap >= self._seek_min and total > 0:
+            if target >= total:
+                return None
+            if cap.set(cv2.CAP_PROP_POS_FRAMES, target):
+                self.stats["frames_skipped"] += gap
+                return target
+        while index < target:
+            if not cap.grab():
+                return None
+            self.stats["frames_skipped"] += 1
+            index += 1
+        return index
+
+    def _read(self, cap, index, fps):
+        ok, frame = cap.read()
+        if not ok:
+            return None
+        self.stats["frames_decoded"] += 1
+        if fps:
+            timestamp = index / fps
+        else:
+            # No frame rate: trust the container clock, else assume DEFAULT_FPS
+            timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0 or index / DEFAULT_FPS
+        return SampledFrame(index, timestamp, frame)
+
+    def _interval(self, cap, seconds):
+        fps = read_fps(cap)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        step = self._step_frames(fps, seconds)
+        index = 0
+        while True:
+            sample = self._read(cap, index, fps)
+            if sample is None:
+                return
+            self.stats["frames_sampled"] += 1
+            yield sample
+            index = self._advance(cap, index + 1, sample.index + step, total)
+            if index is None:
+                return
+
+    def _coarse(self, cap):
+        fps = read_fps(cap)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        if total <= 0:
+            yield from self._interval(cap, self.interval_seconds)
+            return
+        grid = range(0, total, self._step_frames(fps, self.interval_seconds))
+        for position in coarse_to_fine(len(grid)):
+            index = grid[position]
+            if not cap.set(cv2.CAP_PROP_POS_FRAMES, index):
+                continue
+            # Frame counts can overstate the length; a failed read just skips the position
+            sample = self._read(cap, index, fps)
+            if sample is not None:
+                self.stats["frames_sampled"] += 1
+                yield sample
+
+    def _scene(self, cap):
+        fps = read_fps(cap)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        step = self._step_frames(fps, self.scene_check_seconds)
+        previous = None
+        index = 0
+        while True:
+            sample = self._read(cap, index, fps)
+            if sample is None:
+                return
+            thumb = thumbnail(sample.image)
+            if previous is None or np.abs(thumb - previous).mean() > self.scene_threshold:
+                previous = thumb
+                self.stats["frames_sampled"] += 1
+                yield sample
+            index = self._advance(cap, index + 1, sample.index + step, total)
+            if index is None:
+                return
+
+    def _decode_av(self, source):
+        try:
+            container = av.open(source)
+        except av.error.FFmpegError as exc:
+            raise IOError(f"Cannot open video: {exc}") from exc
+
+        with container:
+            if not container.streams.video:
+                raise IOError("No video stream found")
+            stream = container.streams.video[0]
+            if self.mode == "keyframes":
+                stream.codec_context.skip_frame = "NONKEY"
+            fps = float(stream.average_rate) if stream.average_rate else None
+            check_seconds = self.scene_check_seconds if self.mode == "scene" else self.interval_seconds
+            next_time = 0.0
+            previous = None
+
+            frames = enumerate(container.decode(stream))
+            while True:
+                # Corrupt data surfaces as IOError, the same as a capture OpenCV cannot read
+                try:
+                    position, frame = next(frames)
+                except StopIteration:
+                    return
+                except av.error.FFmpegError as exc:
+                    raise IOError(f"Cannot decode video: {exc}") from exc
+                self.stats["frames_decoded"] += 1
+                timestamp = frame.time if frame.time is not None else position / (fps or DEFAULT_FPS)
+                index = int(round(timestamp * (fps or DEFAULT_FPS)))
+
+                # Frames between samples are decoded by FFmpeg but never converted
+                if self.mode != "keyframes" and timestamp < next_time:
+                    self.stats["frames_skipped"] += 1
+                    continue
+                next_time = timestamp + check_seconds
+
+                image = frame.to_ndarray(format="bgr24")
+                if self.mode == "scene":
+                    thumb = thumbnail(image)
+                    if previous is not None and np.abs(thumb - previous).mean() <= self.scene_threshold:
+                        continue
+                    previous = thumb
+
+                self.stats["frames_sampled"] += 1
+                yield SampledFrame(index, timestamp, image)
+
+
+def thumbnail(frame):
+    """Small greyscale float image, cheap to compare between frames."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    return cv2.resize(gray, (64, 36), interpolation=cv2.INTER_AREA).astype(np.float32) / 255.0
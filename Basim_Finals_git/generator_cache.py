@@ -0,0 +1,122 @@
+from collections import namedtuple
+import hashlib
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# A rasterized symbol; see GlyphCache.glyph
+Glyph = namedtuple("Glyph", ["mask", "offset", "extent", "ink"])
+
+
+class BackgroundCache:
+    """
+    Background images decoded and resized once per target size.
+
+    Without `cache_dir` each process keeps the images it has used in memory.
+    With `cache_dir` all backgrounds are resized once into a single `.npy`
+    stack that every process memory-maps, so a pool of workers shares one
+    copy through the page cache and never decodes a JPEG again.
+    """
+
+    def __init__(self, paths, img_size, cache_dir=None):
+        """
+        Args:
+            paths (list): Background image files, in a fixed order.
+            img_size (tuple): (width, height) every background is resized to.
+            cache_dir (str): Directory for the memory-mapped stack; None keeps images in memory.
+        """
+        self.paths = list(paths)
+        self.img_size = tuple(img_size)
+        self._images = {}
+        self._stack = self._load_or_build(cache_dir) if cache_dir else None
+
+    def cache_path(self, cache_dir):
+        """File name of the stack; changes when a background or the target size does."""
+        digest = hashlib.sha256(f"RGB{self.img_size}".encode())
+        for path in self.paths:
+            stat = os.stat(path)
+            digest.update(f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+        width, height = self.img_size
+        return os.path.join(cache_dir, f"backgrounds_{width}x{height}_{digest.hexdigest()[:16]}.npy")
+
+    def _decode(self, path):
+        return np.asarray(Image.open(path).convert("RGB").resize(self.img_size))
+
+    def _load_or_build(self, cache_dir):
+        path = self.cache_path(cache_dir)
+        if not os.path.exists(path):
+            os.makedirs(cache_dir, exist_ok=True)
+            stack = np.stack([self._decode(p) for p in self.paths])
+            # Write then rename, so a process never maps a half-written file
+            partial = f"{path}.{os.getpid()}.tmp"
+            with open(partial, "wb") as f:
+                np.save(f, stack)
+            os.replace(partial, path)
+        return np.load(path, mmap_mode="r")
+
+    def __len__(self):
+        return len(self.paths)
+
+    def array(self, index):
+        """RGB background `index` as an (height, width, 3) uint8 array (read-only)."""
+        if self._stack is not None:
+            return self._stack[index]
+        if index not in self._images:
+            self._images[index] = self._decode(self.paths[index])
+        return self._images[index]
+
+    def image(self, index):
+        """RGB background `index` as a fresh PIL image, safe to draw on."""
+        return Image.fromarray(np.array(self.array(index)), "RGB")
+
+
+class GlyphCache:
+    """
+    Fonts and rasterized symbols, rendered once per (symbol, font size, angle).
+
+    Each glyph is kept as an "L" alpha mask plus the offset of its ink from
+    the text origin, so it can be stamped wherever `draw.text` would have
+    drawn it without rasterizing the text again.
+    """
+
+    def __init__(self, font_path):
+        self.font_path = font_path
+        self._fonts = {}
+        self._glyphs = {}
+
+    def font(self, font_size):
+        if font_size not in self._fonts:
+            self._fonts[font_size] = ImageFont.truetype(self.font_path, font_size)
+        return self._fonts[font_size]
+
+    def glyph(self, symbol, font_size, angle=0):
+        """
+        Args:
+            angle (int): Counter-clockwise rotation in whole degrees, about the glyph centre.
+
+        Returns:
+            Glyph(mask, offset, extent, ink): the alpha mask, the position of its
+            top-left corner relative to the text origin, the upright text extent
+            from the origin (what `draw.textsize` used to return) and the
+            (x0, y0, x1, y1) box of the mask's non-zero pixels.
+        """
+        key = (symbol, font_size, angle)
+        if key not in self._glyphs:
+            if angle:
+                upright = self.glyph(symbol, font_size)
+                mask = upright.mask.rotate(angle, resample=Image.BICUBIC, expand=True)
+                # Keep the ink centred where the upright glyph's was
+                left = upright.offset[0] + (upright.mask.width - mask.width) // 2
+                top = upright.offset[1] + (upright.mask.height - mask.height) // 2
+                extent = upright.extent
+            else:
+                font = self.font(font_size)
+                left, top, right, bottom = font.getbbox(symbol)
+                mask = Image.new("L", (max(1, right - left), max(1, bottom - top)), 0)
+                ImageDraw.Draw(mask).text((-left, -top), symbol, font=font, fill=255)
+                extent = (right, bottom)
+            # Tight box of the rendered (and rotated) ink, used for exact labels
+            ink = mask.getbbox() or (0, 0, 0, 0)
+            self._glyphs[key] = Glyph(mask, (left, top), extent, ink)
+        return self._glyphs[key]
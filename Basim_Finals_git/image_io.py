@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+
+from result_cache import content_key
+
+# Upload types the detector accepts and the largest body /detect will parse
+ALLOWED_IMAGE_TYPES = {"image/jpeg", "image/png", "image/bmp", "image/webp", "image/tiff"}
+MAX_IMAGE_BYTES = 25 * 1024 * 1024
+
+
+def decode_image_buffer(buffer):
+    """
+    Decode an encoded image held in memory into a BGR NumPy array.
+
+    Args:
+        buffer: Any object exposing the buffer protocol (bytes, bytearray, memoryview).
+
+    Returns:
+        The decoded BGR image, or None if the bytes are not a readable image.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if data.size == 0:
+        return None
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+
+def decode_image_stream(stream):
+    """
+    Decode an uploaded image straight from its stream, without touching disk.
+
+    In-memory streams (BytesIO) are decoded through a zero-copy view of their
+    buffer; anything else is read once into memory.
+
+    Args:
+        stream: File-like object positioned anywhere in the encoded image.
+
+    Returns:
+        The decoded BGR image, or None if the bytes are not a readable image.
+    """
+    if hasattr(stream, "getbuffer"):
+        view = stream.getbuffer()
+        try:
+            return decode_image_buffer(view)
+        finally:
+            # The stream cannot be closed while a view of it is still exported
+            view.release()
+
+    stream.seek(0)
+    return decode_image_buffer(stream.read())
+
+
+def upload_content_key(stream):
+    """Content hash of an uploaded image's encoded bytes, without copying in-memory uploads."""
+    if hasattr(stream, "getbuffer"):
+        view = stream.getbuffer()
+        try:
+            return content_key(view)
+        finally:
+            view.release()
+
+    stream.seek(0)
+    return content_key(stream.read())
@@ -0,0 +1,342 @@
+from concurrent.futures import Future
+import itertools
+import multiprocessing as mp
+from multiprocessing import connection, shared_memory
+import os
+import sys
+import threading
+
+import numpy as np
+
+from backends import _as_list, _load_image
+from detection import RawDetections
+from metrics import collect_stages, observe_stage
+
+
+def _attach(name):
+    # The parent owns (and unlinks) every segment. Workers share its resource
+    # tracker, so attaching before Python 3.13 only re-registers a known name.
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+def _limit_threads(threads):
+    # Must run before torch / onnxruntime are imported in the worker
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "ORT_INTRA_OP_THREADS"):
+        os.environ[var] = str(threads)
+
+
+def _worker_main(worker_id, backend, weights_path, threads, cpus, conn):
+    """Inference worker: pins itself, loads the model once, then serves batches from shared memory."""
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+    if threads:
+        _limit_threads(threads)
+
+    from backends import load_backend
+
+    try:
+        model = load_backend(backend, weights_path)
+    except Exception as exc:
+        conn.send(("error", worker_id, f"{type(exc).__name__}: {exc}"))
+        return
+    torch = sys.modules.get("torch")
+    if threads and torch is not None:
+        torch.set_num_threads(threads)
+    conn.send(("ready", worker_id, model.names))
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return  # The pool went away
+        if task is None:
+            return
+        task_id, shm_name, layout = task
+        shm = _attach(shm_name)
+        images = []
+        # The backend's preprocess/model/postprocess timings travel back with the results
+        with collect_stages() as stages:
+            try:
+                # Views straight into the shared block, no copy or unpickling of pixels
+                images = [
+                    np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+                    for offset, shape, dtype in layout
+                ]
+                raws = [tuple(raw) for raw in model(images)]
+                error = None
+            except Exception as exc:
+                raws, error = None, f"{type(exc).__name__}: {exc}"
+        try:
+            conn.send((task_id, raws, error, stages))
+        finally:
+            del images
+            shm.close()
+
+
+class _Worker:
+    # One worker process, its pipe and the tasks sent to it that have not come back
+    def __init__(self, worker_id, process, conn):
+        self.worker_id = worker_id
+        self.process = process
+        self.conn = conn
+        self.send_lock = threading.Lock()
+        self.tasks = set()
+        self.ready = False
+        self.failures = 0  # Restarts in a row that died before becoming ready
+        self.error = None  # Load error reported by the worker
+
+
+class InferencePool:
+    """
+    Pre-started inference worker processes, each holding its own model.
+
+    Batches are copied once into a shared-memory block and only its name and
+    layout cross the process boundary; workers read the frames in place.
+    Each batch goes to the worker with the fewest batches outstanding, so
+    throughput grows with the number of workers as long as there are cores
+    (and batches) to feed them.
+
+    A worker that dies (e.g. killed by the OOM killer) only fails the batches
+    it was holding; it is restarted in the background while the others keep
+    serving. A worker that keeps dying before its model loads is given up
+    on, and once no worker is left every call fails at once.
+    """
+
+    def __init__(self, num_workers=2, backend=None, weights_path="mark.pt",
+                 threads_per_worker=None, pin_cpus=False, task_timeout=300.0, max_restarts=3):
+        """
+        Args:
+            num_workers (int): Number of worker processes.
+            backend (str): Backend name passed to load_backend in each worker.
+            weights_path (str): Model weights each worker loads after it starts.
+            threads_per_worker (int): Intra-op threads per worker; defaults to cores / workers.
+            pin_cpus (bool): Pin each worker to its own block of `threads_per_worker` CPUs.
+            task_timeout (float): Seconds `__call__` waits for a batch; None waits forever.
+            max_restarts (int): Restarts in a row a worker may die in before it is given up on.
+        """
+        cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else list(range(os.cpu_count() or 1))
+        self.num_workers = max(1, int(num_workers))
+        self.threads_per_worker = int(threads_per_worker or max(1, len(cpus) // self.num_workers))
+        self.weights_path = weights_path
+        self.backend = backend
+        self.task_timeout = task_timeout
+        self.max_restarts = int(max_restarts)
+        self._cpus = cpus
+        self._pin_cpus = pin_cpus
+
+        # spawn: workers start from a clean interpreter, with no copied threads or locks
+        self._ctx = mp.get_context("spawn")
+        self._pending = {}  # task_id -> (future, shm, worker)
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._closing = False
+        self._broken = None
+
+        self._workers = [self._spawn(worker_id) for worker_id in range(self.num_workers)]
+
+        # Wait until every worker has loaded its model
+        self.names = None
+        for worker in self._workers:
+            connection.wait([worker.conn, worker.process.sentinel])
+            try:
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                message = ("error", worker.worker_id, "worker process exited")
+            if message[0] != "ready":
+                self._terminate()
+                raise RuntimeError(f"Inference worker {message[1]} failed to start: {message[2]}")
+            worker.ready = True
+            self.names = message[2]
+
+        self._collector = threading.Thread(target=self._collect, name="inference-results", daemon=True)
+        self._collector.start()
+
+    @property
+    def _processes(self):
+        return [worker.process for worker in self._workers]
+
+    def _spawn(self, worker_id):
+        worker_cpus = None
+        if self._pin_cpus:
+            start = (worker_id * self.threads_per_worker) % len(self._cpus)
+            worker_cpus = self._cpus[start:start + self.threads_per_worker] or self._cpus
+        # A pipe per worker: the pool always knows which worker holds which batch
+        conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self.backend, self.weights_path, self.threads_per_worker, worker_cpus, child_conn),
+            name=f"inference-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(worker_id, process, conn)
+
+    def submit(self, source):
+        """Send a batch to the least busy worker; returns a Future of its RawDetections list."""
+        if self._closing:
+            raise RuntimeError("InferencePool has been closed")
+        if self._broken is not None:
+            raise self._broken
+
+        images = [np.ascontiguousarray(_load_image(image)) for image in _as_list(source)]
+        total = sum(image.nbytes for image in images)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, total))
+
+        layout = []
+        offset = 0
+        for image in images:
+            np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf, offset=offset)[...] = image
+            layout.append((offset, image.shape, image.dtype.str))
+            offset += image.nbytes
+
+        task_id = next(self._ids)
+        future = Future()
+        with self._lock:
+            error = self._broken
+            if error is None:
+                # Prefer loaded workers; a restarting one queues the batch until its model is up
+                worker = min(self._workers, key=lambda w: (not w.ready, len(w.tasks)))
+                worker.tasks.add(task_id)
+                self._pending[task_id] = (future, shm, worker)
+        if error is not None:
+            self._release(shm)
+            raise error
+
+        try:
+            with worker.send_lock:
+                worker.conn.send((task_id, shm.name, layout))
+        except (OSError, ValueError) as exc:
+            # The worker died under us; the collector restarts it
+            self._finish(task_id, error=RuntimeError(f"Inference worker {worker.worker_id} unavailable: {exc}"))
+        return future
+
+    def __call__(self, source, timeout=None):
+        """Run a batch on a worker process and block for its RawDetections (up to `task_timeout`)."""
+        return self.submit(source).result(timeout if timeout is not None else self.task_timeout)
+
+    @staticmethod
+    def _release(shm):
+        shm.close()
+        shm.unlink()
+
+    def _finish(self, task_id, raws=None, error=None, stages=()):
+        # Worker-side stage timings land in this process's /metrics
+        for stage, seconds in stages:
+            observe_stage(stage, seconds)
+        with self._lock:
+            entry = self._pending.pop(task_id, None)
+            if entry is not None:
+                entry[2].tasks.discard(task_id)
+        if entry is None:
+            return
+        future, shm, _ = entry
+        self._release(shm)
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result([RawDetections(*raw) for raw in raws])
+
+    def _collect(self):
+        while not self._closing:
+            waitables = {}
+            for worker in list(self._workers):
+                waitables[worker.conn] = worker
+                waitables[worker.process.sentinel] = worker
+            # The timeout lets close() and restarts refresh the list
+            for ready in connection.wait(list(waitables), timeout=1.0):
+                worker = waitables[ready]
+                if ready is worker.conn:
+                    try:
+                        message = worker.conn.recv()
+                    except (EOFError, OSError):
+                        self._worker_died(worker)
+                        continue
+                    self._handle(worker, message)
+                elif worker in self._workers:
+                    self._worker_died(worker)
+
+    def _handle(self, worker, message):
+        if message[0] == "ready":
+            worker.ready = True
+            worker.failures = 0
+        elif message[0] == "error":
+            # A restarted worker could not load the model; its exit is handled as a death
+            worker.error = message[2]
+        else:
+            task_id, raws, error, stages = message
+            self._finish(task_id, raws, RuntimeError(error) if error is not None else None, stages)
+
+    def _worker_died(self, worker):
+        if worker not in self._workers:
+            return
+        # Results sent just before the exit are still in the pipe
+        try:
+            while worker.conn.poll():
+                self._handle(worker, worker.conn.recv())
+        except (EOFError, OSError):
+            pass
+        worker.process.join(timeout=1.0)
+        with worker.send_lock:
+            worker.conn.close()
+
+        reason = worker.error or f"exit code {worker.process.exitcode}"
+        error = RuntimeError(f"Inference worker {worker.worker_id} exited ({reason})")
+        with self._lock:
+            lost = list(worker.tasks)
+        for task_id in lost:
+            self._finish(task_id, error=error)
+        if self._closing:
+            return
+
+        failures = 0 if worker.ready else worker.failures + 1
+        if failures > self.max_restarts:
+            # Keeps dying before its model loads: give up on this slot
+            with self._lock:
+                self._workers.remove(worker)
+                if not self._workers:
+                    self._broken = RuntimeError(f"All inference workers failed; last error: {error}")
+            if self._broken is not None:
+                self._fail_pending(self._broken)
+            return
+
+        replacement = self._spawn(worker.worker_id)
+        replacement.failures = failures
+        with self._lock:
+            self._workers[self._workers.index(worker)] = replacement
+
+    def _fail_pending(self, exc):
+        with self._lock:
+            task_ids = list(self._pending)
+        for task_id in task_ids:
+            self._finish(task_id, error=exc)
+
+    def _terminate(self):
+        for process in self._processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
+
+    def close(self):
+        """Stop the workers and release any shared memory still in flight."""
+        self._closing = True
+        for worker in list(self._workers):
+            try:
+                with worker.send_lock:
+                    worker.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for process in self._processes:
+            process.join(timeout=10)
+        self._terminate()
+        collector = getattr(self, "_collector", None)
+        if collector is not None:
+            collector.join()
+        self._fail_pending(RuntimeError("InferencePool has been closed"))
+        for worker in self._workers:
+            worker.conn.close()
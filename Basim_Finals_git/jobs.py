@@ -0,0 +1,235 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    frames_processed INTEGER NOT NULL DEFAULT 0,
+    class_counts TEXT,
+    result TEXT,
+    error TEXT,
+    owner TEXT
+)
+"""
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Alive, just owned by another user
+    return True
+
+
+class JobStore:
+    """
+    SQLite-backed record of background jobs, so progress and results survive
+    a restart and can be fetched any number of times.
+
+    Every job records the process that runs it ("host:pid"), so several server
+    processes (or tools importing the API) can share one database; `recover()`
+    only fails jobs whose process is gone.
+    """
+
+    def __init__(self, db_path="jobs.sqlite3"):
+        """
+        Args:
+            db_path (str): SQLite database file, created on first use.
+        """
+        self.db_path = db_path
+        self.host = socket.gethostname()
+        self._lock = threading.Lock()
+        self._schema_lock = threading.Lock()
+        self._schema_ready = False
+
+    @property
+    def owner(self):
+        # Read per call, so a forked child records its own pid
+        return f"{self.host}:{os.getpid()}"
+
+    def _connect(self):
+        # The file and table are created by the first job operation, not when the API
+        # module is imported by a tool or test that never touches jobs
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    conn = sqlite3.connect(self.db_path, timeout=30)
+                    try:
+                        with conn:
+                            conn.execute(_SCHEMA)
+                            # Databases created before jobs had an owner
+                            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+                            if "owner" not in columns:
+                                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+                    finally:
+                        conn.close()
+                    self._schema_ready = True
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _query(self, sql, params=()):
+        conn = self._connect()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(sql, params)
+            finally:
+                conn.close()
+
+    def recover(self):
+        """
+        Fail the jobs left queued or running by a server process that has exited.
+
+        Call once at server start. Jobs of live processes on this host, and of
+        processes on other hosts sharing the database, are left alone; jobs
+        without an owner predate owner tracking and are failed as before.
+
+        Returns:
+            Number of jobs marked failed.
+        """
+        orphaned = []
+        for job_id, owner in self._query(
+            "SELECT id, owner FROM jobs WHERE status IN (?, ?)", (JOB_QUEUED, JOB_RUNNING)
+        ):
+            host, _, pid = (owner or "").rpartition(":")
+            if not owner or (host == self.host and pid.isdigit() and not _process_alive(int(pid))):
+                orphaned.append(job_id)
+        now = time.time()
+        for job_id in orphaned:
+            # Still in flight when its process died, so it will never finish
+            self._execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status IN (?, ?)",
+                (JOB_FAILED, "Interrupted by a server restart", now, job_id, JOB_QUEUED, JOB_RUNNING),
+            )
+        return len(orphaned)
+
+    def create(self, kind):
+        """Insert a new queued job owned by this process and return its id."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (id, kind, status, created_at, updated_at, owner) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, JOB_QUEUED, now, now, self.owner),
+        )
+        return job_id
+
+    def mark_running(self, job_id):
+        self._execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+            (JOB_RUNNING, time.time(), job_id),
+        )
+
+    def update_progress(self, job_id, frames_processed, class_counts):
+        """Record how far a running job has got and its partial class counts."""
+        self._execute(
+            "UPDATE jobs SET frames_processed = ?, class_counts = ?, updated_at = ? WHERE id = ?",
+            (frames_processed, json.dumps(class_counts), time.time(), job_id),
+        )
+
+    def complete(self, job_id, result, frames_processed=0, class_counts=None):
+        self._execute(
+            "UPDATE jobs SET status = ?, result = ?, frames_processed = ?, class_counts = ?, "
+            "updated_at = ? WHERE id = ?",
+            (JOB_DONE, json.dumps(result), frames_processed, json.dumps(class_counts or {}),
+             time.time(), job_id),
+        )
+
+    def fail(self, job_id, error):
+        self._execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (JOB_FAILED, str(error), time.time(), job_id),
+        )
+
+    def get(self, job_id):
+        """Return the job as a dictionary for clients, or None if the id is unknown."""
+        conn = self._connect()
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        # Which host and pid runs the job is internal to the servers sharing the database
+        del job["owner"]
+        job["class_counts"] = json.loads(job["class_counts"]) if job["class_counts"] else {}
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+
+class JobRunner:
+    """Run jobs on a worker pool and keep their state in a JobStore."""
+
+    def __init__(self, store, max_workers=2, progress_interval=0.5):
+        """
+        Args:
+            store (JobStore): Where job state is persisted.
+            max_workers (int): Number of jobs processed concurrently.
+            progress_interval (float): Minimum seconds between progress writes per job.
+        """
+        self.store = store
+        self.progress_interval = progress_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+
+    def submit(self, kind, func, cleanup=None):
+        """
+        Queue `func(report_progress)` as a new job and return its id at once.
+
+        Args:
+            kind (str): Label stored with the job, e.g. "video".
+            func: Callable taking a report_progress(frames_processed, class_counts)
+                callback and returning a JSON-serialisable result.
+            cleanup: Optional callable run after the job finishes either way.
+        """
+        job_id = self.store.create(kind)
+        self._executor.submit(self._run, job_id, func, cleanup)
+        return job_id
+
+    def _run(self, job_id, func, cleanup):
+        progress = {"written_at": 0.0, "frames_processed": 0, "class_counts": {}}
+
+        def report_progress(frames_processed, class_counts):
+            progress["frames_processed"] = frames_processed
+            progress["class_counts"] = dict(class_counts)
+            # Throttle writes so a fast job does not hammer the database
+            now = time.monotonic()
+            if now - progress["written_at"] >= self.progress_interval:
+                progress["written_at"] = now
+                self.store.update_progress(job_id, frames_processed, progress["class_counts"])
+
+        try:
+            self.store.mark_running(job_id)
+            result = func(report_progress)
+        except Exception as exc:
+            self.store.fail(job_id, exc)
+        else:
+            self.store.complete(
+                job_id, result, progress["frames_processed"], progress["class_counts"]
+            )
+        finally:
+            if cleanup is not None:
+                cleanup()
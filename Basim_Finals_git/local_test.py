@@ -1,38 +1,31 @@
-from ultralytics import YOLO
-from collections import Counter
+import cv2
 
-# Load a model
-model = YOLO("mark.pt")  # Load a custom model
+from backends import load_backend
+from model_registry import ModelRegistry
+from tiling import infer_image
 
-# Predict with the model
-results = model("checker.png")  # Predict on an image
-
-# Access the first result
-result = results[0]  # Extract the first (and only) Results object
-
-# Access the boxes attribute
-boxes = result.boxes  # Access the boxes attribute
+# Load a model (on first use, then warmed up once)
+model = ModelRegistry(
+    lambda path: load_backend(weights_path=path), "mark.pt",  # Load a custom model
+    engine_options={"conf_threshold": 0.5},
+)
 
-if boxes is not None:
-    # Extract class indices and confidence scores
-    class_indices = boxes.cls.cpu().numpy()  # Convert class indices to NumPy array
-    confidences = boxes.conf.cpu().numpy()   # Convert confidence scores to NumPy array
+# "auto" cuts large screenshots (1280px and up) into overlapping 640px tiles, which finds
+# more small symbols at the cost of several model passes; "on" / "off" force it
+TILE_MODE = "off"
 
-    # Filter objects with confidence >= 50%
-    valid_detections = [
-        int(cls) for cls, conf in zip(class_indices, confidences) if conf >= 0.5
-    ]
-
-    if valid_detections:
-        # Count classes with valid detections
-        class_names = result.names
-        class_counts = Counter(valid_detections)
-
-        # Print class counts
-        print("Class Counts (Confidence >= 50%):")
-        for class_index, count in class_counts.items():
-            print(f"{class_names[class_index]}: {count}")
-    else:
-        print("No objects detected with confidence >= 50%.")
+# Predict with the model
+image = cv2.imread("checker.png")  # Predict on an image
+raw = infer_image(model, image, TILE_MODE)
+
+# Threshold and count the detections (confidence >= 50%)
+summary = model.engine.summarize(raw)
+class_counts = summary["class_counts"]
+
+if class_counts:
+    # Print class counts
+    print("Class Counts (Confidence >= 50%):")
+    for class_name, count in class_counts.items():
+        print(f"{class_name}: {count}")
 else:
-    print("No detections found.")
+    print("No objects detected with confidence >= 50%.")
@@ -1,87 +1,87 @@
-from ultralytics import YOLO
-from collections import Counter
-import cv2
 import os
 
-# Load the YOLO model
-model = YOLO("mark.pt")  # Load your custom model
+from backends import load_backend
+from detection import DetectionEngine, raw_detections
+from frame_sampler import FrameSampler
+from model_registry import ModelRegistry
+from result_cache import content_key
+from video_pipeline import process_video_pipelined
 
+# The YOLO model, loaded (and warmed up) on first use so importing this module stays cheap
+model = ModelRegistry(lambda path: load_backend(weights_path=path), "mark.pt")  # Load your custom model
 
-def process_frame(image, model):
+
+def process_frame(image, model, cache=None, engine=None):
     """
     Process a single frame using the YOLO model.
     Args:
         image: Frame to process.
         model: Preloaded YOLO model.
+        cache: Optional ResultCache; repeated or near-identical frames skip the model.
+        engine: Optional DetectionEngine; defaults to a 50% threshold for every class.
 
     Returns:
         List of tuples containing class index and confidence for detections with confidence >= 50%.
     """
-    results = model(image)
-    result = results[0]  # Extract the first (and only) Results object
-    boxes = result.boxes  # Access the boxes attribute
-
-    if boxes is not None:
-        class_indices = boxes.cls.cpu().numpy()
-        confidences = boxes.conf.cpu().numpy()
-
-        # Filter objects with confidence >= 50%
-        valid_detections = [
-            (int(cls), float(conf))
-            for cls, conf in zip(class_indices, confidences) if conf >= 0.5
-        ]
-        return valid_detections
-    else:
-        return []
+    if engine is None:
+        engine = DetectionEngine(model.names)
+
+    raw = None
+    if cache is not None:
+        key = content_key(image)
+        raw = cache.get(key)
+        if raw is None:
+            raw = cache.get_similar(image)
 
+    if raw is None:
+        results = model(image)
+        raw = raw_detections(results[0])  # First (and only) Results object
+        if cache is not None:
+            cache.put(key, raw, image=image)
 
-def process_video(video_path, model):
+    _, class_indices, confidences, _ = engine.filter_batch([raw])
+    return list(zip(class_indices.tolist(), confidences.tolist()))
+
+
+def process_video(video_path, model, sampler=None, cache=None, engine=None):
     """
     Process a video file, extract 1 frame per second, and return aggregated detection results.
     Args:
         video_path: Path to the video file.
         model: Preloaded YOLO model.
+        sampler: Optional FrameSampler; defaults to one frame per second.
+        cache: Optional ResultCache shared across frames (and calls).
+        engine: Optional DetectionEngine; defaults to a 50% threshold for every class.
 
     Returns:
         Dictionary of aggregated class counts and confidences.
     """
-    cap = cv2.VideoCapture(video_path)
-    frame_rate = int(cap.get(cv2.CAP_PROP_FPS))  # Get the frame rate of the video
-    frame_count = 0
-    all_detections = []
-
-    if not cap.isOpened():
+    if sampler is None:
+        sampler = FrameSampler(mode="interval", interval_seconds=1.0)
+    if engine is None:
+        engine = DetectionEngine(model.names)
+
+    try:
+        # Decoding runs on its own thread, so it overlaps with inference
+        summary = process_video_pipelined(
+            video_path, model, engine, sampler=sampler, num_workers=1,
+            keep_detections=True, cache=cache,
+        )
+    except IOError:
         print("Error: Cannot open video file.")
         return {"message": "Failed to process video."}
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        if frame_count % frame_rate == 0:  # Extract 1 frame per second
-            detections = process_frame(frame, model)
-            all_detections.extend(detections)  # Collect all detections
-
-        frame_count += 1
-
-    cap.release()
-    cv2.destroyAllWindows()
-
+    all_detections = summary["detections"]
     if all_detections:
-        # Aggregate results
-        class_counts = Counter([cls for cls, _ in all_detections])
-        confidences = [(cls, conf) for cls, conf in all_detections]
-
         # Get class names
         result_names = model.names
 
-        # Format output
+        # Format output; counts were aggregated batch by batch in the pipeline
         return {
-            "class_counts": {result_names[cls]: count for cls, count in class_counts.items()},
+            "class_counts": engine.named_counts(summary["class_counts"]),
             "confidences": [
                 {"class": result_names[cls], "confidence": round(conf, 2)}
-                for cls, conf in confidences
+                for cls, conf in all_detections
             ]
         }
     else:
@@ -0,0 +1,297 @@
+import cProfile
+from contextlib import contextmanager
+import os
+import random
+import threading
+import time
+
+# Histogram buckets in seconds, from sub-millisecond stages to whole videos
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name} takes labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def _samples(self):
+        with self._lock:
+            return [(key, value) for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self._samples():
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. frames decoded."""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, e.g. requests in flight."""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    """Distribution of durations in cumulative buckets, plus their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def _samples(self):
+        # Copy the bucket counts so rendering never sees a half-updated histogram
+        with self._lock:
+            return [(key, (list(counts), total)) for key, (counts, total) in sorted(self._values.items())]
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total) in self._samples():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labels, key, [('le', _format_value(bound))])} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Named metrics rendered together in the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labels != metric.labels:
+                    raise ValueError(f"Metric {metric.name} already registered differently")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, description, labels=()):
+        return self._register(Counter(name, description, labels))
+
+    def gauge(self, name, description, labels=()):
+        return self._register(Gauge(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry served by the API's /metrics endpoint
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "wm_stage_seconds", "Time spent in each processing stage.", ["stage"]
+)
+VIDEO_FRAMES = REGISTRY.counter(
+    "wm_video_frames_total", "Video frames decoded, sampled for inference or skipped.", ["kind"]
+)
+
+
+# Per-thread list that collect_stages() fills in addition to STAGE_SECONDS
+_collected = threading.local()
+
+
+def observe_stage(stage, seconds):
+    """Record `seconds` spent in `stage`."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    stages = getattr(_collected, "stages", None)
+    if stages is not None:
+        stages.append((stage, seconds))
+
+
+@contextmanager
+def collect_stages():
+    """
+    Also collect the stages observed on this thread inside the block, as (stage, seconds) pairs.
+
+    An inference worker process sends them back with its results, so they reach
+    the /metrics of the process serving requests instead of the worker's own registry.
+    """
+    previous = getattr(_collected, "stages", None)
+    _collected.stages = stages = []
+    try:
+        yield stages
+    finally:
+        _collected.stages = previous
+
+
+@contextmanager
+def stage_timer(stage):
+    """Time the body of a `with` block as one observation of `stage`."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+
+def timed_iter(iterable, stage):
+    """
+    Yield from `iterable`, timing each step as one observation of `stage`.
+
+    Closing the returned generator also closes `iterable`, so a wrapped frame
+    generator still releases its capture when a scan stops early.
+    """
+    iterator = iter(iterable)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            observe_stage(stage, time.perf_counter() - started)
+            yield item
+    finally:
+        close = getattr(iterator, "close", None)
+        if close is not None:
+            close()
+
+
+def record_frames(stats):
+    """Add a FrameSampler's frame statistics to the frame counters."""
+    for kind, key in (("decoded", "frames_decoded"), ("sampled", "frames_sampled"), ("skipped", "frames_skipped")):
+        if stats.get(key):
+            VIDEO_FRAMES.inc(stats[key], kind=kind)
+
+
+class RequestProfiler:
+    """
+    Profile a random sample of requests with cProfile.
+
+    Each sampled request is written to `output_dir` as a .prof file (open it
+    with `python -m pstats` or snakeviz). Only one request is profiled at a
+    time, since cProfile cannot run twice at once. For whole-process views
+    without touching the code, `py-spy record --pid <pid>` works alongside.
+    """
+
+    def __init__(self, sample_rate=0.0, output_dir="profiles"):
+        """
+        Args:
+            sample_rate (float): Fraction of requests profiled, 0 disables profiling.
+            output_dir (str): Directory the .prof files are written to.
+        """
+        self.sample_rate = float(sample_rate)
+        self.output_dir = output_dir
+        self._busy = threading.Lock()
+        if self.sample_rate > 0:
+            os.makedirs(output_dir, exist_ok=True)
+
+    def start(self):
+        """Maybe start profiling the calling thread; returns a handle for `stop`, or None."""
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler (e.g. a debugger) is already attached
+            self._busy.release()
+            return None
+        return profile
+
+    def stop(self, profile, name):
+        """Stop a profile from `start` and write it as <name>-<time>.prof."""
+        if profile is None:
+            return None
+        try:
+            profile.disable()
+            safe_name = "".join(c if c.isalnum() else "_" for c in name).strip("_") or "request"
+            path = os.path.join(self.output_dir, f"{safe_name}-{time.time_ns()}.prof")
+            profile.dump_stats(path)
+            return path
+        finally:
+            self._busy.release()
@@ -0,0 +1,267 @@
+from concurrent.futures import wait
+import os
+import threading
+import time
+
+import numpy as np
+
+from detection import DetectionEngine
+from result_cache import weights_fingerprint
+
+# Model input size the warmup images are built at
+WARMUP_SIZE = 640
+
+
+def warm_up(model, runs=1, size=WARMUP_SIZE, batch_sizes=(1,)):
+    """
+    Run dummy images through a freshly loaded model so the first request is not a cold start.
+
+    The first calls build the inference graph and grow the allocator pools; doing
+    them here keeps that cost out of request latency. A model with worker
+    processes (InferencePool) gets one batch per worker in parallel.
+
+    Args:
+        model: Callable taking a list of images.
+        runs (int): Passes over every batch size.
+        size (int): Side of the square grey dummy images.
+        batch_sizes (tuple): Batch sizes to warm up, e.g. (1, 16) for the scheduler's largest batch.
+    """
+    dummy = np.full((size, size, 3), 114, dtype=np.uint8)
+    copies = getattr(model, "num_workers", 1) if hasattr(model, "submit") else 1
+    for _ in range(max(0, int(runs))):
+        for batch_size in batch_sizes:
+            batch = [dummy] * max(1, int(batch_size))
+            if copies > 1:
+                wait([model.submit(batch) for _ in range(copies)])
+            else:
+                model(batch)
+
+
+class ModelReplacedError(RuntimeError):
+    """A swap changed the class map under a run that had already read the old engine."""
+
+
+class ModelRegistry:
+    """
+    The serving model, loaded lazily and swappable without a restart.
+
+    The registry is itself the model callable (with `names` and
+    `weights_path`), so it can be handed to the BatchScheduler, the video
+    pipeline or `infer_image` in place of a backend. Nothing is loaded until
+    the first call, `load()` or `start_loading()`; each load is followed by a
+    warmup pass and only then does `ready` turn true. `swap()` loads and warms
+    new weights next to the old model, switches over atomically, and closes the
+    old model once its in-flight calls have finished. Every switch bumps
+    `generation`, so a caller can tell whether a swap happened mid-request.
+    """
+
+    def __init__(self, loader, weights_path="mark.pt", warmup_runs=1, warmup_batch_sizes=(1,),
+                 engine_options=None, on_load=None):
+        """
+        Args:
+            loader: Callable(weights_path) returning a model, e.g. a load_backend wrapper.
+            weights_path (str): Weights loaded first.
+            warmup_runs (int): Warmup passes after every load; 0 skips warmup.
+            warmup_batch_sizes (tuple): Batch sizes run during warmup.
+            engine_options (dict): Passed to the DetectionEngine built for each model.
+            on_load: Optional callback(registry, load_seconds) for each successful load,
+                e.g. to invalidate caches keyed by the model. It runs inside the switch,
+                before any call can reach the new model, so it must not block.
+        """
+        self.loader = loader
+        self.warmup_runs = int(warmup_runs)
+        self.warmup_batch_sizes = tuple(warmup_batch_sizes)
+        self.engine_options = engine_options or {}
+        self.on_load = on_load
+
+        self._weights_path = weights_path
+        self._model = None
+        self._engine = None
+        self._generation = 0
+        self._users = {}  # id(model) -> calls in flight
+        self._load_lock = threading.Lock()
+        self._state_lock = threading.Condition()
+        self._status = {
+            "state": "unloaded", "weights_path": weights_path, "load_seconds": None,
+            "warmup_seconds": None, "loaded_at": None, "error": None,
+        }
+
+    def _set_status(self, **values):
+        with self._state_lock:
+            self._status.update(values)
+
+    def _build(self, weights_path):
+        # Load and warm a model without touching the one being served
+        self._set_status(state="loading", error=None)
+        started = time.perf_counter()
+        model = self.loader(weights_path)
+        load_seconds = time.perf_counter() - started
+
+        self._set_status(state="warming")
+        started = time.perf_counter()
+        try:
+            warm_up(model, self.warmup_runs, WARMUP_SIZE, self.warmup_batch_sizes)
+        except Exception:
+            if hasattr(model, "close"):
+                model.close()
+            raise
+        return model, load_seconds, time.perf_counter() - started
+
+    def _install(self, model, weights_path, load_seconds, warmup_seconds):
+        engine = DetectionEngine(model.names, **self.engine_options)
+        with self._state_lock:
+            old = self._model
+            self._model, self._engine = model, engine
+            self._weights_path = weights_path
+            self._generation += 1
+            self._status.update(
+                state="ready", weights_path=weights_path, load_seconds=round(load_seconds, 3),
+                warmup_seconds=round(warmup_seconds, 3), loaded_at=time.time(), error=None,
+            )
+            # Calls pick their model under this lock, so caches keyed by the model are
+            # reset before the first result of the new one can reach them
+            if self.on_load is not None:
+                self.on_load(self, load_seconds)
+        if old is not None:
+            threading.Thread(target=self._retire, args=(old,), name="model-retire", daemon=True).start()
+
+    def _retire(self, model):
+        # Close a replaced model once no call is using it any more
+        with self._state_lock:
+            self._state_lock.wait_for(lambda: not self._users.get(id(model)))
+        close = getattr(model, "close", None)
+        if close is not None:
+            close()
+
+    def load(self):
+        """Load and warm the model now if it is not loaded yet; returns the model."""
+        if self._model is not None:
+            return self._model
+        with self._load_lock:
+            if self._model is None:
+                try:
+                    model, load_seconds, warmup_seconds = self._build(self._weights_path)
+                except Exception as exc:
+                    self._set_status(state="failed", error=str(exc))
+                    raise
+                self._install(model, self._weights_path, load_seconds, warmup_seconds)
+        return self._model
+
+    def start_loading(self):
+        """Load and warm the model on a background thread; poll `ready` (or /ready) for the outcome."""
+        def run():
+            try:
+                self.load()
+            except Exception:
+                pass  # recorded in status()
+
+        thread = threading.Thread(target=run, name="model-load", daemon=True)
+        thread.start()
+        return thread
+
+    def swap(self, weights_path=None):
+        """
+        Load new weights (or reload the current file) and switch to them.
+
+        The old model keeps serving while the new one loads and warms up; if
+        loading fails the old model stays in place and the error is raised.
+
+        Returns:
+            The registry status after the swap.
+        """
+        weights_path = weights_path or self._weights_path
+        with self._load_lock:
+            try:
+                model, load_seconds, warmup_seconds = self._build(weights_path)
+            except Exception as exc:
+                self._set_status(state="ready" if self._model is not None else "failed", error=str(exc))
+                raise
+            self._install(model, weights_path, load_seconds, warmup_seconds)
+        return self.status()
+
+    @property
+    def ready(self):
+        """True once a model is loaded and warmed up."""
+        return self._model is not None
+
+    @property
+    def model(self):
+        """The model currently served, loading it first if needed."""
+        return self.load()
+
+    @property
+    def engine(self):
+        """DetectionEngine for the current model's classes."""
+        self.load()
+        return self._engine
+
+    def current(self):
+        """(engine, generation) of the model serving right now, read together."""
+        self.load()
+        with self._state_lock:
+            return self._engine, self._generation
+
+    @property
+    def generation(self):
+        """Number of models installed so far; changes on every swap."""
+        return self._generation
+
+    def check_engine(self, engine):
+        """
+        Make sure the output of the model serving now can still be read with `engine`.
+
+        Long runs (videos, batch scans) read the engine once, while each of their
+        calls goes to the newest model.
+
+        Raises:
+            ModelReplacedError: If a swap installed a model with a different class map.
+        """
+        current = self._engine
+        if current is not engine and current.class_names != engine.class_names:
+            raise ModelReplacedError("The model was replaced by one with different classes; submit the request again")
+
+    @property
+    def names(self):
+        return self.load().names
+
+    @property
+    def weights_path(self):
+        return self._weights_path
+
+    @property
+    def fingerprint(self):
+        """Identity of the loaded weights, for caches keyed by model output."""
+        path = self._weights_path
+        if os.path.exists(path):
+            return weights_fingerprint(path)
+        return f"{path}#{self._generation}"
+
+    def __call__(self, source):
+        """Run the current model; a swap during the call does not affect it."""
+        self.load()
+        # Pick the model and register the call together, so a swap cannot retire it mid-call
+        with self._state_lock:
+            model = self._model
+            key = id(model)
+            self._users[key] = self._users.get(key, 0) + 1
+        try:
+            return model(source)
+        finally:
+            with self._state_lock:
+                self._users[key] -= 1
+                if not self._users[key]:
+                    del self._users[key]
+                    self._state_lock.notify_all()
+
+    def status(self):
+        """State, weights and load/warmup timings, as reported by /ready."""
+        with self._state_lock:
+            return dict(self._status, ready=self._model is not None)
+
+    def close(self):
+        with self._load_lock:
+            model, self._model = self._model, None
+        close = getattr(model, "close", None)
+        if close is not None:
+            close()
+        self._set_status(state="unloaded")
@@ -0,0 +1,218 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+
+def content_key(data):
+    """
+    Hash image content for exact-match lookups.
+
+    Args:
+        data: Encoded image bytes (any buffer) or a decoded NumPy image.
+
+    Returns:
+        Hex SHA-256 digest; decoded arrays also hash their shape and dtype.
+    """
+    digest = hashlib.sha256()
+    if isinstance(data, np.ndarray):
+        digest.update(f"{data.shape}{data.dtype}".encode())
+        data = np.ascontiguousarray(data)
+    digest.update(memoryview(data).cast("B"))
+    return digest.hexdigest()
+
+
+def perceptual_hash(image):
+    """
+    64-bit difference hash (dHash) of a BGR or greyscale image.
+
+    Near-duplicate frames (re-encodes, compression noise, tiny overlays) differ
+    in only a few bits, so the Hamming distance between hashes measures similarity.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def weights_fingerprint(weights_path):
+    """Identify a weights file by path, size and modification time."""
+    stat = os.stat(weights_path)
+    return f"{os.path.abspath(weights_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class ResultCache:
+    """
+    LRU cache of model outputs keyed by image content hash.
+
+    The key is usually computed from the encoded upload, so an exact hit skips
+    decoding as well as inference.
+
+    Entries expire after `ttl_seconds` and the least recently used one is
+    dropped once `max_entries` is reached. With `perceptual=True`, a miss on
+    the exact hash falls back to the closest stored perceptual hash within
+    `max_distance` bits, among entries stored under the same `namespace`
+    (results that are not interchangeable, e.g. tiled and whole-frame ones,
+    must not match each other). The cache empties itself whenever the model
+    fingerprint changes, or the file at `weights_path` does.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600.0, perceptual=False,
+                 max_distance=4, weights_path=None, check_interval=1.0):
+        """
+        Args:
+            max_entries (int): Largest number of results kept.
+            ttl_seconds (float): Lifetime of an entry; None or 0 keeps entries until evicted.
+            perceptual (bool): Also match near-duplicate images by perceptual hash.
+            max_distance (int): Largest Hamming distance counted as a near-duplicate.
+            weights_path (str): Model weights to watch; a changed file clears the cache.
+            check_interval (float): Minimum seconds between checks of `weights_path`.
+        """
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl_seconds) if ttl_seconds else None
+        self.perceptual = perceptual
+        self.max_distance = int(max_distance)
+        self.weights_path = weights_path
+        self.check_interval = check_interval
+
+        self._entries = OrderedDict()  # key -> (value, stored_at, (namespace, perceptual hash) or None)
+        self._lock = threading.Lock()
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._counters = {
+            "hits": 0, "misses": 0, "perceptual_hits": 0, "perceptual_misses": 0,
+            "evictions": 0, "invalidations": 0,
+        }
+
+        if weights_path is not None and os.path.exists(weights_path):
+            self._fingerprint = weights_fingerprint(weights_path)
+
+    def set_model_fingerprint(self, fingerprint):
+        """Declare which model produced new results; a different one clears the cache."""
+        with self._lock:
+            if fingerprint != self._fingerprint:
+                if self._fingerprint is not None:
+                    self._clear_locked()
+                self._fingerprint = fingerprint
+
+    @property
+    def fingerprint(self):
+        """Fingerprint of the model the cached results belong to; read it before inferring."""
+        return self._fingerprint
+
+    def clear(self):
+        with self._lock:
+            self._clear_locked()
+
+    def _clear_locked(self):
+        if self._entries:
+            self._counters["invalidations"] += 1
+        self._entries.clear()
+
+    def _check_weights(self):
+        if self.weights_path is None:
+            return
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return
+        self._checked_at = now
+        try:
+            fingerprint = weights_fingerprint(self.weights_path)
+        except OSError:
+            return
+        self.set_model_fingerprint(fingerprint)
+
+    def _expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def get(self, key):
+        """
+        Look up a stored result by exact content key.
+
+        Returns:
+            The cached value, or None on a miss.
+        """
+        self._check_weights()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at, _ = entry
+                if not self._expired(stored_at, now):
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return value
+                del self._entries[key]
+            self._counters["misses"] += 1
+            return None
+
+    def get_similar(self, image, namespace=None):
+        """
+        Look up the result of a near-duplicate image after an exact miss.
+
+        Args:
+            namespace: Only entries `put` under the same namespace can match.
+
+        Returns:
+            The cached value, or None if perceptual matching is off or nothing is close enough.
+        """
+        if not self.perceptual:
+            return None
+        phash = perceptual_hash(image)
+        now = time.monotonic()
+        with self._lock:
+            value = self._nearest_locked(phash, namespace, now)
+            self._counters["perceptual_hits" if value is not None else "perceptual_misses"] += 1
+            return value
+
+    def _nearest_locked(self, phash, namespace, now):
+        keys, hashes = [], []
+        for key, (_, stored_at, stored_hash) in self._entries.items():
+            if stored_hash is not None and stored_hash[0] == namespace and not self._expired(stored_at, now):
+                keys.append(key)
+                hashes.append(stored_hash[1])
+        if not hashes:
+            return None
+
+        # Hamming distance to every stored hash in one vectorised pass
+        xor = np.bitwise_xor(np.array(hashes, dtype=np.uint64), np.uint64(phash))
+        distances = np.unpackbits(xor.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+        best = int(np.argmin(distances))
+        if distances[best] > self.max_distance:
+            return None
+        self._entries.move_to_end(keys[best])
+        return self._entries[keys[best]][0]
+
+    def put(self, key, value, image=None, fingerprint=None, namespace=None):
+        """
+        Store a result under its content key (and perceptual hash, if enabled).
+
+        Args:
+            fingerprint (str): `fingerprint` as read before running the model; if the
+                model has been replaced since, the result is dropped instead of being
+                stored as the new model's.
+            namespace: Perceptual matches for this result are limited to `get_similar`
+                calls with the same namespace.
+        """
+        phash = (namespace, perceptual_hash(image)) if self.perceptual and image is not None else None
+        with self._lock:
+            if fingerprint is not None and fingerprint != self._fingerprint:
+                return
+            self._entries[key] = (value, time.monotonic(), phash)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the current size."""
+        with self._lock:
+            stats = dict(self._counters)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["hits"] + stats["perceptual_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
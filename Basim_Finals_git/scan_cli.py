@@ -0,0 +1,150 @@
+import argparse
+from collections import Counter
+import functools
+import json
+import os
+import sys
+import time
+
+from backends import BACKENDS, load_backend
+from batch_scan import scan_images, walk_images
+from model_registry import ModelRegistry
+from tiling import TILE_MODES
+
+
+def read_file(path):
+    with open(path, "rb") as image_file:
+        return image_file.read()
+
+
+def file_stamp(path):
+    # Size and modification time identify an unchanged file between runs
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def load_manifest(path, retry_errors=False):
+    """
+    Files already scanned according to an NDJSON results manifest.
+
+    Lines that cannot be parsed (e.g. the last line of an interrupted run) are
+    ignored, so those files are simply scanned again.
+
+    Args:
+        path (str): Manifest written by an earlier run.
+        retry_errors (bool): Treat files that failed last time as not scanned.
+
+    Returns:
+        Dict of file path -> (size, mtime_ns) at the time it was scanned.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as manifest:
+        for line in manifest:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if "file" not in record:
+                continue
+            if retry_errors and "error" in record:
+                done.pop(record["file"], None)
+            else:
+                done[record["file"]] = (record.get("size"), record.get("mtime_ns"))
+    return done
+
+
+def open_manifest(path):
+    """Open the manifest for appending, finishing a line cut off by an interrupted run."""
+    manifest = open(path, "a+", encoding="utf-8")
+    if manifest.tell():
+        manifest.seek(manifest.tell() - 1)
+        if manifest.read(1) != "\n":
+            manifest.write("\n")
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Detect watermarks in every image under the given directories, files or glob patterns."
+    )
+    parser.add_argument("paths", nargs="+", help="Directories, image files or quoted glob patterns")
+    parser.add_argument("--output", default="scan_results.ndjson",
+                        help="NDJSON results manifest; an existing one is resumed. '-' writes to stdout")
+    parser.add_argument("--backend", default=os.environ.get("MODEL_BACKEND", "torch"),
+                        help=f"One of {', '.join(BACKENDS)}")
+    parser.add_argument("--weights", default=os.environ.get("MODEL_PATH", "mark.pt"))
+    parser.add_argument("--batch-size", type=int, default=16, help="Images per inference call")
+    parser.add_argument("--decode-workers", type=int, default=4, help="Threads reading and decoding images")
+    parser.add_argument("--tile", default="off", choices=TILE_MODES,
+                        help="auto tiles images of 1280px and up: slower, counts more small symbols")
+    parser.add_argument("--conf", type=float, default=None, help="Confidence threshold")
+    parser.add_argument("--boxes", action="store_true", help="Include detection boxes in the results")
+    parser.add_argument("--no-recursive", action="store_true", help="Do not descend into subdirectories")
+    parser.add_argument("--retry-errors", action="store_true", help="Scan files that failed last time again")
+    args = parser.parse_args()
+
+    files = walk_images(args.paths, recursive=not args.no_recursive)
+    to_stdout = args.output == "-"
+    done = {} if to_stdout else load_manifest(args.output, args.retry_errors)
+
+    # Skip files whose size and modification time match the manifest
+    todo = []
+    for path in files:
+        try:
+            stamp = file_stamp(path)
+        except OSError:
+            continue
+        if done.get(path) != stamp:
+            todo.append((path, stamp))
+    print(f"{len(files)} images found, {len(files) - len(todo)} already scanned, {len(todo)} to scan",
+          file=sys.stderr)
+    if not todo:
+        sys.exit(0)
+
+    model = ModelRegistry(
+        lambda path: load_backend(args.backend, path), args.weights, warmup_batch_sizes=(args.batch_size,),
+    )
+    stamps = dict(todo)
+    sources = ((path, functools.partial(read_file, path)) for path, _ in todo)
+
+    output = sys.stdout if to_stdout else open_manifest(args.output)
+    totals = Counter()
+    scanned = errors = 0
+    started = time.perf_counter()
+    try:
+        for result in scan_images(
+            sources,
+            model,
+            model.engine,
+            batch_size=args.batch_size,
+            decode_workers=args.decode_workers,
+            tile_mode=args.tile,
+            conf_threshold=args.conf,
+            return_boxes=args.boxes,
+        ):
+            size, mtime_ns = stamps[result["file"]]
+            output.write(json.dumps({**result, "size": size, "mtime_ns": mtime_ns}) + "\n")
+            # Flush every line so an interrupted scan resumes from the last finished file
+            output.flush()
+
+            scanned += 1
+            if "error" in result:
+                errors += 1
+            else:
+                totals.update(result["class_counts"])
+            if scanned % 100 == 0:
+                rate = scanned / (time.perf_counter() - started)
+                print(f"{scanned}/{len(todo)} images ({rate:.1f} images/s)", file=sys.stderr)
+    except KeyboardInterrupt:
+        print(f"Interrupted after {scanned} images; run again to resume", file=sys.stderr)
+    finally:
+        if not to_stdout:
+            output.close()
+        model.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"Scanned {scanned} images in {elapsed:.1f}s ({scanned / max(elapsed, 1e-9):.1f} images/s), "
+          f"{errors} errors", file=sys.stderr)
+    print(json.dumps({"class_counts": dict(totals)}), file=sys.stderr)
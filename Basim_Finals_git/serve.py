@@ -0,0 +1,54 @@
+import argparse
+import os
+
+try:
+    from waitress import serve as waitress_serve  # Optional: production WSGI server
+except ImportError:
+    waitress_serve = None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the detection API with one model instance per worker process."
+    )
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("INFERENCE_WORKERS", 0)) or os.cpu_count() // 2 or 1,
+                        help="Inference worker processes (default: half the cores)")
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="Intra-op threads per worker (default: cores / workers)")
+    parser.add_argument("--pin", action="store_true", help="Pin each worker to its own CPUs")
+    parser.add_argument("--backend", default=None, help="torch, onnx, openvino or stub (default: $MODEL_BACKEND)")
+    parser.add_argument("--weights", default=None, help="Model weights (default: $MODEL_PATH or mark.pt)")
+    parser.add_argument("--http-threads", type=int, default=32, help="Threads accepting HTTP requests")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=6001)
+    args = parser.parse_args()
+
+    # The API module builds its model at import time from these settings
+    os.environ["INFERENCE_WORKERS"] = str(max(1, args.workers))
+    if args.threads_per_worker:
+        os.environ["THREADS_PER_WORKER"] = str(args.threads_per_worker)
+    if args.pin:
+        os.environ["PIN_WORKERS"] = "1"
+    if args.backend:
+        os.environ["MODEL_BACKEND"] = args.backend
+    if args.weights:
+        os.environ["MODEL_PATH"] = args.weights
+
+    from api_deployed_pv import app, job_store, model
+
+    # Jobs left unfinished by an earlier server process that has exited
+    job_store.recover()
+    # Workers start and warm up in the background; GET /ready turns 200 once they have
+    model.start_loading()
+    print(f"Loading {model.weights_path} into {os.environ['INFERENCE_WORKERS']} inference workers")
+    try:
+        if waitress_serve is not None:
+            waitress_serve(app, host=args.host, port=args.port, threads=args.http_threads)
+        else:
+            app.run(host=args.host, port=args.port, threaded=True)
+    finally:
+        model.close()
+
+
+if __name__ == "__main__":
+    main()
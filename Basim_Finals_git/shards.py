@@ -0,0 +1,190 @@
+from collections import namedtuple
+import glob
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+
+import numpy as np
+
+from image_io import decode_image_buffer
+
+# One training sample: encoded image bytes and its YOLO label text
+Sample = namedtuple("Sample", ["key", "image", "label"])
+
+SHARD_PATTERN = "{prefix}-{shard:05d}.tar"
+INDEX_SUFFIX = ".idx.json"
+
+
+class ShardWriter:
+    """
+    Write samples into one tar shard, WebDataset style.
+
+    Each sample becomes two members, `<key>.jpg` and `<key>.txt`, written
+    through a large file buffer so a shard turns into a few big writes
+    rather than thousands of small files. Next to the shard, an index of
+    member offsets allows random access without scanning the tar.
+    """
+
+    def __init__(self, path, buffer_size=8 << 20):
+        """
+        Args:
+            path (str): Shard file to create, e.g. "output/watermarked-00000.tar".
+            buffer_size (int): Bytes buffered before each write to disk.
+        """
+        self.path = path
+        self._partial = f"{path}.{os.getpid()}.tmp"
+        self._file = open(self._partial, "wb", buffering=buffer_size)
+        self._tar = tarfile.open(fileobj=self._file, mode="w", format=tarfile.USTAR_FORMAT)
+        self._index = []
+
+    def _add_member(self, name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = 0  # keep shards byte-identical across runs
+        # The member's data starts right after its header block(s)
+        header = info.tobuf(self._tar.format, self._tar.encoding, self._tar.errors)
+        data_offset = self._tar.offset + len(header)
+        self._tar.addfile(info, io.BytesIO(data))
+        return data_offset, info.size
+
+    def write(self, key, image_bytes, label):
+        """Append one sample: encoded JPEG bytes and its YOLO label text."""
+        image_offset, image_size = self._add_member(f"{key}.jpg", image_bytes)
+        label_offset, label_size = self._add_member(f"{key}.txt", label.encode())
+        self._index.append([key, image_offset, image_size, label_offset, label_size])
+
+    def close(self):
+        """Finish the tar and its index; the shard only appears under its name once complete."""
+        self._tar.close()
+        self._file.close()
+        os.replace(self._partial, self.path)
+        with open(self.path + INDEX_SUFFIX, "w") as index_file:
+            json.dump({"shard": os.path.basename(self.path), "samples": self._index}, index_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._tar.close()
+            self._file.close()
+            os.remove(self._partial)
+
+
+def _scan_index(path):
+    # Rebuild a missing index by walking the tar headers
+    members = {}
+    with tarfile.open(path, "r") as tar:
+        for info in tar:
+            key, ext = os.path.splitext(info.name)
+            members.setdefault(key, {})[ext] = (info.offset_data, info.size)
+    return [
+        [key, *parts[".jpg"], *parts[".txt"]]
+        for key, parts in members.items()
+        if ".jpg" in parts and ".txt" in parts
+    ]
+
+
+class ShardReader:
+    """
+    Read samples back from a set of shards.
+
+    Iteration streams each shard front to back; indexing (`reader[i]`) reads
+    a single sample straight from its offset. Access is thread-safe.
+    """
+
+    def __init__(self, source):
+        """
+        Args:
+            source: Directory of shards, a glob pattern, or a list of shard paths.
+        """
+        if isinstance(source, (list, tuple)):
+            paths = list(source)
+        elif os.path.isdir(source):
+            paths = glob.glob(os.path.join(source, "*.tar"))
+        else:
+            paths = glob.glob(source)
+        self.paths = sorted(paths)
+
+        # Flat index over all shards: (shard number, key, image offset/size, label offset/size)
+        self._entries = []
+        for shard, path in enumerate(self.paths):
+            if os.path.exists(path + INDEX_SUFFIX):
+                with open(path + INDEX_SUFFIX) as index_file:
+                    samples = json.load(index_file)["samples"]
+            else:
+                samples = _scan_index(path)
+            self._entries.extend((shard, *sample) for sample in samples)
+
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _read(self, shard, offset, size):
+        with self._lock:
+            handle = self._files.get(shard)
+            if handle is None:
+                handle = self._files[shard] = open(self.paths[shard], "rb")
+            handle.seek(offset)
+            return handle.read(size)
+
+    def __getitem__(self, i):
+        """Random access to sample `i` (in shard order)."""
+        shard, key, image_offset, image_size, label_offset, label_size = self._entries[i]
+        image = self._read(shard, image_offset, image_size)
+        label = self._read(shard, label_offset, label_size).decode()
+        return Sample(key, image, label)
+
+    def __iter__(self):
+        """Stream every sample, reading each shard sequentially."""
+        for path in self.paths:
+            pending = {}
+            with tarfile.open(path, "r|") as tar:
+                for info in tar:
+                    key, ext = os.path.splitext(info.name)
+                    pending.setdefault(key, {})[ext] = tar.extractfile(info).read()
+                    parts = pending[key]
+                    if ".jpg" in parts and ".txt" in parts:
+                        del pending[key]
+                        yield Sample(key, parts[".jpg"], parts[".txt"].decode())
+
+    def close(self):
+        with self._lock:
+            for handle in self._files.values():
+                handle.close()
+            self._files.clear()
+
+
+def decode_sample(sample):
+    """
+    Decode a sample for training or benchmarking.
+
+    Returns:
+        (BGR NumPy image, (N, 5) float32 array of class, x_center, y_center, w, h)
+    """
+    image = decode_image_buffer(sample.image)
+    labels = np.array(
+        [line.split() for line in sample.label.splitlines() if line.strip()], dtype=np.float32
+    ).reshape(-1, 5)
+    return image, labels
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or time reading a set of dataset shards.")
+    parser.add_argument("source", help="Shard directory or glob pattern")
+    args = parser.parse_args()
+
+    reader = ShardReader(args.source)
+    started = time.perf_counter()
+    count = sum(1 for _ in reader)
+    elapsed = time.perf_counter() - started
+    print(f"{len(reader.paths)} shards, {count} samples, streamed at {count / max(elapsed, 1e-9):.1f} samples/sec")
@@ -0,0 +1,129 @@
+import numpy as np
+
+from detection import RawDetections, non_max_suppression, raw_detections
+
+TILE_MODES = ("off", "on", "auto")
+DEFAULT_TILE_SIZE = 640
+DEFAULT_OVERLAP = 0.25
+
+# "auto" tiles once the model would shrink the image by at least this factor
+DEFAULT_MIN_SCALE = 2.0
+
+
+def _starts(length, tile_size, stride):
+    if length <= tile_size:
+        return [0]
+    # Regular steps, plus one tile flush with the far edge
+    return list(range(0, length - tile_size, stride)) + [length - tile_size]
+
+
+def tile_grid(shape, tile_size=DEFAULT_TILE_SIZE, overlap=DEFAULT_OVERLAP):
+    """
+    Top-left corners of overlapping tiles covering an image.
+
+    Args:
+        shape (tuple): Image shape (height, width, ...).
+        tile_size (int): Side of the square tiles, normally the model input size.
+        overlap (float): Fraction of a tile shared with its neighbour.
+
+    Returns:
+        List of (x, y) tile origins, row by row.
+    """
+    height, width = shape[:2]
+    stride = max(1, int(tile_size * (1.0 - overlap)))
+    return [
+        (x, y)
+        for y in _starts(height, tile_size, stride)
+        for x in _starts(width, tile_size, stride)
+    ]
+
+
+def should_tile(shape, mode="auto", tile_size=DEFAULT_TILE_SIZE, min_scale=DEFAULT_MIN_SCALE):
+    """
+    Decide whether an image is inferred in tiles.
+
+    Args:
+        mode (str): "on", "off", or "auto" to tile only images whose longer side
+            is at least `min_scale` times the tile size.
+    """
+    if mode not in TILE_MODES:
+        raise ValueError(f"Unknown tile mode {mode!r}, expected one of {TILE_MODES}")
+    longest = max(shape[:2])
+    if mode == "on":
+        return longest > tile_size
+    if mode == "auto":
+        return longest >= tile_size * min_scale
+    return False
+
+
+def infer_tiled(infer_batch, image, tile_size=DEFAULT_TILE_SIZE, overlap=DEFAULT_OVERLAP,
+                iou_threshold=0.5, include_full=True, edge_margin=2, max_det=1000):
+    """
+    Detect small objects in a large image by running the model on overlapping tiles.
+
+    All tiles (and, with `include_full`, the whole image for symbols larger than
+    a tile) go to the model as one batch. Boxes cut by an inner tile edge are
+    dropped, since the overlap shows those objects whole in a neighbouring
+    tile; the rest are moved to image coordinates and merged with class-aware NMS.
+
+    Args:
+        infer_batch: Callable mapping a list of images to one result per image.
+        image: BGR NumPy image.
+        tile_size (int): Side of the square tiles.
+        overlap (float): Fraction of a tile shared with its neighbour; should
+            exceed the size of the objects looked for.
+        iou_threshold (float): IoU above which boxes from different tiles are duplicates.
+        include_full (bool): Also run the whole (downscaled) image.
+        edge_margin (int): Pixels from an inner tile edge within which a box counts as cut.
+        max_det (int): Largest number of boxes kept.
+
+    Returns:
+        RawDetections in the coordinates of `image`.
+    """
+    height, width = image.shape[:2]
+    origins = tile_grid(image.shape, tile_size, overlap)
+    batch = [image[y:y + tile_size, x:x + tile_size] for x, y in origins]
+    if include_full:
+        batch.append(image)
+    raws = [raw_detections(result) for result in infer_batch(batch)]
+
+    class_ids, confidences, boxes = [], [], []
+    for (x, y), tile, raw in zip(origins, batch, raws):
+        tile_h, tile_w = tile.shape[:2]
+        tile_boxes = raw.boxes.reshape(-1, 4)
+        cut = (
+            ((tile_boxes[:, 0] <= edge_margin) & (x > 0))
+            | ((tile_boxes[:, 1] <= edge_margin) & (y > 0))
+            | ((tile_boxes[:, 2] >= tile_w - edge_margin) & (x + tile_w < width))
+            | ((tile_boxes[:, 3] >= tile_h - edge_margin) & (y + tile_h < height))
+        )
+        keep = ~cut
+        class_ids.append(raw.class_ids[keep])
+        confidences.append(raw.confidences[keep])
+        boxes.append(tile_boxes[keep] + np.array([x, y, x, y], dtype=np.float32))
+    if include_full:
+        full = raws[-1]
+        class_ids.append(full.class_ids)
+        confidences.append(full.confidences)
+        boxes.append(full.boxes.reshape(-1, 4))
+
+    class_ids = np.concatenate(class_ids).astype(np.int64)
+    confidences = np.concatenate(confidences).astype(np.float32)
+    boxes = np.concatenate(boxes).astype(np.float32)
+
+    # Objects seen by several overlapping tiles collapse to their best box
+    kept = non_max_suppression(boxes, confidences, class_ids, iou_threshold, max_det)
+    return RawDetections(class_ids[kept], confidences[kept], boxes[kept])
+
+
+def infer_image(infer_batch, image, mode="off", tile_size=DEFAULT_TILE_SIZE,
+                min_scale=DEFAULT_MIN_SCALE, **options):
+    """
+    Run one image whole or in tiles, depending on `mode` and its resolution.
+
+    Returns:
+        RawDetections for the image.
+    """
+    if should_tile(image.shape, mode, tile_size, min_scale):
+        return infer_tiled(infer_batch, image, tile_size, **options)
+    return raw_detections(infer_batch([image])[0])
@@ -0,0 +1,231 @@
+from collections import Counter
+import math
+
+import numpy as np
+
+from detection import box_iou
+from frame_sampler import FrameSampler, thumbnail
+from metrics import timed_iter
+from video_pipeline import infer_with_cache
+
+# Mean absolute thumbnail difference (0-1) below which a frame counts as unchanged
+DEFAULT_DELTA_THRESHOLD = 0.02
+
+# Shortest time a track survives unseen; track_video stretches it to cover
+# GAP_SAMPLES sampling intervals, so sparse sampling does not retire every track
+DEFAULT_MAX_GAP_SECONDS = 3.0
+GAP_SAMPLES = 2.5
+
+
+class Track:
+    """One watermark instance followed across frames."""
+
+    def __init__(self, track_id, class_id, box, confidence, timestamp):
+        self.track_id = track_id
+        self.class_id = class_id
+        self.box = box
+        self.confidence = confidence
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.hits = 1
+
+    def update(self, box, confidence, timestamp):
+        self.box = box
+        self.confidence = max(self.confidence, confidence)
+        self.last_seen = timestamp
+        self.hits += 1
+
+
+def _centers(boxes):
+    return (boxes[:, :2] + boxes[:, 2:]) / 2.0
+
+
+def _diagonals(boxes):
+    return np.hypot(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+
+
+class IoUTracker:
+    """
+    Link detections of consecutive frames into tracks.
+
+    Each frame's boxes are matched greedily to the live tracks of the same
+    class, best IoU first. Boxes left over (e.g. a small symbol that moved
+    further than its own width) are then matched by centroid distance,
+    measured in box diagonals and allowed to grow with every frame carried
+    over by `extend` since the last detection. Whatever is still unmatched
+    starts a new track, and tracks unseen for `max_gap_seconds` are retired.
+    """
+
+    def __init__(self, iou_threshold=0.3, max_center_distance=0.5, max_gap_seconds=DEFAULT_MAX_GAP_SECONDS):
+        """
+        Args:
+            iou_threshold (float): Least IoU for a box to continue a track.
+            max_center_distance (float): Largest centroid shift per frame, in box
+                diagonals, for the fallback match.
+            max_gap_seconds (float): How long a track survives without being seen.
+        """
+        self.iou_threshold = float(iou_threshold)
+        self.max_center_distance = float(max_center_distance)
+        self.max_gap_seconds = float(max_gap_seconds)
+        self.tracks = []
+        self._live = []
+        self._visible = []
+        self._carried = 0  # frames extended since the last update
+
+    def _match(self, live, boxes, max_distance):
+        # Greedy assignment over (track, box) pairs, IoU first, then centroid distance
+        track_boxes = np.array([track.box for track in live], dtype=np.float32).reshape(-1, 4)
+        iou = np.stack([box_iou(box, boxes) for box in track_boxes]) if len(live) else np.zeros((0, len(boxes)))
+        distance = np.linalg.norm(
+            _centers(track_boxes)[:, None, :] - _centers(boxes)[None, :, :], axis=2
+        ) / np.maximum((_diagonals(track_boxes)[:, None] + _diagonals(boxes)[None, :]) / 2.0, 1e-9)
+
+        pairs = []
+        used_tracks, used_boxes = set(), set()
+        for score, allowed in ((iou, iou >= self.iou_threshold),
+                               (-distance, distance <= max_distance)):
+            candidates = np.argwhere(allowed)
+            order = np.argsort(-score[allowed], kind="stable")
+            for t, b in candidates[order]:
+                if t in used_tracks or b in used_boxes:
+                    continue
+                used_tracks.add(t)
+                used_boxes.add(b)
+                pairs.append((t, b))
+        return pairs
+
+    def update(self, timestamp, class_ids, confidences, boxes):
+        """
+        Feed the kept detections of one processed frame.
+
+        Args:
+            timestamp (float): Video time of the frame, in seconds.
+            class_ids, confidences, boxes: Arrays of the frame's detections (xyxy boxes).
+        """
+        self._live = [
+            track for track in self._live if timestamp - track.last_seen <= self.max_gap_seconds
+        ]
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        # Objects may have moved on every skipped frame too
+        max_distance = self.max_center_distance * (1 + self._carried)
+        self._carried = 0
+        visible = []
+        for cls in np.unique(class_ids):
+            members = np.flatnonzero(class_ids == cls)
+            live = [track for track in self._live if track.class_id == cls]
+            matched = set()
+            for t, b in self._match(live, boxes[members], max_distance):
+                i = members[b]
+                live[t].update(boxes[i], float(confidences[i]), timestamp)
+                visible.append(live[t])
+                matched.add(b)
+            for b, i in enumerate(members):
+                if b in matched:
+                    continue
+                track = Track(len(self.tracks), int(cls), boxes[i], float(confidences[i]), timestamp)
+                self.tracks.append(track)
+                self._live.append(track)
+                visible.append(track)
+        self._visible = visible
+
+    def extend(self, timestamp):
+        """Carry the last processed frame's tracks over an unchanged frame without detecting."""
+        self._carried += 1
+        for track in self._visible:
+            track.last_seen = timestamp
+
+    def unique_counts(self, min_hits=1):
+        """Counter of class index -> number of tracks seen on at least `min_hits` frames."""
+        return Counter(track.class_id for track in self.tracks if track.hits >= min_hits)
+
+
+def track_video(video_path, infer_batch, engine, sampler=None, batch_size=8,
+                delta_threshold=DEFAULT_DELTA_THRESHOLD, min_hits=1, conf_threshold=None,
+                class_thresholds=None, on_progress=None, cache=None, **tracker_options):
+    """
+    Count unique watermark instances in a video instead of per-frame detections.
+
+    Sampled frames are taken in order. A frame whose thumbnail differs from
+    the last detected frame by less than `delta_threshold` is not sent to the
+    model at all; the tracks visible on that frame are simply extended to it.
+    Every other frame is detected (in batches) and its boxes are linked to the
+    running tracks by an IoUTracker.
+
+    Args:
+        video_path: Path of the video, or a readable binary file object.
+        infer_batch: Callable mapping a list of frames to one result per frame.
+        engine (DetectionEngine): Thresholds and class names.
+        sampler (FrameSampler): Frame selection; defaults to one frame per second.
+        batch_size (int): Frames read ahead per inference call.
+        delta_threshold (float): Content change (0-1) below which detection is skipped;
+            0 detects every sampled frame.
+        min_hits (int): Frames a track needs before it is reported.
+        conf_threshold (float): Optional request-level confidence threshold.
+        class_thresholds (dict): Optional class index -> threshold overrides.
+        on_progress: Optional callback(frames_processed, Counter of class index -> tracks).
+        cache (ResultCache): Optional cache of per-frame detections.
+        **tracker_options: Passed on to IoUTracker. `max_gap_seconds` defaults to
+            GAP_SAMPLES sampling intervals, and at least DEFAULT_MAX_GAP_SECONDS.
+
+    Returns:
+        Dictionary with "class_counts" (Counter of unique instances per class
+        index), "tracks" (Track objects that meet `min_hits`), "frames_processed",
+        "frames_detected" and the sampler statistics.
+
+    Raises:
+        ValueError: If `delta_threshold` is negative or not a number.
+    """
+    # NaN would compare false against every change and stop detection after the first frame
+    if not (math.isfinite(delta_threshold) and delta_threshold >= 0):
+        raise ValueError("delta must be a non-negative number")
+    if sampler is None:
+        sampler = FrameSampler(mode="interval", interval_seconds=1.0)
+    batch_size = max(1, int(batch_size))
+    if "max_gap_seconds" not in tracker_options:
+        spacing = sampler.scene_check_seconds if sampler.mode == "scene" else sampler.interval_seconds
+        tracker_options["max_gap_seconds"] = max(DEFAULT_MAX_GAP_SECONDS, GAP_SAMPLES * spacing)
+    tracker = IoUTracker(**tracker_options)
+    reference = None  # thumbnail of the last frame sent to the model
+    frames_processed = 0
+    frames_detected = 0
+
+    frames = timed_iter(sampler.frames(video_path), "frame_decode")
+    try:
+        while True:
+            batch = [sample for _, sample in zip(range(batch_size), frames)]
+            if not batch:
+                break
+
+            # Decide per frame, in order, whether it needs the model
+            detect = []
+            for sample in batch:
+                thumb = thumbnail(sample.image)
+                changed = reference is None or np.abs(thumb - reference).mean() >= delta_threshold
+                if changed:
+                    reference = thumb
+                detect.append(changed)
+
+            images = [sample.image for sample, changed in zip(batch, detect) if changed]
+            raw = iter(infer_with_cache(images, infer_batch, cache) if images else [])
+            for sample, changed in zip(batch, detect):
+                if not changed:
+                    tracker.extend(sample.timestamp)
+                    continue
+                _, class_ids, confidences, boxes = engine.filter_batch(
+                    [next(raw)], conf_threshold, class_thresholds
+                )
+                tracker.update(sample.timestamp, class_ids, confidences, boxes)
+            frames_processed += len(batch)
+            frames_detected += len(images)
+            if on_progress is not None:
+                on_progress(frames_processed, tracker.unique_counts(min_hits))
+    finally:
+        frames.close()
+
+    return {
+        "class_counts": tracker.unique_counts(min_hits),
+        "tracks": [track for track in tracker.tracks if track.hits >= min_hits],
+        "frames_processed": frames_processed,
+        "frames_detected": frames_detected,
+        "sampler": dict(sampler.stats),
+    }
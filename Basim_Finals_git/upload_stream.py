@@ -0,0 +1,220 @@
+import io
+import os
+import tempfile
+import threading
+
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+# Largest video body accepted and the chunk size used when spooling it
+MAX_VIDEO_BYTES = int(os.environ.get("MAX_VIDEO_BYTES", 8 * 1024 ** 3))
+CHUNK_SIZE = 1024 * 1024
+
+# MPEG-TS packet size; a transport stream is recognised by its sync byte repeating at this stride
+TS_PACKET_BYTES = 188
+
+# Bytes needed before the container type can be sniffed: three TS sync bytes
+HEADER_BYTES = 2 * TS_PACKET_BYTES + 1
+
+# Containers that can be demuxed while the rest of the file is still arriving
+STREAMABLE_CONTAINERS = {"matroska", "mpegts", "flv"}
+
+
+def sniff_video_container(header):
+    """
+    Identify a video container from the first bytes of the file.
+
+    Args:
+        header (bytes): At least the first HEADER_BYTES bytes of the upload.
+
+    Returns:
+        A short container name ("mp4", "matroska", "avi", "mpegts", "flv") or None.
+    """
+    if len(header) >= 12 and header[4:8] in (b"ftyp", b"moov", b"mdat", b"free", b"wide", b"skip"):
+        return "mp4"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return "matroska"
+    if header[:4] == b"RIFF" and header[8:12] == b"AVI ":
+        return "avi"
+    if header[:3] == b"FLV":
+        return "flv"
+    # A lone leading "G" is far too weak, so require the sync byte on three consecutive packets
+    if len(header) >= HEADER_BYTES and all(header[i] == 0x47 for i in range(0, HEADER_BYTES, TS_PACKET_BYTES)):
+        return "mpegts"
+    return None
+
+
+class SpooledVideoUpload:
+    """
+    Uniquely named temporary file that an upload is streamed into.
+
+    It is written chunk by chunk (directly from the request body, or by
+    Werkzeug's multipart parser, which uses it as the file container), checks
+    the container header as soon as the first bytes land and can hand out
+    readers that block until more bytes arrive, so decoding can start while
+    the upload is still in flight.
+    """
+
+    def __init__(self, max_bytes=MAX_VIDEO_BYTES, suffix=".video"):
+        # mkstemp gives every upload its own file, so concurrent requests never collide
+        fd, self.path = tempfile.mkstemp(prefix="upload_", suffix=suffix)
+        self._file = os.fdopen(fd, "wb")
+        self.max_bytes = max_bytes
+        self.container = None
+        self.bytes_written = 0
+        self.error = None
+        self._header = b""
+        self._finished = False
+        self._cond = threading.Condition()
+
+    # Writer side --------------------------------------------------------
+
+    def writable(self):
+        return True
+
+    def write(self, chunk):
+        if self.error is not None:
+            raise self.error
+        if self.bytes_written + len(chunk) > self.max_bytes:
+            self.fail(RequestEntityTooLarge(f"Video exceeds {self.max_bytes} bytes"))
+            raise self.error
+
+        if self.container is None:
+            self._header += bytes(chunk[:HEADER_BYTES - len(self._header)])
+            if len(self._header) >= HEADER_BYTES:
+                self.container = sniff_video_container(self._header)
+                if self.container is None:
+                    self.fail(UnsupportedMediaType("Upload is not a recognised video container"))
+                    raise self.error
+
+        self._file.write(chunk)
+        self._file.flush()
+        with self._cond:
+            self.bytes_written += len(chunk)
+            self._cond.notify_all()
+        return len(chunk)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        # Werkzeug rewinds the container once the part is complete; nothing to do
+        return 0
+
+    def copy_from(self, stream, chunk_size=CHUNK_SIZE):
+        """Spool a raw request body into the file, then mark the upload finished."""
+        try:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                self.write(chunk)
+        except Exception as exc:
+            # Recorded on the upload; readers and waiters re-raise it
+            self.fail(exc)
+            return
+        self.finish()
+
+    def finish(self):
+        """Mark the upload complete, rejecting bodies too short to hold a header."""
+        if self.container is None and self.error is None:
+            self.container = sniff_video_container(self._header)
+            if self.container is None:
+                self.error = UnsupportedMediaType("Upload is not a recognised video container")
+        with self._cond:
+            self._finished = True
+            self._cond.notify_all()
+
+    def fail(self, error):
+        """Abort the upload; pending and future reads and writes raise `error`."""
+        with self._cond:
+            if self.error is None:
+                self.error = error
+            self._finished = True
+            self._cond.notify_all()
+
+    # Reader side --------------------------------------------------------
+
+    @property
+    def finished(self):
+        return self._finished
+
+    def wait_for_header(self, timeout=None):
+        """Block until the container type is known or the upload has failed."""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.container is not None or self.error is not None or self._finished,
+                timeout,
+            )
+        if self.error is not None:
+            raise self.error
+        return self.container
+
+    def wait_until_finished(self, timeout=None):
+        """Block until every byte of the upload has been written."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._finished, timeout)
+        if self.error is not None:
+            raise self.error
+
+    def reader(self):
+        """Return a file-like reader that blocks at the current end of the upload."""
+        return _GrowingFileReader(self)
+
+    def discard(self):
+        """Close and delete the spooled file."""
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        # Werkzeug closes request files at teardown; the spool outlives that
+        pass
+
+
+class _GrowingFileReader(io.RawIOBase):
+    """Seekable reader over a SpooledVideoUpload that waits for bytes still in flight."""
+
+    def __init__(self, upload):
+        super().__init__()
+        self._upload = upload
+        self._file = open(upload.path, "rb")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _wait_for(self, end):
+        upload = self._upload
+        with upload._cond:
+            upload._cond.wait_for(lambda: upload.bytes_written >= end or upload.finished)
+        if upload.error is not None:
+            raise upload.error
+        return upload.bytes_written
+
+    def readinto(self, buffer):
+        available = self._wait_for(self._pos + 1)
+        size = min(len(buffer), available - self._pos)
+        if size <= 0:
+            return 0
+        self._file.seek(self._pos)
+        read = self._file.readinto(memoryview(buffer)[:size])
+        self._pos += read
+        return read
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_END:
+            # The end is only known once the upload is complete
+            self._upload.wait_until_finished()
+            self._pos = self._upload.bytes_written + offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = offset
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._file.close()
+        super().close()
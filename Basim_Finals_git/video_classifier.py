@@ -0,0 +1,91 @@
+from collections import Counter
+
+import numpy as np
+
+from frame_sampler import FrameSampler
+from metrics import timed_iter
+from video_pipeline import infer_with_cache
+
+
+def classify_video(video_path, infer_batch, engine, interval_seconds=1.0, min_hits=3,
+                   conf_threshold=None, class_thresholds=None, batch_size=4,
+                   on_progress=None, cache=None):
+    """
+    Find which watermark class a video carries, stopping as soon as one is confirmed.
+
+    Frames on the `interval_seconds` grid are visited coarse to fine (start,
+    end, middle, then bisections). A class is confirmed once it has been
+    detected above its threshold on `min_hits` distinct frames, and decoding
+    stops right there. Without a confirmation the whole grid is scanned and the
+    most frequently seen class, if any, is reported unconfirmed.
+
+    Args:
+        video_path: Path of a seekable video file.
+        infer_batch: Callable mapping a list of frames to one result per frame.
+        engine (DetectionEngine): Thresholds and class names.
+        interval_seconds (float): Spacing of the candidate frames.
+        min_hits (int): Distinct frames a class needs to be confirmed.
+        conf_threshold (float): Optional request-level confidence threshold.
+        class_thresholds (dict): Optional class index -> threshold overrides.
+        batch_size (int): Frames per inference call; smaller exits sooner.
+        on_progress: Optional callback(frames_processed, Counter of class index -> hits).
+        cache (ResultCache): Optional cache of per-frame detections.
+
+    Returns:
+        Dictionary with "class" (name or None), "confirmed", "confidence" (mean of
+        the class's best per-frame confidence over its hits), "first_hit_seconds"
+        (earliest video time among those hits), "hits" and "frames_processed".
+    """
+    sampler = FrameSampler(mode="coarse", interval_seconds=interval_seconds)
+    min_hits = max(1, int(min_hits))
+    hits = {}  # class index -> list of (timestamp, best confidence on that frame)
+    winner = None
+    frames_processed = 0
+
+    frames = timed_iter(sampler.frames(video_path), "frame_decode")
+    try:
+        while winner is None:
+            batch = [sample for _, sample in zip(range(batch_size), frames)]
+            if not batch:
+                break
+            raw = infer_with_cache([sample.image for sample in batch], infer_batch, cache)
+
+            # Best confidence of every class on every frame of the batch
+            image_index, class_ids, confidences, _ = engine.filter_batch(
+                raw, conf_threshold, class_thresholds
+            )
+            best = np.zeros((len(batch), engine.num_classes), dtype=np.float32)
+            np.maximum.at(best, (image_index, class_ids), confidences)
+            for frame, cls in zip(*np.nonzero(best)):
+                hits.setdefault(int(cls), []).append((batch[frame].timestamp, float(best[frame, cls])))
+
+            frames_processed += len(batch)
+            if on_progress is not None:
+                on_progress(frames_processed, Counter({cls: len(h) for cls, h in hits.items()}))
+
+            confirmed = [cls for cls, h in hits.items() if len(h) >= min_hits]
+            if confirmed:
+                winner = max(confirmed, key=lambda cls: (len(hits[cls]), sum(c for _, c in hits[cls])))
+    finally:
+        # Closing the generator releases the capture without decoding further
+        frames.close()
+
+    result = {
+        "class": None,
+        "confirmed": winner is not None,
+        "confidence": 0.0,
+        "first_hit_seconds": None,
+        "hits": 0,
+        "frames_processed": frames_processed,
+    }
+    if winner is None and hits:
+        winner = max(hits, key=lambda cls: (len(hits[cls]), sum(c for _, c in hits[cls])))
+    if winner is not None:
+        class_hits = hits[winner]
+        result.update({
+            "class": engine.class_names[winner],
+            "confidence": round(sum(c for _, c in class_hits) / len(class_hits), 4),
+            "first_hit_seconds": round(min(t for t, _ in class_hits), 3),
+            "hits": len(class_hits),
+        })
+    return result
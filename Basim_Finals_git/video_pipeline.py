@@ -0,0 +1,195 @@
+from collections import Counter
+import queue
+import threading
+
+import numpy as np
+
+from detection import raw_detections
+from frame_sampler import FrameSampler
+from metrics import stage_timer, timed_iter
+from result_cache import content_key
+
+# Marks the end of a stage's output on a queue
+_DONE = object()
+
+
+def infer_with_cache(images, infer_batch, cache):
+    """Serve repeated or near-identical frames from the cache, infer the rest in one batch."""
+    raw = [None] * len(images)
+    keys = [None] * len(images)
+    if cache is not None:
+        with stage_timer("frame_cache"):
+            for i, image in enumerate(images):
+                keys[i] = content_key(image)
+                raw[i] = cache.get(keys[i])
+                if raw[i] is None:
+                    raw[i] = cache.get_similar(image)
+
+    misses = [i for i, value in enumerate(raw) if value is None]
+    if misses:
+        fingerprint = cache.fingerprint if cache is not None else None
+        with stage_timer("frame_inference"):
+            results = infer_batch([images[i] for i in misses])
+        for i, result in zip(misses, results):
+            raw[i] = raw_detections(result)
+            if cache is not None:
+                cache.put(keys[i], raw[i], image=images[i], fingerprint=fingerprint)
+    return raw
+
+
+def _to_counter(totals):
+    return Counter({index: int(n) for index, n in enumerate(totals) if n})
+
+
+def _put(q, item, stop):
+    # Blocking put that gives up once the pipeline is being torn down
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    # Blocking get that returns _DONE once the pipeline is being torn down
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def process_video_pipelined(
+    video_path, infer_batch, engine, sampler=None, batch_size=8, num_workers=2,
+    queue_size=16, conf_threshold=None, class_thresholds=None, keep_detections=False,
+    on_progress=None, cache=None
+):
+    """
+    Run decoding, inference and aggregation of a video as concurrent stages.
+
+    A decoder thread pushes sampled frames into a bounded queue, inference
+    workers pull them off in batches, and the calling thread folds each batch
+    into a running Counter. The bounded queues give backpressure, so at most
+    `queue_size` decoded frames are held in memory however long the video is.
+
+    Args:
+        video_path (str): Path to the video file.
+        infer_batch: Callable taking a list of frames and returning one YOLO result per frame.
+        engine (DetectionEngine): Shared thresholding and counting.
+        sampler (FrameSampler): Frame selection; defaults to one frame per second.
+        batch_size (int): Largest number of frames per inference call.
+        num_workers (int): Number of inference worker threads.
+        queue_size (int): Capacity of the decoded-frame queue.
+        conf_threshold (float): Minimum confidence; defaults to the engine's threshold.
+        class_thresholds (dict): Optional class index -> threshold overrides.
+        keep_detections (bool): Also return every (class index, confidence) pair.
+        on_progress: Optional callback(frames_processed, class_counts) run after each batch.
+        cache (ResultCache): Optional cache consulted before running the model on a frame.
+
+    Returns:
+        Dictionary with the class index Counter, number of frames processed,
+        the sampler statistics and, if requested, the raw detections.
+
+    Raises:
+        IOError: If the video cannot be opened.
+    """
+    if sampler is None:
+        sampler = FrameSampler(mode="interval", interval_seconds=1.0)
+    num_workers = max(1, int(num_workers))
+    batch_size = max(1, int(batch_size))
+
+    frames_q = queue.Queue(maxsize=max(1, int(queue_size)))
+    results_q = queue.Queue(maxsize=num_workers * 2)
+    stop = threading.Event()
+
+    def decode():
+        try:
+            for sample in timed_iter(sampler.frames(video_path), "frame_decode"):
+                if not _put(frames_q, sample, stop):
+                    return
+        except Exception as exc:
+            _put(results_q, exc, stop)
+        finally:
+            for _ in range(num_workers):
+                _put(frames_q, _DONE, stop)
+
+    def infer():
+        try:
+            while True:
+                first = _get(frames_q, stop)
+                if first is _DONE:
+                    return
+                batch = [first]
+                finished = False
+                while len(batch) < batch_size:
+                    try:
+                        sample = frames_q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if sample is _DONE:
+                        finished = True
+                        break
+                    batch.append(sample)
+
+                raw = infer_with_cache([sample.image for sample in batch], infer_batch, cache)
+
+                # The whole batch is thresholded and counted in one vectorised pass
+                _, class_ids, confidences, _ = engine.filter_batch(raw, conf_threshold, class_thresholds)
+                counts = np.bincount(class_ids, minlength=engine.num_classes)
+                detections = None
+                if keep_detections:
+                    detections = list(zip(class_ids.tolist(), confidences.tolist()))
+                if not _put(results_q, (len(batch), counts, detections), stop) or finished:
+                    return
+        except Exception as exc:
+            _put(results_q, exc, stop)
+        finally:
+            _put(results_q, _DONE, stop)
+
+    threads = [threading.Thread(target=decode, name="video-decode", daemon=True)]
+    threads += [
+        threading.Thread(target=infer, name=f"video-infer-{i}", daemon=True)
+        for i in range(num_workers)
+    ]
+    for thread in threads:
+        thread.start()
+
+    # Streaming aggregation on the caller's thread
+    totals = np.zeros(engine.num_classes, dtype=np.int64)
+    all_detections = [] if keep_detections else None
+    frames_processed = 0
+    workers_left = num_workers
+    error = None
+    try:
+        while workers_left:
+            item = results_q.get()
+            if item is _DONE:
+                workers_left -= 1
+                continue
+            if isinstance(item, Exception):
+                error = item
+                break
+            count, counts, detections = item
+            frames_processed += count
+            totals += counts
+            if keep_detections:
+                all_detections.extend(detections)
+            if on_progress is not None:
+                on_progress(frames_processed, _to_counter(totals))
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    if error is not None:
+        raise error
+
+    return {
+        "class_counts": _to_counter(totals),
+        "frames_processed": frames_processed,
+        "sampler": dict(sampler.stats),
+        "detections": all_detections,
+    }